@@ -0,0 +1,349 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")  # "memory" or "sqlite" (shared by all workers)
+ADMISSION_PATH = os.getenv("ADMISSION_PATH", os.path.join(BASE_DIR, "admission.sqlite3"))
+# Per-sender token bucket: a voice reply costs VOICE_REPLY_COST tokens, a text-only reply 1
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "10"))
+USER_BURST = float(os.getenv("USER_BURST", "6"))
+VOICE_REPLY_COST = float(os.getenv("VOICE_REPLY_COST", "2"))
+ADMISSION_MAX_USERS = int(os.getenv("ADMISSION_MAX_USERS", "100000"))
+# Messages in flight per upstream, across the process (memory) or the host (sqlite)
+UPSTREAM_LIMITS = {
+    "gemini": int(os.getenv("ADMISSION_GEMINI_LIMIT", "16")),
+    "sarvam": int(os.getenv("ADMISSION_SARVAM_LIMIT", "32")),
+    "twilio": int(os.getenv("ADMISSION_TWILIO_LIMIT", "32")),
+}
+# A permit held longer than this is assumed leaked by a crashed worker (sqlite backend)
+ADMISSION_PERMIT_LEASE = float(os.getenv("ADMISSION_PERMIT_LEASE", "120"))
+
+# Degradation ladder, cheapest first
+FULL = "full"            # Text and voice reply
+TEXT_ONLY = "text_only"  # Skip TTS
+QUEUED = "queued"        # Reply later from a background worker
+REJECTED = "rejected"    # Turn the message away
+
+# Upstreams a spoken reply needs (TTS, then the Twilio media message)
+VOICE_UPSTREAMS = ("sarvam", "twilio")
+
+
+class MemoryStore:
+    """Per-process token buckets and permit counts."""
+
+    blocking = False  # Safe to call from an event loop
+
+    def __init__(self, max_users=ADMISSION_MAX_USERS):
+        self.max_users = max_users
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._in_flight = {}  # upstream -> permits held
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """Takes cost tokens from key's bucket if it has them. Returns True if granted."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            granted = tokens >= cost
+            if granted:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # A forgotten sender starts again with a full bucket
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+            return granted
+
+    def acquire(self, upstream, limit, lease):
+        """Takes a permit for upstream if fewer than limit are held. Returns the permit id or None."""
+        with self._lock:
+            held = self._in_flight.get(upstream, 0)
+            if held >= limit:
+                return None
+            self._in_flight[upstream] = held + 1
+            return upstream
+
+    def release(self, upstream, permit):
+        with self._lock:
+            self._in_flight[upstream] = max(0, self._in_flight.get(upstream, 0) - 1)
+
+    def in_flight(self, upstream):
+        with self._lock:
+            return self._in_flight.get(upstream, 0)
+
+
+class SQLiteStore:
+    """On-disk buckets and permits shared by every worker process on the host."""
+
+    blocking = True  # Disk I/O and file locks; async callers use a thread
+
+    def __init__(self, path=ADMISSION_PATH, max_users=ADMISSION_MAX_USERS):
+        self.path = path
+        self.max_users = max_users
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS permits (id TEXT PRIMARY KEY, upstream TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS permits_upstream ON permits (upstream, expires_at)")
+
+    def _connect(self):
+        # One connection per thread and process (a forked gunicorn worker must not reuse its parent's)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, cost, rate, burst):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            granted = tokens >= cost
+            if granted:
+                tokens -= cost
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._trim(conn, now, burst / rate if rate > 0 else 0)
+        return granted
+
+    def acquire(self, upstream, limit, lease):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM permits WHERE upstream = ? AND expires_at < ?", (upstream, now))
+            held = conn.execute("SELECT COUNT(*) FROM permits WHERE upstream = ?", (upstream,)).fetchone()[0]
+            permit = None
+            if held < limit:
+                permit = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO permits (id, upstream, expires_at) VALUES (?, ?, ?)", (permit, upstream, now + lease)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return permit
+
+    def release(self, upstream, permit):
+        self._connect().execute("DELETE FROM permits WHERE id = ?", (permit,))
+
+    def in_flight(self, upstream):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM permits WHERE upstream = ? AND expires_at >= ?", (upstream, time.time())
+        ).fetchone()[0]
+
+    def _trim(self, conn, now, refill_seconds):
+        # A bucket untouched for a full refill is the same as no bucket
+        conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - refill_seconds,))
+        conn.execute(
+            "DELETE FROM buckets WHERE key IN ("
+            "SELECT key FROM buckets ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_users,)
+        )
+
+
+def create_store(name=ADMISSION_BACKEND):
+    """Builds an admission store by name."""
+    if name == "memory":
+        return MemoryStore()
+    if name == "sqlite":
+        return SQLiteStore()
+    raise ValueError(f"Unknown admission backend: {name}")
+
+
+class Ticket:
+    """Admission outcome; holds its upstream permits until released (usable as a context manager)."""
+
+    __slots__ = ("level", "reason", "_controller", "_permits")
+
+    def __init__(self, level, reason=None, controller=None, permits=None):
+        self.level = level
+        self.reason = reason
+        self._controller = controller
+        self._permits = permits or []
+
+    @property
+    def voice(self):
+        return self.level == FULL
+
+    def release(self, *upstreams):
+        """Releases the permits held for upstreams (every permit when none are named)."""
+        permits = self._take(upstreams)
+        if permits:
+            self._controller._release(permits)
+
+    def _take(self, upstreams):
+        if not upstreams:
+            permits, self._permits = self._permits, []
+            return permits
+        permits = [permit for permit in self._permits if permit[0] in upstreams]
+        self._permits = [permit for permit in self._permits if permit[0] not in upstreams]
+        return permits
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    async def release_async(self, *upstreams):
+        """release() for event-loop callers."""
+        permits = self._take(upstreams)
+        if permits:
+            await self._controller._off_loop(self._controller._release, permits)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release_async()
+
+
+class AdmissionController:
+    """
+    Decides how much work an incoming message may cost.
+
+    A sender over their rate first loses voice replies, then is rejected. Globally,
+    busy voice upstreams (Sarvam, Twilio) turn replies text-only, a full Gemini
+    sends messages to the queue, and the caller rejects when the queue is full too.
+    """
+
+    def __init__(self, store=None, rate_per_minute=USER_RATE_PER_MINUTE, burst=USER_BURST,
+                 voice_cost=VOICE_REPLY_COST, limits=None, lease=ADMISSION_PERMIT_LEASE):
+        self.store = store or create_store()
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.voice_cost = voice_cost
+        self.limits = dict(UPSTREAM_LIMITS if limits is None else limits)
+        self.lease = lease
+
+    def admit(self, user, upstreams=("gemini",), voice=True):
+        """
+        Admits one message.
+
+        :param user: Sender (the From number); falsy senders skip the rate limit
+        :param upstreams: Upstreams the message holds a permit for while it is processed
+        :param voice: The message would normally get a spoken reply
+        :return: Ticket; release it (or use it in a with block) when processing ends
+        """
+        level, reason = (FULL if voice else TEXT_ONLY), None
+        if user:
+            if voice and self.store.take(user, self.voice_cost, self.rate, self.burst):
+                pass
+            elif self.store.take(user, 1, self.rate, self.burst):
+                if voice:
+                    level, reason = TEXT_ONLY, "user_rate"
+            else:
+                return self._decided(Ticket(REJECTED, "user_rate"))
+
+        permits = self._acquire(upstreams)
+        if permits is None:
+            return self._decided(Ticket(QUEUED, "upstream_busy"))
+
+        # The message's own permits (Sarvam for ASR) are handed back before its voice leg starts
+        held = [upstream for upstream, _ in permits]
+        if level == FULL and any(
+            self.store.in_flight(upstream) - held.count(upstream) >= self.limits[upstream]
+            for upstream in VOICE_UPSTREAMS if upstream in self.limits
+        ):
+            level, reason = TEXT_ONLY, "voice_busy"
+        return self._decided(Ticket(level, reason, self, permits))
+
+    async def admit_async(self, user, upstreams=("gemini",), voice=True):
+        """admit() for event-loop callers; release the ticket with async with."""
+        return await self._off_loop(self.admit, user, upstreams, voice)
+
+    @contextmanager
+    def permit(self, *upstreams):
+        """
+        Holds permits for a background leg, yielding False if any upstream is saturated.
+
+        with controller.permit("sarvam", "twilio") as granted: ...
+        """
+        permits = self._acquire(upstreams)
+        try:
+            yield permits is not None
+        finally:
+            if permits:
+                self._release(permits)
+
+    @asynccontextmanager
+    async def permit_async(self, *upstreams):
+        """permit() for event-loop callers: async with controller.permit_async(...) as granted: ..."""
+        permits = await self._off_loop(self._acquire, upstreams)
+        try:
+            yield permits is not None
+        finally:
+            if permits:
+                await self._off_loop(self._release, permits)
+
+    async def _off_loop(self, func, *args):
+        # A SQLite store would stall the event loop on disk I/O or another process's write lock
+        if self.store.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def _acquire(self, upstreams):
+        permits = []
+        for upstream in upstreams:
+            limit = self.limits.get(upstream)
+            if limit is None:
+                continue
+            permit = self.store.acquire(upstream, limit, self.lease)
+            if permit is None:
+                metrics.inc("admission_saturated_total", upstream=upstream)
+                self._release(permits)
+                return None
+            permits.append((upstream, permit))
+            metrics.set_gauge("admission_in_flight", self.store.in_flight(upstream), upstream=upstream)
+        return permits
+
+    def _release(self, permits):
+        for upstream, permit in permits:
+            self.store.release(upstream, permit)
+            metrics.set_gauge("admission_in_flight", self.store.in_flight(upstream), upstream=upstream)
+
+    def _decided(self, ticket):
+        metrics.inc("admission_total", level=ticket.level, reason=ticket.reason or "ok")
+        return ticket
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """Returns the process-wide admission controller."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
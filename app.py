@@ -1,233 +1,133 @@
 import os 
-import requests
-import uuid
-import socket
-import subprocess
 import time
-import shutil
 import base64
-from flask import Flask, request, send_from_directory, jsonify
+import threading
+from contextlib import ExitStack, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
 from twilio.twiml.messaging_response import MessagingResponse
 from twilio.rest import Client
-import google.generativeai as genai  # Gemini AI integration
-from gemini_chatbot import check_loan_eligibility, gemini_loan_insights
-import boto3
+from twilio.http.http_client import TwilioHttpClient
 from flask_cors import CORS
 
 
 
 load_dotenv()
 
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION = os.getenv("AWS_REGION", "us-east-1")  # Default to us-east-1
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")  # Your S3 bucket name
-
-# Initialize S3 client
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
+# Local modules read their settings from the environment at import, so load .env first
+from gemini_chatbot import check_loan_eligibility, gemini_loan_insights
+# Settings, credentials, language tables, prompts and the S3 upload path shared with asgi_app.py
+from chatbot_core import (
+    ADMISSION_CONTROL, HELP_TEXT, LANGUAGE_DETECT_HEDGE, LANGUAGE_MAP, SARVAM_API_KEY, STATIC_PHRASES,
+    TTS_MODEL, TTS_SAMPLE_RATE, TTS_SPEAKER, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, WEBHOOK_DEDUPE,
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WHATSAPP_AUDIO_FORMAT, build_chat_prompt, chatbot_response,
+    conversation_history, emi_batch_response, is_help_command, message_upstreams, no_response_message,
+    remember_exchange, tts_cache_key, tts_language_code, upload_tts_audio, voice_available, voice_permit,
+    wants_voice,
 )
+import admission
+import app_logging
+import canned_responses
+import circuit_breaker
+import db_connector
+import dedupe
+import gemini_client  # Gemini AI integration
+import http_client
+import job_queue
+import language_detect
+import metrics
+import pipeline
+import sarvam_asr
+import transcoder
+import translation_service
+import tts_cache
+
+log = app_logging.get_logger("app")
 
 app = Flask(__name__)
-SARVAM_API_KEY = os.getenv("SARVAM_API_KEY")
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")  # Gemini API key
 NGROK_URL = os.getenv("NGROK_URL", "")  # Optional ngrok URL for local development
-CORS(app, origins=["https://www.stratolending.com"])
 
-# Get the base directory of the application
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Webhook processing mode: "sync" runs the pipeline in the request, "queue" hands it to background workers
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "sync").lower()
+WEBHOOK_QUEUE_BACKEND = os.getenv("WEBHOOK_QUEUE_BACKEND", "local")
 
-# Validate environment variables
-if not SARVAM_API_KEY:
-    raise ValueError("SARVAM_API_KEY is not set.")
-if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
-    raise ValueError("Twilio credentials are not set.")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY is not set.")
+# Stream Gemini replies and start TTS per sentence instead of waiting for the whole reply
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "").lower() in ("1", "true", "yes")
+STREAM_MIN_SENTENCE_CHARS = int(os.getenv("STREAM_MIN_SENTENCE_CHARS", "20"))
+STREAM_TTS_WORKERS = int(os.getenv("STREAM_TTS_WORKERS", "8"))
 
-# Configure Gemini API
-genai.configure(api_key=GEMINI_API_KEY)
-genai.configured = True
+# Threads for the per-message stage graphs: foreground stages (language, Gemini) and,
+# separately, background audio legs, so slow TTS/S3/Twilio work never delays a text reply
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "16"))
+PIPELINE_BACKGROUND_WORKERS = int(os.getenv("PIPELINE_BACKGROUND_WORKERS", "16"))
 
-# Initialize Twilio client
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+CORS(app, origins=["https://www.stratolending.com"])
 
-# Check internet connectivity
-try:
-    socket.gethostbyname('www.google.com')
-    print("Internet connectivity test successful")
-except Exception as e:
-    print(f"Internet connectivity test failed: {str(e)}")
+# Initialize Twilio client on a keep-alive HTTP client with a timeout
+twilio_client = Client(
+    TWILIO_ACCOUNT_SID,
+    TWILIO_AUTH_TOKEN,
+    http_client=TwilioHttpClient(
+        pool_connections=True,
+        timeout=http_client.HTTP_READ_TIMEOUT,
+        max_retries=http_client.HTTP_MAX_RETRIES
+    )
+)
 
-def chatbot_response(message):
-    # Temporary response logic (replace with Gemini / LangChain)
-    return f"You said: {message}. I'll calculate your loan options soon!"
+_pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+_background_executor = ThreadPoolExecutor(max_workers=PIPELINE_BACKGROUND_WORKERS, thread_name_prefix="pipeline-bg")
 
+# Sentence clips are synthesized in parallel; each reply's clips are sent one at a time, in order
+_stream_tts_executor = ThreadPoolExecutor(max_workers=STREAM_TTS_WORKERS, thread_name_prefix="stream-tts")
+_stream_send_executor = ThreadPoolExecutor(max_workers=STREAM_TTS_WORKERS, thread_name_prefix="stream-send")
 
 
 def download_audio(url, message_sid):
-    """Downloads an audio file from the given Twilio media URL."""
+    """Downloads an audio file from the given Twilio media URL into memory."""
     try:
-        print(f"Attempting to download audio from: {url}")
-
-        response = requests.get(url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
+        with metrics.stage("download"):
+            response = http_client.get(
+                url,
+                endpoint="twilio.media",
+                auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+            )
 
-        print(f"HTTP Status Code: {response.status_code}")
         if response.status_code != 200:
-            print(f"Response Text: {response.text}")
+            log.error("audio_download_failed", sid=message_sid, status=response.status_code, body=response.text[:200])
             return None
 
-        # Save the file with a unique name based on the message SID
-        temp_dir = os.path.join(BASE_DIR, "temp")
-        os.makedirs(temp_dir, exist_ok=True)
-
-        file_path = os.path.join(temp_dir, f"audio_file_{message_sid}_{uuid.uuid4()}.mp4")
-        with open(file_path, "wb") as file:
-            file.write(response.content)
-
-        print(f"Audio file successfully saved at: {file_path}")
-        return file_path
+        log.info("audio_downloaded", sampled=True, sid=message_sid, bytes=len(response.content))
+        return response.content
 
     except Exception as e:
-        print(f"Error downloading audio: {str(e)}")
+        log.error("audio_download_error", sid=message_sid, error=str(e))
         return None
 
 
-def convert_audio(input_path):
-    """Converts an audio file to WAV format (16kHz, mono)."""
+def transcribe_audio(audio_bytes, language_code="auto"):
+    """Transcribes in-memory audio with the Sarvam speech-to-text API."""
     try:
-        output_path = os.path.splitext(input_path)[0] + ".wav"
-        print(f"Converting {input_path} to {output_path}")
-        
-        # Check if ffmpeg is installed and in PATH
-        ffmpeg_command = None
-        
-        # Try standard command first
-        if shutil.which("ffmpeg") is not None:
-            ffmpeg_command = "ffmpeg"
-        else:
-            # Common Windows ffmpeg locations
-            potential_paths = [
-                r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
-                r"C:\ffmpeg\bin\ffmpeg.exe",
-                r"C:\ProgramData\chocolatey\bin\ffmpeg.exe",
-                os.path.join(BASE_DIR, "ffmpeg", "bin", "ffmpeg.exe"),
-                os.path.join(BASE_DIR, "ffmpeg.exe")
-            ]
-            
-            for path in potential_paths:
-                if os.path.exists(path):
-                    ffmpeg_command = f'"{path}"'  # Quote the path in case it contains spaces
-                    print(f"Found ffmpeg at: {path}")
-                    break
-        
-        if not ffmpeg_command:
-            print("ffmpeg not found. Please install ffmpeg or add it to PATH.")
-            print("Download ffmpeg from: https://ffmpeg.org/download.html")
-            print("You can also place ffmpeg.exe in the same directory as this script.")
-            return None
-            
-        # Build the complete command with quotes around paths (important for Windows paths with spaces)
-        command = f'{ffmpeg_command} -i "{input_path}" -ar 16000 -ac 1 -c:a pcm_s16le "{output_path}"'
-        print(f"Running command: {command}")
-        
-        # Use shell=True for complex command with paths on Windows
-        process = subprocess.run(
-            command,
-            shell=True,  # Using shell to handle paths with spaces properly
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=False  # Don't raise exception on non-zero exit
-        )
-        
-        if process.returncode != 0:
-            print(f"ffmpeg stderr: {process.stderr.decode('utf-8')}")
-            print(f"ffmpeg failed with return code: {process.returncode}")
-            return None
-            
-        # Verify the file was created
-        if os.path.exists(output_path):
-            print(f"Successfully converted to: {output_path}")
-            return output_path
-        else:
-            print(f"Output file not found after conversion: {output_path}")
+        # Convert (or resample) to 16kHz mono WAV for the Sarvam API
+        with metrics.stage("convert"):
+            wav_bytes = transcoder.to_asr_wav(audio_bytes)
+        if not wav_bytes:
+            log.error("audio_conversion_failed", bytes=len(audio_bytes))
             return None
-            
-    except Exception as e:
-        print(f"Exception in convert_audio: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
-
 
-def transcribe_audio(file_path, language_code="auto"):
-    """Calls test_sarvam_api.py to transcribe the audio."""
-    try:
-        # Ensure we're using absolute paths
-        abs_file_path = os.path.abspath(file_path)
-        script_path = os.path.join(BASE_DIR, "test_sarvam_api.py")
-        
-        print(f"Processing file at absolute path: {abs_file_path}")
-        print(f"Using script at: {script_path}")
-        
-        # Check if file exists
-        if not os.path.exists(abs_file_path):
-            print(f"Error: Audio file does not exist at path: {abs_file_path}")
-            return None
-            
-        # Convert to WAV format if needed
-        file_name, file_ext = os.path.splitext(abs_file_path)
-        wav_path = f"{file_name}.wav"
-        
-        # Convert to WAV if it's not already
-        if file_ext.lower() != '.wav':
-            print(f"Converting {file_ext} file to WAV: {wav_path}")
-            wav_path = convert_audio(abs_file_path)
-            if not wav_path:
-                print("Failed to convert audio to WAV format")
-                return None
-            
-        # Double-check file exists after conversion
-        if not os.path.exists(wav_path):
-            print(f"Error: WAV file does not exist after conversion: {wav_path}")
-            return None
-        
-        print(f"Starting transcription of file: {wav_path}")
-        
-        # Create appropriate environment for subprocess
-        env = os.environ.copy()
-        env["SARVAM_API_KEY"] = SARVAM_API_KEY
-        
-        # Now pass the file to the script via command line arguments
-        result = subprocess.run(
-            ["python", script_path, "--file", wav_path, "--language", language_code],
-            capture_output=True,
-            text=True,
-            env=env
-        )
-        
-        print(f"Subprocess return code: {result.returncode}")
-        print(f"Subprocess stdout: {result.stdout}")
-        print(f"Subprocess stderr: {result.stderr}")
-        
-        if result.returncode == 0 and result.stdout.strip():
-            return result.stdout.strip()
-        else:
-            print(f"Transcription failed: {result.stderr}")
-            return None
+        with metrics.stage("transcribe"):
+            result = sarvam_asr.transcribe_wav_bytes(wav_bytes, language_code, api_key=SARVAM_API_KEY)
+        if result:
+            log.info("audio_transcribed", sampled=True, bytes=len(wav_bytes), seconds=round(result.timings["total"], 3),
+                     language=result.language_code, confidence=result.confidence)
+        return result
     except Exception as e:
-        print(f"Error in transcribe_audio: {str(e)}")
+        log.error("transcribe_error", error=str(e))
         return None
 
 
-def detect_language(text):
-    """Detects the language of the given text using Sarvam API."""
+def detect_language_api(text):
+    """Detects the language of the given text using Sarvam API. Returns None on failure."""
     try:
         url = "https://api.sarvam.ai/translate"
         
@@ -242,92 +142,68 @@ def detect_language(text):
             "api-subscription-key": SARVAM_API_KEY
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = http_client.post(url, endpoint="sarvam.detect", headers=headers, json=payload)
         
         if response.status_code == 200:
             response_json = response.json()
             detected_language = response_json.get("source_language_code", "en-IN")
-            print(f"Detected language: {detected_language}")
-            
-            # Map the detected language to appropriate TTS language code
-            language_map = {
-                "en": "en-IN",
-                "hi": "hi-IN",
-                "ta": "ta-IN",
-                "te": "te-IN",
-                "kn": "kn-IN",
-                "ml": "ml-IN",
-                "bn": "bn-IN",
-                "gu": "gu-IN",
-                "mr": "mr-IN",
-                "pa": "pa-IN"
-            }
             
-            return language_map.get(detected_language, "en-IN")
+            # The API may answer "hi" or "hi-IN"; map either to the TTS language code
+            return LANGUAGE_MAP.get(detected_language.split("-")[0], "en-IN")
         else:
-            print(f"Language detection failed: {response.text}")
-            return "en-IN"  # Default to English
+            log.error("language_detection_failed", status=response.status_code, body=response.text[:200])
+            return None
     except Exception as e:
-        print(f"Error in language detection: {str(e)}")
-        return "en-IN"  # Default to English
+        log.error("language_detection_error", error=str(e))
+        return None
+
+
+def hedged_detect_language_api(text):
+    """detect_language_api, with a backup request if the first is slower than the endpoint's p95."""
+    return circuit_breaker.hedge(
+        detect_language_api, text, delay=circuit_breaker.hedge_delay("sarvam.detect"), endpoint="sarvam.detect"
+    )
+
+
+def detect_language(text):
+    """Detects the language of the given text, locally from its script when possible."""
+    api_detect = hedged_detect_language_api if LANGUAGE_DETECT_HEDGE else detect_language_api
+    with metrics.stage("detect"):
+        language_code, source = language_detect.detect(text, api_detect)
+    log.info("language_detected", sampled=True, language=language_code, source=source)
+    return language_code
+
 
 def text_to_speech(text, language_code="en-IN"):
-    """Converts text to speech using Sarvam API."""
+    """Converts text to speech using Sarvam API, reusing cached audio for repeated text."""
     try:
-        print(f"Converting text to speech: {text}")
-        
         url = "https://api.sarvam.ai/text-to-speech"
         
-        # Define appropriate speaker based on language
-        speaker = "meera"  # Default for Indian English
-        
-        # Updated language-speaker mapping with more precise matching
-        language_speaker_map = {
-            "en-IN": "meera",     # Indian English
-            "hi-IN": "indic",     # Hindi
-            "ta-IN": "indic",     # Tamil
-            "kn-IN": "indic",     # Kannada
-            "te-IN": "indic",     # Telugu
-            "ml-IN": "indic",     # Malayalam
-            "bn-IN": "indic",     # Bengali
-            "pa-IN": "indic",     # Punjabi
-            "gu-IN": "indic",     # Gujarati
-            "mr-IN": "indic"      # Marathi
-        }
-        
-        # Handle cases where we might get just the language code without region
-        base_language = language_code.split('-')[0] if '-' in language_code else language_code
-        
-        # Try exact match first, then try base language
-        if language_code in language_speaker_map:
-            speaker = language_speaker_map[language_code]
-        elif f"{base_language}-IN" in language_speaker_map:
-            language_code = f"{base_language}-IN"  # Standardize to Indian variant
-            speaker = language_speaker_map[language_code]
-        speaker_name = "meera"
-        print(f"Using language code: {language_code} with speaker: {speaker_name}")
+        language_code = tts_language_code(language_code)
+        key = tts_cache_key(text, language_code)
+        cached_audio = tts_cache.audio_cache.get(key)
+        if cached_audio is not None:
+            log.debug("tts_cache_hit", sampled=True, key=key[:12])
+            return cached_audio
+
+        speaker_name = TTS_SPEAKER
 
         payload = {
             "inputs": [text],
             "target_language_code": language_code,
             "speaker": speaker_name,
-            "speech_sample_rate": 16000,  # Higher quality for WhatsApp
+            "speech_sample_rate": TTS_SAMPLE_RATE,
             "enable_preprocessing": True,
-            "model": "bulbul:v1"
+            "model": TTS_MODEL
         }
         
-        # ... rest of the function remains the same ...
-        
         headers = {
             "Content-Type": "application/json",
             "api-subscription-key": SARVAM_API_KEY
         }
         
-        print(f"Sending TTS request with payload: {payload}")
-        
-        response = requests.post(url, headers=headers, json=payload)
-        
-        print(f"TTS API Status Code: {response.status_code}")
+        with metrics.stage("tts"):
+            response = http_client.post(url, endpoint="sarvam.tts", headers=headers, json=payload)
         
         if response.status_code == 200:
             # Parse the response
@@ -337,436 +213,580 @@ def text_to_speech(text, language_code="en-IN"):
             audio_base64 = response_json.get("audios", [None])[0]
             
             if not audio_base64:
-                print("No audio data found in the response")
+                log.error("tts_empty_response", language=language_code)
                 return None
                 
-            # Create temp directory if it doesn't exist
-            temp_dir = os.path.join(BASE_DIR, "temp")
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            # Generate a unique filename
-            output_file = os.path.join(temp_dir, f"tts_output_{uuid.uuid4()}.wav")
-            
-            # Save the file
-            with open(output_file, "wb") as f:
-                f.write(base64.b64decode(audio_base64))
-                
-            print(f"TTS audio saved to: {output_file}")
-            return output_file
+            audio_bytes = base64.b64decode(audio_base64)
+            log.info("tts_synthesized", sampled=True, language=language_code, chars=len(text), bytes=len(audio_bytes))
+            tts_cache.audio_cache.put(key, audio_bytes)
+            return audio_bytes
         else:
-            print(f"Error from TTS API: {response.text}")
+            log.error("tts_failed", status=response.status_code, body=response.text[:200])
             return None
             
+    except circuit_breaker.CircuitOpenError as e:
+        log.warning("tts_skipped", reason=str(e))
+        return None
     except Exception as e:
-        print(f"Error in text_to_speech: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("tts_error", error=str(e))
         return None
 
 
-def translate_text(text, source_lang_code="en", target_lang_code="hi-IN"):
-    """Translates text from one language to another using Sarvam API."""
-    try:
-        # Convert target language code format (e.g., "hi-IN" to "hi")
-        if "-" in target_lang_code:
-            target_lang = target_lang_code.split("-")[0]
-        else:
-            target_lang = target_lang_code
-            
-        url = "https://api.sarvam.ai/translate"
-        
-        payload = {
-            "inputs": [text],
-            "source_language_code": source_lang_code,
-            "target_language_code": target_lang
-        }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "api-subscription-key": SARVAM_API_KEY
-        }
-        
-        response = requests.post(url, headers=headers, json=payload)
-        
-        if response.status_code == 200:
-            response_json = response.json()
-            translated_texts = response_json.get("translated_texts", [])
-            if translated_texts and len(translated_texts) > 0:
-                return translated_texts[0]
-            else:
-                print("No translation found in response")
-                return text  # Return original text if translation fails
-        else:
-            print(f"Translation failed: {response.text}")
-            return text  # Return original text if translation fails
-    except Exception as e:
-        print(f"Error in translation: {str(e)}")
-        return text  # Return original text if translation fails
+def translate_text(text, source_lang_code="en", target_lang_code="hi-IN", static=False):
+    """
+    Translates text from one language to another using Sarvam API.
+
+    Concurrent calls for the same language pair share one API request; static (system)
+    strings are served from the persistent phrase cache. Returns the original text on failure.
+    """
+    with metrics.stage("translate"):
+        return translation_service.translate(text, source_lang_code, target_lang_code, static=static)
+
+def help_message(language_code="en-IN"):
+    """Returns the command list, translated if needed."""
+    # Pre-rendered when the catalog has it; otherwise translated once and cached
+    return (
+        canned_responses.get("help", language_code)
+        or translate_text(HELP_TEXT, "en", language_code, static=True)
+    )
 
-def process_with_gemini(text, language_code="en-IN"):
+
+def process_with_gemini(text, language_code="en-IN", user=None):
     """Process the text with Gemini API and get a response."""
     try:
-        print(f"Sending to Gemini: {text}")
-        
-        if text.lower() == "help" or text.lower() == "commands":
-            help_text = """
-            Available commands:
-            
-            - Normal message: I'll respond conversationally
-            - tts:[text]: Convert text to speech
-            - loan:income,expenses,cibil_score: Check loan eligibility
-            - insights:income,expenses,cibil_score,loan_amount,interest_rate,tenure: Get detailed loan insights
-            - help: Show this help message
-            """
-            
-            # Translate help text if needed
-            if language_code != "en-IN":
-                return translate_text(help_text, "en", language_code)
-            return help_text
+        if is_help_command(text):
+            return help_message(language_code)
             
-        print(f"Sending to Gemini: {text}")
-        # Determine language name for better context
-        language_names = {
-            "en-IN": "English",
-            "hi-IN": "Hindi",
-            "ta-IN": "Tamil",
-            "te-IN": "Telugu",
-            "kn-IN": "Kannada",
-            "ml-IN": "Malayalam",
-            "bn-IN": "Bengali",
-            "gu-IN": "Gujarati", 
-            "mr-IN": "Marathi",
-            "pa-IN": "Punjabi"
-        }
-        
-        language_name = language_names.get(language_code, "the user's language")
-        
-        # Create a context/system prompt for the model that includes language instructions
-        prompt = f"""
-        You are an assistant for an Indian language conversational WhatsApp chatbot.
-        The user has sent a message in {language_name}.
-        
-        Original user message: {text}
-        
-        Respond to the user query in a helpful, conversational manner.
-        Keep your response concise (50-70 words) and direct.
-        
-        IMPORTANT: Please respond in {language_name}. If you're not sure about the language,
-        respond in the same language as the user's message.
-        """
-        
-        # Configure Gemini if not already done
-        if not hasattr(genai, 'configured') or not genai.configured:
-            genai.configure(api_key=GEMINI_API_KEY)
-            genai.configured = True
-        
-        # Send to Gemini
-        model = genai.GenerativeModel("gemini-1.5-pro-latest")
-        response = model.generate_content(prompt)
+        prompt = build_chat_prompt(text, language_code)
+        
+        # Send to Gemini (model instances are cached and calls are concurrency-capped),
+        # continuing the user's conversation when there is one
+        history = conversation_history(user)
+        with metrics.stage("gemini"):
+            if history:
+                response = gemini_client.chat(prompt, history)
+            else:
+                response = gemini_client.generate(prompt)
         
         # Extract the response text
         if response and hasattr(response, 'text'):
-            print(f"Gemini response: {response.text}")
+            log.info("gemini_replied", sampled=True, language=language_code, chars=len(response.text),
+                     history_turns=len(history))
+            remember_exchange(user, text, response.text)
             return response.text
         else:
-            print("No valid response from Gemini")
-            # Respond in the detected language if possible
-            if language_code == "hi-IN":
-                return "मैं आपके अनुरोध को संसाधित नहीं कर सका। कृपया पुनः प्रयास करें।"
-            elif language_code == "ta-IN":
-                return "உங்கள் கோரிக்கையை செயலாக்க முடியவில்லை. தயவுசெய்து மீண்டும் முயற்சிக்கவும்."
-            # Add more fallbacks for other languages as needed
-            else:
-                return "I couldn't process your request. Please try again."
+            log.warning("gemini_no_response", language=language_code)
+            return no_response_message(language_code)
             
     except Exception as e:
-        print(f"Error processing with Gemini: {str(e)}")
-        return "Sorry, I encountered an error processing your request."
+        log.error("gemini_error", error=str(e))
+        return canned_responses.text("gemini_error", language_code)
 
-def upload_to_s3(local_file, s3_file_name=None):
+
+def stream_voice_reply(text, language_code, to_number, from_number):
     """
-    Uploads an audio file to S3 and returns the public URL.
+    Streams the Gemini reply and speaks it sentence by sentence.
+
+    Each sentence is synthesized and uploaded as soon as Gemini finishes it, while
+    later sentences are still being generated; clips are sent in sentence order.
+
+    Voice permits (Sarvam, Twilio) are held until the last clip has been sent; when
+    they aren't granted the reply is text-only.
 
-    :param local_file: Path to the local file
-    :param s3_file_name: Name to save in S3 (default: same as local file name)
-    :return: Public URL of the uploaded file
+    :return: The full reply text
     """
+    permit = ExitStack()
+    if not permit.enter_context(voice_permit()):
+        permit.close()
+        log.warning("audio_reply_skipped", reason="voice upstreams busy")
+        return process_with_gemini(text, language_code, to_number)
+
+    sends = []
     try:
-        if s3_file_name is None:
-            s3_file_name = os.path.basename(local_file)
-
-        s3_client.upload_file(
-            local_file,
-            S3_BUCKET_NAME,
-            s3_file_name,
-            ExtraArgs={'ContentType': 'audio/mp3'}
+        return _stream_sentences(text, language_code, to_number, from_number, sends)
+    finally:
+        # Clips are sent in order, so the last send finishing means every clip is out
+        if sends:
+            sends[-1].add_done_callback(lambda _: permit.close())
+        else:
+            permit.close()
+
+
+def _stream_sentences(text, language_code, to_number, from_number, sends):
+    sentences = []
+    start = time.monotonic()
+    try:
+        chunks = gemini_client.generate_stream(
+            build_chat_prompt(text, language_code), history=conversation_history(to_number)
         )
+        for sentence in gemini_client.iter_sentences(chunks, STREAM_MIN_SENTENCE_CHARS):
+            sentences.append(sentence)
+            clip = _stream_tts_executor.submit(synthesize_to_url, sentence, language_code)
+            previous = sends[-1] if sends else None
+            sends.append(_stream_send_executor.submit(
+                _send_clip_when_ready, clip, previous, to_number, from_number
+            ))
+    except Exception as e:
+        log.error("gemini_stream_error", error=str(e), sentences=len(sentences))
+        if not sentences:
+            return canned_responses.text("gemini_error", language_code)
+
+    metrics.observe(metrics.STAGE_METRIC, time.monotonic() - start, stage="gemini")
+    if not sentences:
+        log.warning("gemini_no_response", language=language_code)
+        fallback = no_response_message(language_code)
+        send_tts_reply(fallback, language_code, to_number, from_number)
+        return fallback
+
+    response_text = " ".join(sentences)
+    log.info("gemini_replied", sampled=True, language=language_code, chars=len(response_text), sentences=len(sentences))
+    remember_exchange(to_number, text, response_text)
+    return response_text
+
+
+def _send_clip_when_ready(clip_future, previous_send, to_number, from_number):
+    # Keep clips in sentence order; an earlier task in this FIFO pool is always already running
+    if previous_send is not None:
+        wait([previous_send])
+    public_url = clip_future.result()
+    if public_url:
+        return send_audio_url_via_twilio(public_url, to_number, from_number)
+    log.warning("stream_clip_skipped", reason="audio could not be generated")
+    return False
+
+
+def reply_with_voice(text, to_number, from_number, language_code=None, voice=True):
+    """
+    Gets the Gemini reply for a message and also sends it as speech. Returns the reply text.
+
+    Runs as a stage graph: language -> gemini -> audio. The audio leg (TTS, S3, Twilio)
+    is a background stage, so the text reply returns as soon as Gemini answers.
+    With voice=False (admission control shedding load) only the text reply is produced.
+    """
+    if not language_code and is_help_command(text):
+        # The command words are English, so the canned help needs no detection call
+        language_code = "en-IN"
+    if voice and not voice_available():
+        log.warning("audio_reply_skipped", reason="voice upstream circuit open")
+        voice = False
+
+    graph = pipeline.Pipeline(_pipeline_executor, name="reply", background_executor=_background_executor)
+    graph.add("language", lambda: language_code or detect_language(text))
+
+    if not voice:
+        graph.add("gemini", lambda lang: process_with_gemini(text, lang, to_number), deps=["language"])
+    elif GEMINI_STREAMING and not is_help_command(text):
+        # Streaming sends the audio sentence by sentence from inside the Gemini stage
+        graph.add("gemini", lambda lang: stream_voice_reply(text, lang, to_number, from_number), deps=["language"])
+    else:
+        graph.add("gemini", lambda lang: process_with_gemini(text, lang, to_number), deps=["language"])
+        graph.add("audio", lambda lang, response: _send_reply_audio(response, lang, to_number, from_number),
+                  deps=["language", "gemini"], background=True)
+
+    return graph.run().result("gemini")
+
+
+def _send_reply_audio(response, language_code, to_number, from_number):
+    with voice_permit() as granted:
+        if not granted:
+            log.warning("audio_reply_skipped", reason="voice upstreams busy")
+            return None
+        sent = send_tts_reply(response, language_code, to_number, from_number)
+    if sent:
+        log.info("audio_reply_sent", sampled=True)
+    elif sent is False:
+        log.error("audio_reply_failed")
+    return sent
 
 
-        # Generate the URL
-        s3_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{s3_file_name}"
-        print(f"Uploaded to S3: {s3_url}")
-        return s3_url
+def speak_text(text, to_number, from_number):
+    """
+    Sends text as speech in the background (the tts: command).
+
+    Failures are reported to the user with a follow-up text message, since the webhook
+    reply has already gone out by then.
+    """
+    def speech(language_code):
+        with voice_permit() as granted:
+            if not granted:
+                send_text_via_twilio(canned_responses.text("busy", language_code), to_number, from_number)
+                return None
+            sent = send_tts_reply(text, language_code, to_number, from_number)
+        if sent is False:
+            send_text_via_twilio(canned_responses.text("tts_send_failed", language_code), to_number, from_number)
+        elif sent is None:
+            send_text_via_twilio(canned_responses.text("tts_failed", language_code), to_number, from_number)
+        return sent
+
+    graph = pipeline.Pipeline(_pipeline_executor, name="tts", background_executor=_background_executor)
+    graph.add("language", lambda: detect_language(text))
+    graph.add("speech", speech, deps=["language"], background=True)
+    return graph.run()
+
+
+def send_audio_url_via_twilio(public_url, to_number, from_number):
+    """Sends an already-uploaded audio URL via Twilio WhatsApp."""
+    try:
+        start = time.monotonic()
+        with metrics.stage("twilio"), circuit_breaker.get("twilio.messages").guard():
+            message = twilio_client.messages.create(
+                from_=from_number,
+                to=to_number,
+                media_url=[public_url]
+            )
+        metrics.observe("http_request_seconds", time.monotonic() - start, endpoint="twilio.messages")
+
+        log.info("twilio_audio_sent", sampled=True, sid=message.sid)
+        return True
 
     except Exception as e:
-        print(f"Error uploading to S3: {str(e)}")
-        return None
+        log.error("twilio_audio_error", error=str(e))
+        return False
 
 
-def send_audio_via_twilio(audio_file_path, to_number, from_number):
+def send_audio_via_twilio(audio_bytes, to_number, from_number, cache_key=None):
     """
-    Uploads the TTS audio file to S3 and sends it via Twilio WhatsApp.
+    Uploads TTS audio to S3 and sends it via Twilio WhatsApp.
 
-    :param audio_file_path: Local path of the audio file
+    :param audio_bytes: Audio file contents
     :param to_number: WhatsApp recipient number
     :param from_number: Twilio WhatsApp sender number
+    :param cache_key: TTS cache key; when given the upload is content-addressed and its URL remembered
     :return: Success status (True/False)
     """
     try:
-        print(f"Uploading {audio_file_path} to S3...")
-        
-        # Ensure the file exists
-        if not os.path.exists(audio_file_path):
-            print(f"File not found: {audio_file_path}")
-            return False
-
-        # Convert audio to MP3 if necessary (optional)
-        file_name, file_ext = os.path.splitext(audio_file_path)
-        mp3_path = f"{file_name}.mp3"
-        
-        if file_ext.lower() != ".mp3":
-            # Convert to MP3 if needed
-            os.rename(audio_file_path, mp3_path)  # Simplified conversion step
-            audio_file_path = mp3_path
-
-        # Upload to S3
-        s3_file_name = f"audio_{os.path.basename(audio_file_path)}"
-        public_url = upload_to_s3(audio_file_path, s3_file_name)
-
+        public_url = upload_tts_audio(audio_bytes, cache_key)
         if not public_url:
-            print("Failed to upload audio to S3")
             return False
 
         # Send audio URL via Twilio
-        message = twilio_client.messages.create(
-            from_=from_number,
-            to=to_number,
-            media_url=[public_url]
-        )
-
-        print(f"WhatsApp message sent with SID: {message.sid}")
-        return True
+        return send_audio_url_via_twilio(public_url, to_number, from_number)
 
     except Exception as e:
-        print(f"Error sending audio via Twilio: {str(e)}")
+        log.error("twilio_audio_error", error=str(e))
         return False
-    
-def cleanup_old_files(max_age_hours=24):
-    """Removes audio files older than the specified age."""
-    try:
-        temp_dir = os.path.join(BASE_DIR, "temp")
-        if not os.path.exists(temp_dir):
-            return
-            
-        current_time = time.time()
-        for filename in os.listdir(temp_dir):
-            file_path = os.path.join(temp_dir, filename)
-            # Check if the file is older than max_age_hours
-            if os.path.isfile(file_path) and (current_time - os.path.getmtime(file_path)) > (max_age_hours * 3600):
-                print(f"Removing old file: {file_path}")
-                os.remove(file_path)
-    except Exception as e:
-        print(f"Error cleaning up old files: {str(e)}")
 
 
-@app.route('/webhook', methods=['POST'])
-def whatsapp_webhook():
-    try:
-        print("Received request:", request.form)
-        
-        # Get the Message SID for unique identification
-        message_sid = request.values.get('MessageSid', '')
-        print(f"Processing message with SID: {message_sid}")
-        
-        # Get sender and recipient numbers
-        from_number = request.values.get('To', '')
-        to_number = request.values.get('From', '')
-        
-        resp = MessagingResponse()
-        num_media = int(request.values.get('NumMedia', 0))
-
-        if num_media > 0:
-            media_url = request.values.get('MediaUrl0')
-            media_type = request.values.get('MediaContentType0')
-            print(f"Media received: {media_type} at {media_url}")
-
-            if 'audio' in media_type:
-                # Pass the Message SID to ensure unique file names
-                file_path = download_audio(media_url, message_sid)
-                if file_path:
-                    # Convert the MP4 audio to WAV format for the Sarvam API
-                    transcription = transcribe_audio(file_path)
-                
-                    # Clean up old files to prevent disk space issues
-                    cleanup_old_files()
-                    
-                    if transcription:
-                        # Extract language code from the transcription output if available
+def synthesize_to_url(text, language_code):
+    """Returns a public URL of text spoken in the given language, or None on failure."""
+    key = tts_cache_key(text, language_code)
+    public_url = (
+        canned_responses.audio_url(text, language_code)
+        or tts_cache.url_index().get(f"{key}.{WHATSAPP_AUDIO_FORMAT}")
+    )
+    if public_url:
+        return public_url
+
+    tts_audio = text_to_speech(text, language_code)
+    if not tts_audio:
+        return None
+    return upload_tts_audio(tts_audio, cache_key=key)
+
+
+def send_tts_reply(text, language_code, to_number, from_number):
+    """
+    Speaks text back to the user, skipping synthesis and upload when the clip was sent before.
+
+    :return: True if sent, False if the send failed, None if speech synthesis failed
+    """
+    key = tts_cache_key(text, language_code)
+    # Canned replies were rendered ahead of time; other clips may have been sent before
+    public_url = (
+        canned_responses.audio_url(text, language_code)
+        or tts_cache.url_index().get(f"{key}.{WHATSAPP_AUDIO_FORMAT}")
+    )
+    if public_url:
+        log.debug("tts_url_reused", sampled=True, key=key[:12])
+        return send_audio_url_via_twilio(public_url, to_number, from_number)
+
+    tts_audio = text_to_speech(text, language_code)
+    if not tts_audio:
+        return None
+    return send_audio_via_twilio(tts_audio, to_number, from_number, cache_key=key)
+
+
+def process_message(values, voice=True, ticket=None):
+    """
+    Runs the full reply pipeline for one incoming WhatsApp message.
+
+    :param values: Dict of Twilio webhook form values
+    :param voice: Also send spoken replies (False when admission control sheds load)
+    :param ticket: Admission ticket; its Sarvam permit is handed back once a voice note is
+        transcribed, so the spoken reply's own voice permit isn't taken on top of it
+    :return: List of text replies to send back to the user
+    """
+    replies = []
+
+    # Get the Message SID for unique identification
+    message_sid = values.get('MessageSid', '')
+    log.info("message_received", sampled=True, sid=message_sid, media=values.get('NumMedia', '0'))
+
+    # Get sender and recipient numbers
+    from_number = values.get('To', '')
+    to_number = values.get('From', '')
+
+    num_media = int(values.get('NumMedia', 0))
+
+    # Fixed replies follow the script of the message; no API call is spent on them
+    reply_language = language_detect.guess(values.get('Body', '')) or "en-IN"
+
+    if num_media > 0:
+        media_url = values.get('MediaUrl0')
+        media_type = values.get('MediaContentType0') or ''
+        log.debug("media_received", sid=message_sid, content_type=media_type)
+
+        if 'audio' in media_type:
+            audio_bytes = download_audio(media_url, message_sid)
+            if audio_bytes:
+                # Convert the audio to WAV in memory and transcribe it
+                transcription = transcribe_audio(audio_bytes)
+                if ticket is not None:
+                    ticket.release("sarvam")
+
+                if transcription:
+                    transcription_text = transcription.transcript
+                    language_code = transcription.language_code
+
+                    if language_code == "unknown":
+                        # Let the reply pipeline fall back to language detection
                         language_code = None
-                        transcription_text = transcription
-                        
-                        # Look for the language code in the output
-                        if "language_code" in transcription:
-                            try:
-                                # Try to parse the language code from the output
-                                import re
-                                lang_match = re.search(r"'language_code':\s*'([^']+)'", transcription)
-                                if lang_match:
-                                    detected_lang = lang_match.group(1)
-                                    print(f"Extracted language code from transcription: {detected_lang}")
-                                    
-                                    # Clean up the transcription text - remove the JSON part
-                                    # Find the last line which is the clean transcript
-                                    lines = transcription.strip().split('\n')
-                                    transcription_text = lines[-1].strip()
-                                    
-                                    language_code = detected_lang
-                            except Exception as e:
-                                print(f"Error extracting language code: {str(e)}")
-                        
-                        if not language_code:
-                            # Fallback to language detection API
-                            language_code = detect_language(transcription_text)
-                        
-                        # Process transcription with Gemini to get a response
-                        gemini_response = process_with_gemini(transcription_text, language_code)
-                        
-                        # Send text response to the user
-                        resp.message(f"Received: {transcription_text}\n\nResponse: {gemini_response}")
-                        
-                        # Convert Gemini's response to speech in the detected language
-                        tts_file = text_to_speech(gemini_response, language_code)
-                        
-                        if tts_file:
-                            # Try to send the audio response
-                            if send_audio_via_twilio(tts_file, to_number, from_number):
-                                print("Sent audio response successfully")
-                            else:
-                                print("Failed to send audio response")
-                    else:
-                        resp.message("Sorry, I couldn't transcribe the audio.")
+
+                    # Get Gemini's response and send it as speech in the detected language
+                    gemini_response = reply_with_voice(transcription_text, to_number, from_number, language_code, voice)
+
+                    # Send text response to the user
+                    replies.append(f"Received: {transcription_text}\n\nResponse: {gemini_response}")
                 else:
-                    resp.message("Sorry, I couldn't download the audio file.")
+                    replies.append(canned_responses.text("transcribe_failed", reply_language))
             else:
-                resp.message("I received your media, but I can only process audio files.")
-
+                replies.append(canned_responses.text("download_failed", reply_language))
         else:
-            incoming_msg = request.values.get('Body', '').strip()
-            if incoming_msg:
-                # Process text input with Gemini and TTS
-                if incoming_msg.lower().startswith("tts:"):
-                    # Extract the text to convert to speech
-                    text_for_tts = incoming_msg[4:].strip()
-                    
-                    if text_for_tts:
-                        # Detect language
-                        language_code = detect_language(text_for_tts)
-                        
-                        # Convert to speech
-                        tts_file = text_to_speech(text_for_tts, language_code)
-                        
-                        if tts_file:
-                            # Try to send the audio response
-                            if send_audio_via_twilio(tts_file, to_number, from_number):
-                                resp.message("Here's your text converted to speech.")
-                            else:
-                                resp.message("Generated speech but couldn't send the audio file.")
-                        else:
-                            resp.message("Sorry, I couldn't convert your text to speech.")
+            replies.append(canned_responses.text("media_unsupported", reply_language))
+
+    else:
+        incoming_msg = values.get('Body', '').strip()
+        if incoming_msg:
+            # Process text input with Gemini and TTS
+            if incoming_msg.lower().startswith("tts:"):
+                # Extract the text to convert to speech
+                text_for_tts = incoming_msg[4:].strip()
+
+                if text_for_tts and not voice:
+                    replies.append(canned_responses.text("busy", reply_language))
+                elif text_for_tts:
+                    # Detect language, convert to speech and send it without holding up the reply
+                    speak_text(text_for_tts, to_number, from_number)
+                    replies.append(canned_responses.text("tts_started", reply_language))
+                else:
+                    replies.append(canned_responses.text("tts_empty", reply_language))
+
+            elif incoming_msg.lower().startswith("loan:"):
+                try:
+                    # Parse parameters: income, expenses, cibil_score
+                    params = incoming_msg[5:].strip().split(',')
+                    if len(params) != 3:
+                        replies.append(canned_responses.text("loan_format", reply_language))
+                    else:
+                        income = int(params[0].strip())
+                        expenses = int(params[1].strip())
+                        cibil_score = int(params[2].strip())
+
+                        # Get eligibility check from gemini_chatbot
+                        eligibility_result = check_loan_eligibility(income, expenses, cibil_score)
+                        replies.append(f"Loan Eligibility Analysis:\n\n{eligibility_result}")
+                        remember_exchange(to_number, incoming_msg, eligibility_result)
+                except ValueError:
+                    replies.append(canned_responses.text("loan_numeric", reply_language))
+                except Exception as e:
+                    replies.append(f"Error checking loan eligibility: {str(e)}")
+
+            elif incoming_msg.lower().startswith("insights:"):
+                try:
+                    # Parse parameters: income, expenses, cibil_score, loan_amount, interest_rate, tenure
+                    params = incoming_msg[9:].strip().split(',')
+                    if len(params) != 6:
+                        replies.append(canned_responses.text("insights_format", reply_language))
                     else:
-                        resp.message("Please provide some text after 'tts:' to convert to speech.")
-
-                elif incoming_msg.lower().startswith("loan:"):
-                    try:
-                        # Parse parameters: income, expenses, cibil_score
-                        params = incoming_msg[5:].strip().split(',')
-                        if len(params) != 3:
-                            resp.message("Please provide income, expenses, and CIBIL score in the format: loan:income,expenses,cibil_score")
-                        else:
-                            income = int(params[0].strip())
-                            expenses = int(params[1].strip())
-                            cibil_score = int(params[2].strip())
-                            
-                            # Get eligibility check from gemini_chatbot
-                            eligibility_result = check_loan_eligibility(income, expenses, cibil_score)
-                            resp.message(f"Loan Eligibility Analysis:\n\n{eligibility_result}")
-                    except ValueError:
-                        resp.message("Please provide numeric values for income, expenses, and CIBIL score.")
-                    except Exception as e:
-                        resp.message(f"Error checking loan eligibility: {str(e)}")
-
-                elif incoming_msg.lower().startswith("insights:"):
-                    try:
-                        # Parse parameters: income, expenses, cibil_score, loan_amount, interest_rate, tenure
-                        params = incoming_msg[9:].strip().split(',')
-                        if len(params) != 6:
-                            resp.message("Please provide all parameters in the format: insights:income,expenses,cibil_score,loan_amount,interest_rate,tenure")
-                        else:
-                            income = int(params[0].strip())
-                            expenses = int(params[1].strip())
-                            cibil_score = int(params[2].strip())
-                            loan_amount = int(params[3].strip())
-                            interest_rate = float(params[4].strip())
-                            tenure = int(params[5].strip())
-                            
-                            # Get loan insights from gemini_chatbot
-                            insights_result = gemini_loan_insights(income, expenses, cibil_score, loan_amount, interest_rate, tenure)
-                            resp.message(f"Loan Insights Analysis:\n\n{insights_result}")
-                    except ValueError:
-                        resp.message("Please provide proper numeric values for all parameters.")
-                    except Exception as e:
-                        resp.message(f"Error generating loan insights: {str(e)}")
+                        income = int(params[0].strip())
+                        expenses = int(params[1].strip())
+                        cibil_score = int(params[2].strip())
+                        loan_amount = int(params[3].strip())
+                        interest_rate = float(params[4].strip())
+                        tenure = int(params[5].strip())
+
+                        # Get loan insights from gemini_chatbot
+                        insights_result = gemini_loan_insights(income, expenses, cibil_score, loan_amount, interest_rate, tenure)
+                        replies.append(f"Loan Insights Analysis:\n\n{insights_result}")
+                        remember_exchange(to_number, incoming_msg, insights_result)
+                except ValueError:
+                    replies.append(canned_responses.text("insights_numeric", reply_language))
+                except Exception as e:
+                    replies.append(f"Error generating loan insights: {str(e)}")
 
-                else:
-                    # Regular text message - process with Gemini
-                    language_code = detect_language(incoming_msg)
-                    gemini_response = process_with_gemini(incoming_msg, language_code)
-                    
-                    # Send text response
-                    resp.message(gemini_response)
-                    
-                    # Also create and send speech response
-                    tts_file = text_to_speech(gemini_response, language_code)
-                    if tts_file:
-                        if send_audio_via_twilio(tts_file, to_number, from_number):
-                            print("Sent audio response for text message")
-                        else:
-                            print("Failed to send audio response for text message")
             else:
-                resp.message("I didn't receive any message.")
+                # Regular text message - process with Gemini, also sending a speech response
+                gemini_response = reply_with_voice(incoming_msg, to_number, from_number, voice=voice)
+
+                # Send text response
+                replies.append(gemini_response)
+        else:
+            replies.append(canned_responses.text("empty_message", reply_language))
+
+    return replies
+
+
+def send_text_via_twilio(body, to_number, from_number):
+    """Sends a text message via the Twilio REST API."""
+    try:
+        start = time.monotonic()
+        with metrics.stage("twilio"), circuit_breaker.get("twilio.messages").guard():
+            message = twilio_client.messages.create(
+                from_=from_number,
+                to=to_number,
+                body=body
+            )
+        metrics.observe("http_request_seconds", time.monotonic() - start, endpoint="twilio.messages")
+        log.info("twilio_text_sent", sampled=True, sid=message.sid)
+        return True
+    except Exception as e:
+        log.error("twilio_text_error", error=str(e))
+        return False
+
+
+def run_webhook_job(values):
+    """Background worker entry point: runs the pipeline and sends the replies via REST."""
+    from_number = values.get('To', '')
+    to_number = values.get('From', '')
+    try:
+        replies = process_message(values, voice=not values.get(TEXT_ONLY_FIELD))
+    except Exception as e:
+        log.exception("queued_message_error", sid=values.get('MessageSid', ''), error=str(e))
+        replies = [f"Error: {str(e)}"]
+
+    for reply in replies:
+        send_text_via_twilio(reply, to_number, from_number)
+
 
+_webhook_pool = None
+_webhook_pool_lock = threading.Lock()
+
+
+def get_webhook_pool():
+    """Returns the shared webhook worker pool, creating it on first use (after any fork)."""
+    global _webhook_pool
+    with _webhook_pool_lock:
+        if _webhook_pool is None:
+            backend = job_queue.create_backend(WEBHOOK_QUEUE_BACKEND, maxsize=WEBHOOK_QUEUE_SIZE)
+            _webhook_pool = job_queue.WorkerPool(
+                run_webhook_job,
+                backend=backend,
+                workers=WEBHOOK_WORKERS,
+                name="webhook"
+            )
+        return _webhook_pool
+
+
+def admit(values):
+    """Runs admission control for one delivery. Returns an admission.Ticket, or None when disabled."""
+    if not ADMISSION_CONTROL:
+        return None
+    # Queue workers already bound concurrency; only the sender's rate applies there
+    upstreams = () if WEBHOOK_MODE == "queue" else message_upstreams(values)
+    return admission.get_controller().admit(values.get('From'), upstreams, wants_voice(values))
+
+
+# Marks a queued job whose replies should be text-only
+TEXT_ONLY_FIELD = "_TextOnly"
+
+
+def handle_webhook(values):
+    """Processes (or queues) one webhook delivery and returns the TwiML reply."""
+    resp = MessagingResponse()
+    reply_language = language_detect.guess(values.get('Body', '')) or "en-IN"
+    sid = values.get('MessageSid', '')
+
+    ticket = admit(values)
+    if ticket is not None and ticket.level == admission.REJECTED:
+        log.warning("message_rejected", sid=sid, reason=ticket.reason)
+        resp.message(canned_responses.text("rate_limited", reply_language))
         return str(resp)
 
+    queued = ticket is not None and ticket.level == admission.QUEUED
+    if WEBHOOK_MODE == "queue" or queued:
+        if not values.get('From') or not values.get('To'):
+            resp.message(canned_responses.text("empty_message", reply_language))
+            return str(resp)
+        if ticket is not None and ticket.level == admission.TEXT_ONLY:
+            values = dict(values, **{TEXT_ONLY_FIELD: "1"})
+        try:
+            job = get_webhook_pool().submit(values)
+            log.info("message_queued", sampled=True, sid=sid, job=job.id, reason=ticket.reason if queued else None)
+            if queued:
+                resp.message(canned_responses.text("queued", reply_language))
+        except job_queue.QueueFullError as e:
+            log.warning("message_rejected", sid=sid, reason=str(e))
+            resp.message(canned_responses.text("busy", reply_language))
+        # Otherwise empty TwiML acknowledges the webhook; replies are sent by the worker
+        return str(resp)
+
+    # The ticket's permits are held until the text reply is ready (Sarvam's until a voice note is transcribed)
+    with ticket or nullcontext():
+        for reply in process_message(values, voice=ticket is None or ticket.voice, ticket=ticket):
+            resp.message(reply)
+    return str(resp)
+
+
+# Translate the static replies into every supported language without holding up startup
+if translation_service.TRANSLATION_PRECOMPUTE:
+    translation_service.start_precompute(STATIC_PHRASES, LANGUAGE_MAP.values())
+
+if db_connector.LOAN_KNN_ENGINE:
+    @app.before_request
+    def load_knn_engine():
+        # Start loading the loan table in this worker (after any fork) without holding up the request
+        db_connector.start_knn_engine(wait=False)
+
+
+@app.route('/webhook', methods=['POST'])
+def whatsapp_webhook():
+    try:
+        values = request.values.to_dict()
+
+        if not WEBHOOK_DEDUPE:
+            return handle_webhook(values)
+
+        # A retry while the original is still running waits for its reply; one that
+        # still isn't ready in time gets an empty acknowledgement so Twilio stops retrying
+        return dedupe.get_deduplicator().run(
+            values.get('MessageSid'),
+            lambda: handle_webhook(values),
+            pending_result=str(MessagingResponse())
+        )
+
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
+        log.exception("webhook_error", error=str(e))
         resp = MessagingResponse()
         resp.message(f"Error: {str(e)}")
         return str(resp)
 
 
-# Route to serve audio files (useful for development with ngrok)
-@app.route('/audio/<filename>', methods=['GET'])
-def serve_audio(filename):
-    """Serves audio files from the temp directory."""
-    temp_dir = os.path.join(BASE_DIR, "temp")
-    return send_from_directory(temp_dir, filename)
-
 @app.route("/chat", methods=["POST"])
 def chat():
     user_msg = request.json.get("message", "")
     reply = chatbot_response(user_msg)
     return jsonify({"reply": reply})
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape target: counters, gauges and latency histograms (incl. stage_seconds)."""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/emi/batch", methods=["POST"])
+def emi_batch_endpoint():
+    """Prices many loans in one call (see emi_batch_response)."""
+    payload, status = emi_batch_response(request.get_json(silent=True) or {})
+    return jsonify(payload), status
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # "text" or "json" (one object per line)
+# Share of high-volume per-request events (logged with sampled=True) that are kept; warnings and errors always are
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+ROOT_LOGGER = "chatbot"
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class StructuredFormatter(logging.Formatter):
+    """Renders an event name plus key/value fields as text or JSON."""
+
+    def __init__(self, output=LOG_FORMAT):
+        super().__init__()
+        self.output = output
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        if self.output == "json":
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname.lower(),
+                "logger": record.name,
+                "event": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        line = f"{timestamp} {record.levelname:<7} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure(level=LOG_LEVEL, output=LOG_FORMAT):
+    """Installs the stdout handler for the chatbot loggers (once per process)."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(StructuredFormatter(output))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.addHandler(handler)
+        root.setLevel(level)
+        root.propagate = False
+        _configured = True
+
+
+class StructuredLogger:
+    """
+    Leveled logger taking an event name and key/value fields.
+
+        log.info("audio_downloaded", sid=sid, bytes=len(data))
+        log.debug("tts_cache_hit", key=key[:12], sampled=True)
+
+    Events marked sampled=True are kept with probability LOG_SAMPLE_RATE.
+    """
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+    def _log(self, level, event, fields, sampled=False, exc_info=False):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sampled and level < logging.WARNING and random.random() >= LOG_SAMPLE_RATE:
+            return
+        self._logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event, sampled=False, **fields):
+        self._log(logging.DEBUG, event, fields, sampled)
+
+    def info(self, event, sampled=False, **fields):
+        self._log(logging.INFO, event, fields, sampled)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, exc_info=False, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=exc_info)
+
+    def exception(self, event, **fields):
+        """Logs an error with the current traceback."""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name):
+    """Returns the structured logger for a module."""
+    configure()
+    return StructuredLogger(name)
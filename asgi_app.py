@@ -0,0 +1,588 @@
+import asyncio
+import base64
+from contextlib import nullcontext
+
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+from twilio.twiml.messaging_response import MessagingResponse
+
+# Loads .env and validates the credentials; settings, prompts, language tables and the
+# S3 upload path are shared with the Flask service (without building it)
+import chatbot_core
+import admission
+import app_logging
+import async_db
+import async_http
+import canned_responses
+import circuit_breaker
+import db_connector
+import dedupe
+import gemini_client
+import http_client
+import language_detect
+import metrics
+import result_cache
+import sarvam_asr
+import transcoder
+import translation_service
+import tts_cache
+from gemini_chatbot import check_loan_eligibility_async, gemini_loan_insights_async
+
+log = app_logging.get_logger("asgi_app")
+
+# Fully async variant of the webhook service: one event loop per worker holds every
+# in-flight message, so a slow upstream costs a coroutine instead of a thread.
+# Run with: uvicorn asgi_app:app --workers 2
+# GEMINI_STREAMING and WEBHOOK_MODE=queue only apply to the Flask service.
+app = cors(Quart(__name__), allow_origin=["https://www.stratolending.com"])
+
+SARVAM_DETECT_URL = "https://api.sarvam.ai/translate"
+SARVAM_TTS_URL = "https://api.sarvam.ai/text-to-speech"
+TWILIO_MESSAGES_URL = "https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json"
+
+# Audio replies run after the webhook has answered; keep references so they aren't collected
+_background_tasks = set()
+
+# Messages queued by admission control wait for one of WEBHOOK_WORKERS slots
+_queue_slots = asyncio.Semaphore(chatbot_core.WEBHOOK_WORKERS)
+_queued = 0
+
+
+def spawn(coro):
+    """Runs a coroutine in the background, after the webhook reply."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def canned_text(name, language_code="en-IN"):
+    """canned_responses.text from memory only; startup() loaded the phrase cache off the loop."""
+    return canned_responses.text(name, language_code, memory_only=True)
+
+
+async def admit(values):
+    """Runs admission control for one delivery. Returns an admission.Ticket, or None when disabled."""
+    if not chatbot_core.ADMISSION_CONTROL:
+        return None
+    return await admission.get_controller().admit_async(
+        values.get('From'), chatbot_core.message_upstreams(values), chatbot_core.wants_voice(values)
+    )
+
+
+def voice_permit():
+    """chatbot_core.voice_permit for async with; SQLite permits are taken in a thread."""
+    if not chatbot_core.ADMISSION_CONTROL:
+        return nullcontext(True)
+    return admission.get_controller().permit_async(*admission.VOICE_UPSTREAMS)
+
+
+def _sarvam_headers():
+    return {
+        "Content-Type": "application/json",
+        "api-subscription-key": chatbot_core.SARVAM_API_KEY
+    }
+
+
+async def download_audio(url, message_sid):
+    """Downloads an audio file from the given Twilio media URL into memory."""
+    try:
+        with metrics.stage("download"):
+            # Twilio redirects media requests to its CDN
+            response = await async_http.get(
+                url,
+                endpoint="twilio.media",
+                auth=(chatbot_core.TWILIO_ACCOUNT_SID, chatbot_core.TWILIO_AUTH_TOKEN),
+                follow_redirects=True
+            )
+
+        if response.status_code != 200:
+            log.error("audio_download_failed", sid=message_sid, status=response.status_code, body=response.text[:200])
+            return None
+
+        log.info("audio_downloaded", sampled=True, sid=message_sid, bytes=len(response.content))
+        return response.content
+
+    except Exception as e:
+        log.error("audio_download_error", sid=message_sid, error=str(e))
+        return None
+
+
+async def transcribe_audio(audio_bytes, language_code="auto"):
+    """Transcribes in-memory audio with the Sarvam speech-to-text API."""
+    try:
+        # ffmpeg runs in a worker thread so the event loop keeps serving other messages
+        with metrics.stage("convert"):
+            wav_bytes = await asyncio.to_thread(transcoder.to_asr_wav, audio_bytes)
+        if not wav_bytes:
+            log.error("audio_conversion_failed", bytes=len(audio_bytes))
+            return None
+
+        with metrics.stage("transcribe"):
+            result = await sarvam_asr.transcribe_wav_bytes_async(wav_bytes, language_code, api_key=chatbot_core.SARVAM_API_KEY)
+        if result:
+            log.info("audio_transcribed", sampled=True, bytes=len(wav_bytes), seconds=round(result.timings["total"], 3),
+                     language=result.language_code, confidence=result.confidence)
+        return result
+    except Exception as e:
+        log.error("transcribe_error", error=str(e))
+        return None
+
+
+async def detect_language_api(text):
+    """Detects the language of the given text using Sarvam API. Returns None on failure."""
+    try:
+        payload = {
+            "input": text,
+            "source_language_code": "auto",
+            "target_language_code": "en"
+        }
+        response = await async_http.post(
+            SARVAM_DETECT_URL, endpoint="sarvam.detect", headers=_sarvam_headers(), json=payload
+        )
+
+        if response.status_code == 200:
+            detected_language = response.json().get("source_language_code", "en-IN")
+            return chatbot_core.LANGUAGE_MAP.get(detected_language.split("-")[0], "en-IN")
+        log.error("language_detection_failed", status=response.status_code, body=response.text[:200])
+        return None
+    except Exception as e:
+        log.error("language_detection_error", error=str(e))
+        return None
+
+
+async def hedged_detect_language_api(text):
+    """detect_language_api, with a backup request if the first is slower than the endpoint's p95."""
+    return await circuit_breaker.hedge_async(
+        detect_language_api, text, delay=circuit_breaker.hedge_delay("sarvam.detect"), endpoint="sarvam.detect"
+    )
+
+
+async def detect_language(text):
+    """Detects the language of the given text, locally from its script when possible."""
+    api_detect = hedged_detect_language_api if chatbot_core.LANGUAGE_DETECT_HEDGE else detect_language_api
+    with metrics.stage("detect"):
+        language_code, source = await language_detect.detect_async(text, api_detect)
+    log.info("language_detected", sampled=True, language=language_code, source=source)
+    return language_code
+
+
+async def text_to_speech(text, language_code="en-IN"):
+    """Converts text to speech using Sarvam API, reusing cached audio for repeated text."""
+    try:
+        language_code = chatbot_core.tts_language_code(language_code)
+        key = chatbot_core.tts_cache_key(text, language_code)
+        cached_audio = tts_cache.audio_cache.get(key)
+        if cached_audio is not None:
+            log.debug("tts_cache_hit", sampled=True, key=key[:12])
+            return cached_audio
+
+        payload = {
+            "inputs": [text],
+            "target_language_code": language_code,
+            "speaker": chatbot_core.TTS_SPEAKER,
+            "speech_sample_rate": chatbot_core.TTS_SAMPLE_RATE,
+            "enable_preprocessing": True,
+            "model": chatbot_core.TTS_MODEL
+        }
+        with metrics.stage("tts"):
+            response = await async_http.post(SARVAM_TTS_URL, endpoint="sarvam.tts", headers=_sarvam_headers(), json=payload)
+
+        if response.status_code != 200:
+            log.error("tts_failed", status=response.status_code, body=response.text[:200])
+            return None
+
+        audio_base64 = response.json().get("audios", [None])[0]
+        if not audio_base64:
+            log.error("tts_empty_response", language=language_code)
+            return None
+
+        audio_bytes = base64.b64decode(audio_base64)
+        log.info("tts_synthesized", sampled=True, language=language_code, chars=len(text), bytes=len(audio_bytes))
+        tts_cache.audio_cache.put(key, audio_bytes)
+        return audio_bytes
+
+    except circuit_breaker.CircuitOpenError as e:
+        log.warning("tts_skipped", reason=str(e))
+        return None
+    except Exception as e:
+        log.exception("tts_error", error=str(e))
+        return None
+
+
+async def translate_text(text, source_lang_code="en", target_lang_code="hi-IN", static=False):
+    """Translates text with the batching translation service; cached static strings skip the thread hop."""
+    if static:
+        cached = translation_service.lookup(text, source_lang_code, target_lang_code, memory_only=True)
+        if cached is not None:
+            return cached
+    with metrics.stage("translate"):
+        return await asyncio.to_thread(
+            translation_service.translate, text, source_lang_code, target_lang_code, static
+        )
+
+
+async def help_message(language_code="en-IN"):
+    """Returns the command list, translated if needed."""
+    return canned_responses.get("help", language_code, memory_only=True) or await translate_text(
+        chatbot_core.HELP_TEXT, "en", language_code, static=True
+    )
+
+
+async def process_with_gemini(text, language_code="en-IN", user=None):
+    """Process the text with Gemini API and get a response."""
+    try:
+        if chatbot_core.is_help_command(text):
+            return await help_message(language_code)
+
+        prompt = chatbot_core.build_chat_prompt(text, language_code)
+        history = chatbot_core.conversation_history(user)
+        with metrics.stage("gemini"):
+            if history:
+                response = await gemini_client.chat_async(prompt, history)
+            else:
+                response = await gemini_client.generate_async(prompt)
+
+        if response and hasattr(response, 'text'):
+            log.info("gemini_replied", sampled=True, language=language_code, chars=len(response.text),
+                     history_turns=len(history))
+            chatbot_core.remember_exchange(user, text, response.text)
+            return response.text
+        log.warning("gemini_no_response", language=language_code)
+        return canned_text("no_response", language_code)
+
+    except Exception as e:
+        log.error("gemini_error", error=str(e))
+        return canned_text("gemini_error", language_code)
+
+
+async def send_twilio_message(to_number, from_number, body=None, media_url=None):
+    """Sends a WhatsApp text or media message via the Twilio REST API. Returns True on success."""
+    data = {"From": from_number, "To": to_number}
+    if body is not None:
+        data["Body"] = body
+    if media_url:
+        data["MediaUrl"] = media_url
+    try:
+        with metrics.stage("twilio"):
+            response = await async_http.post(
+                TWILIO_MESSAGES_URL.format(sid=chatbot_core.TWILIO_ACCOUNT_SID),
+                endpoint="twilio.messages",
+                auth=(chatbot_core.TWILIO_ACCOUNT_SID, chatbot_core.TWILIO_AUTH_TOKEN),
+                data=data
+            )
+        if response.status_code not in (200, 201):
+            log.error("twilio_send_failed", status=response.status_code, body=response.text[:200])
+            return False
+
+        log.info("twilio_audio_sent" if media_url else "twilio_text_sent", sampled=True, sid=response.json().get("sid"))
+        return True
+    except Exception as e:
+        log.error("twilio_send_error", error=str(e))
+        return False
+
+
+async def send_tts_reply(text, language_code, to_number, from_number):
+    """
+    Speaks text back to the user, skipping synthesis and upload when the clip was sent before.
+
+    :return: True if sent, False if the send failed, None if speech synthesis failed
+    """
+    key = chatbot_core.tts_cache_key(text, language_code)
+    public_url = canned_responses.audio_url(text, language_code) or await asyncio.to_thread(
+        tts_cache.url_index().get, f"{key}.{chatbot_core.WHATSAPP_AUDIO_FORMAT}"
+    )
+    if public_url:
+        log.debug("tts_url_reused", sampled=True, key=key[:12])
+    else:
+        tts_audio = await text_to_speech(text, language_code)
+        if not tts_audio:
+            return None
+        # Encoding (ffmpeg) and the S3 upload (boto3) are blocking, so they run in a thread
+        public_url = await asyncio.to_thread(chatbot_core.upload_tts_audio, tts_audio, key)
+        if not public_url:
+            return False
+    return await send_twilio_message(to_number, from_number, media_url=public_url)
+
+
+async def _send_reply_audio(response, language_code, to_number, from_number):
+    async with voice_permit() as granted:
+        if not granted:
+            log.warning("audio_reply_skipped", reason="voice upstreams busy")
+            return None
+        sent = await send_tts_reply(response, language_code, to_number, from_number)
+    if sent:
+        log.info("audio_reply_sent", sampled=True)
+    elif sent is False:
+        log.error("audio_reply_failed")
+    return sent
+
+
+async def reply_with_voice(text, to_number, from_number, language_code=None, voice=True):
+    """
+    Gets the Gemini reply for a message and also sends it as speech. Returns the reply text.
+
+    The audio leg (TTS, S3, Twilio) runs in the background, so the text reply returns
+    as soon as Gemini answers. With voice=False only the text reply is produced.
+    """
+    if not language_code and chatbot_core.is_help_command(text):
+        language_code = "en-IN"
+    if voice and not chatbot_core.voice_available():
+        log.warning("audio_reply_skipped", reason="voice upstream circuit open")
+        voice = False
+    language_code = language_code or await detect_language(text)
+    response = await process_with_gemini(text, language_code, to_number)
+    if voice:
+        spawn(_send_reply_audio(response, language_code, to_number, from_number))
+    return response
+
+
+async def speak_text(text, to_number, from_number):
+    """Sends text as speech in the background (the tts: command)."""
+    async def speech():
+        language_code = await detect_language(text)
+        async with voice_permit() as granted:
+            if not granted:
+                await send_twilio_message(to_number, from_number, body=canned_text("busy", language_code))
+                return None
+            sent = await send_tts_reply(text, language_code, to_number, from_number)
+        if sent is False:
+            await send_twilio_message(to_number, from_number, body=canned_text("tts_send_failed", language_code))
+        elif sent is None:
+            await send_twilio_message(to_number, from_number, body=canned_text("tts_failed", language_code))
+        return sent
+
+    return spawn(speech())
+
+
+async def process_message(values, voice=True, ticket=None):
+    """
+    Runs the full reply pipeline for one incoming WhatsApp message.
+
+    :param values: Dict of Twilio webhook form values
+    :param voice: Also send spoken replies (False when admission control sheds load)
+    :param ticket: Admission ticket; its Sarvam permit is handed back once a voice note is
+        transcribed, so the spoken reply's own voice permit isn't taken on top of it
+    :return: List of text replies to send back to the user
+    """
+    replies = []
+
+    message_sid = values.get('MessageSid', '')
+    log.info("message_received", sampled=True, sid=message_sid, media=values.get('NumMedia', '0'))
+
+    from_number = values.get('To', '')
+    to_number = values.get('From', '')
+
+    num_media = int(values.get('NumMedia', 0))
+    reply_language = language_detect.guess(values.get('Body', '')) or "en-IN"
+
+    if num_media > 0:
+        media_url = values.get('MediaUrl0')
+        media_type = values.get('MediaContentType0') or ''
+        log.debug("media_received", sid=message_sid, content_type=media_type)
+
+        if 'audio' in media_type:
+            audio_bytes = await download_audio(media_url, message_sid)
+            if audio_bytes:
+                transcription = await transcribe_audio(audio_bytes)
+                if ticket is not None:
+                    await ticket.release_async("sarvam")
+
+                if transcription:
+                    transcription_text = transcription.transcript
+                    language_code = transcription.language_code
+                    if language_code == "unknown":
+                        language_code = None
+
+                    gemini_response = await reply_with_voice(transcription_text, to_number, from_number, language_code, voice)
+                    replies.append(f"Received: {transcription_text}\n\nResponse: {gemini_response}")
+                else:
+                    replies.append(canned_text("transcribe_failed", reply_language))
+            else:
+                replies.append(canned_text("download_failed", reply_language))
+        else:
+            replies.append(canned_text("media_unsupported", reply_language))
+
+    else:
+        incoming_msg = values.get('Body', '').strip()
+        if incoming_msg:
+            if incoming_msg.lower().startswith("tts:"):
+                text_for_tts = incoming_msg[4:].strip()
+
+                if text_for_tts and not voice:
+                    replies.append(canned_text("busy", reply_language))
+                elif text_for_tts:
+                    await speak_text(text_for_tts, to_number, from_number)
+                    replies.append(canned_text("tts_started", reply_language))
+                else:
+                    replies.append(canned_text("tts_empty", reply_language))
+
+            elif incoming_msg.lower().startswith("loan:"):
+                try:
+                    params = incoming_msg[5:].strip().split(',')
+                    if len(params) != 3:
+                        replies.append(canned_text("loan_format", reply_language))
+                    else:
+                        income = int(params[0].strip())
+                        expenses = int(params[1].strip())
+                        cibil_score = int(params[2].strip())
+
+                        eligibility_result = await check_loan_eligibility_async(income, expenses, cibil_score)
+                        replies.append(f"Loan Eligibility Analysis:\n\n{eligibility_result}")
+                        chatbot_core.remember_exchange(to_number, incoming_msg, eligibility_result)
+                except ValueError:
+                    replies.append(canned_text("loan_numeric", reply_language))
+                except Exception as e:
+                    replies.append(f"Error checking loan eligibility: {str(e)}")
+
+            elif incoming_msg.lower().startswith("insights:"):
+                try:
+                    params = incoming_msg[9:].strip().split(',')
+                    if len(params) != 6:
+                        replies.append(canned_text("insights_format", reply_language))
+                    else:
+                        income = int(params[0].strip())
+                        expenses = int(params[1].strip())
+                        cibil_score = int(params[2].strip())
+                        loan_amount = int(params[3].strip())
+                        interest_rate = float(params[4].strip())
+                        tenure = int(params[5].strip())
+
+                        insights_result = await gemini_loan_insights_async(income, expenses, cibil_score, loan_amount, interest_rate, tenure)
+                        replies.append(f"Loan Insights Analysis:\n\n{insights_result}")
+                        chatbot_core.remember_exchange(to_number, incoming_msg, insights_result)
+                except ValueError:
+                    replies.append(canned_text("insights_numeric", reply_language))
+                except Exception as e:
+                    replies.append(f"Error generating loan insights: {str(e)}")
+
+            else:
+                replies.append(await reply_with_voice(incoming_msg, to_number, from_number, voice=voice))
+        else:
+            replies.append(canned_text("empty_message", reply_language))
+
+    return replies
+
+
+async def run_queued(values):
+    """Processes a message turned away by admission control once a worker slot frees up."""
+    global _queued
+    try:
+        async with _queue_slots:
+            replies = await process_message(values)
+    except Exception as e:
+        log.exception("queued_message_error", sid=values.get('MessageSid', ''), error=str(e))
+        replies = [f"Error: {str(e)}"]
+    finally:
+        _queued -= 1
+
+    for reply in replies:
+        await send_twilio_message(values.get('From', ''), values.get('To', ''), body=reply)
+
+
+async def handle_webhook(values):
+    """Processes (or queues) one webhook delivery and returns the TwiML reply."""
+    global _queued
+    resp = MessagingResponse()
+    reply_language = language_detect.guess(values.get('Body', '')) or "en-IN"
+    sid = values.get('MessageSid', '')
+
+    ticket = await admit(values)
+    if ticket is not None and ticket.level == admission.REJECTED:
+        log.warning("message_rejected", sid=sid, reason=ticket.reason)
+        resp.message(canned_text("rate_limited", reply_language))
+        return str(resp)
+
+    if ticket is not None and ticket.level == admission.QUEUED:
+        if _queued >= chatbot_core.WEBHOOK_QUEUE_SIZE or not values.get('From') or not values.get('To'):
+            log.warning("message_rejected", sid=sid, reason="queue full")
+            resp.message(canned_text("busy", reply_language))
+        else:
+            _queued += 1
+            spawn(run_queued(values))
+            log.info("message_queued", sampled=True, sid=sid, reason=ticket.reason)
+            resp.message(canned_text("queued", reply_language))
+        return str(resp)
+
+    async with ticket or nullcontext():
+        for reply in await process_message(values, voice=ticket is None or ticket.voice, ticket=ticket):
+            resp.message(reply)
+    return str(resp)
+
+
+@app.before_serving
+async def startup():
+    # Open the upstream connection pools before the first message arrives
+    async_http.get_client()
+    # Open the SQLite-backed stores and load the canned catalog off the event loop. Canned
+    # replies and static translations are then read from memory on the loop; the other
+    # stores' SQLite backends are called through asyncio.to_thread
+    await asyncio.to_thread(translation_service.phrase_cache)
+    await asyncio.to_thread(canned_responses.catalog)
+    await asyncio.to_thread(tts_cache.url_index)
+    await asyncio.to_thread(result_cache.default_backend)
+    if chatbot_core.WEBHOOK_DEDUPE:
+        await asyncio.to_thread(dedupe.get_deduplicator)
+    if chatbot_core.ADMISSION_CONTROL:
+        await asyncio.to_thread(admission.get_controller)
+    if translation_service.TRANSLATION_PRECOMPUTE:
+        translation_service.start_precompute(chatbot_core.STATIC_PHRASES, chatbot_core.LANGUAGE_MAP.values())
+    if db_connector.LOAN_KNN_ENGINE:
+        # Load the loan table in the background; loan: requests use SQL until it is ready
+        db_connector.start_knn_engine(wait=False)
+    else:
+        try:
+            await async_db.get_pool()
+        except Exception as e:
+            log.warning("db_pool_warmup_failed", error=str(e))
+
+
+@app.after_serving
+async def shutdown():
+    # Let audio replies that are already under way finish before closing the pools
+    if _background_tasks:
+        await asyncio.wait(list(_background_tasks), timeout=http_client.HTTP_READ_TIMEOUT)
+    await async_http.close()
+    await async_db.close()
+
+
+@app.route('/webhook', methods=['POST'])
+async def whatsapp_webhook():
+    try:
+        values = (await request.values).to_dict()
+
+        if not chatbot_core.WEBHOOK_DEDUPE:
+            return await handle_webhook(values)
+
+        return await dedupe.get_deduplicator().run_async(
+            values.get('MessageSid'),
+            lambda: handle_webhook(values),
+            pending_result=str(MessagingResponse())
+        )
+
+    except Exception as e:
+        log.exception("webhook_error", error=str(e))
+        resp = MessagingResponse()
+        resp.message(f"Error: {str(e)}")
+        return str(resp)
+
+
+@app.route("/chat", methods=["POST"])
+async def chat():
+    body = await request.get_json()
+    return jsonify({"reply": chatbot_core.chatbot_response(body.get("message", ""))})
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint():
+    """Prometheus scrape target (same registry as the Flask service)."""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/emi/batch", methods=["POST"])
+async def emi_batch_endpoint():
+    """Prices many loans in one call (see chatbot_core.emi_batch_response)."""
+    body = await request.get_json(silent=True) or {}
+    # Large grids take a few milliseconds of numpy work; keep them off the event loop
+    payload, status = await asyncio.to_thread(chatbot_core.emi_batch_response, body)
+    return jsonify(payload), status
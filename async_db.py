@@ -0,0 +1,72 @@
+import asyncio
+import re
+import weakref
+
+import asyncpg
+
+import app_logging
+import db_connector
+import metrics
+
+log = app_logging.get_logger("async_db")
+
+# asyncpg would infer the parameters as int4 from "$1 - 1000000"; cast them to the bigint
+# types db_connector's PREPARE declares, so large figures neither overflow nor change the plan
+SIMILAR_LOANS_SQL = re.sub(r"\$(\d+)", r"$\1::bigint", db_connector.SIMILAR_LOANS_SQL)
+
+_pools = weakref.WeakKeyDictionary()  # Event loop -> asyncpg pool
+_pool_locks = weakref.WeakKeyDictionary()
+
+
+async def get_pool():
+    """Returns the asyncpg pool for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    lock = _pool_locks.setdefault(loop, asyncio.Lock())
+    async with lock:
+        pool = _pools.get(loop)
+        if pool is None:
+            # Same settings as the psycopg2 pool; the password comes from PGPASSWORD/.pgpass as with libpq
+            config = db_connector.DB_CONFIG
+            pool = _pools[loop] = await asyncpg.create_pool(
+                database=config["dbname"],
+                user=config["user"],
+                host=config["host"],
+                port=int(config["port"]),
+                min_size=db_connector.DB_POOL_MIN,
+                max_size=db_connector.DB_POOL_MAX,
+                server_settings={"statement_timeout": str(db_connector.DB_STATEMENT_TIMEOUT_MS)}
+            )
+        return pool
+
+
+async def close():
+    """Closes the running loop's pool (call on shutdown)."""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+
+
+async def fetch_similar_loans(income, expenses, cibil_score):
+    """Async counterpart of db_connector.fetch_similar_loans; returns [] on error."""
+    try:
+        if db_connector.LOAN_KNN_ENGINE:
+            # The in-memory engine answers in microseconds, so there is nothing to await
+            engine = db_connector.get_knn_engine()
+            if engine is not None:
+                return engine.query(income, expenses, cibil_score, db_connector.SIMILAR_LOANS_LIMIT)
+
+        pool = await get_pool()
+        with metrics.timer("db_pool_wait_seconds"):
+            connection = await pool.acquire(timeout=db_connector.DB_POOL_TIMEOUT)
+        try:
+            # asyncpg prepares and caches the statement per connection
+            rows = await connection.fetch(
+                SIMILAR_LOANS_SQL, int(income), int(expenses), int(cibil_score)
+            )
+        finally:
+            await pool.release(connection)
+        return [tuple(row) for row in rows]
+
+    except Exception as e:
+        log.error("database_error", error=str(e))
+        return []
@@ -0,0 +1,98 @@
+import asyncio
+import time
+import weakref
+from urllib.parse import urlparse
+
+import httpx
+
+import app_logging
+import circuit_breaker
+import http_client
+import metrics
+
+log = app_logging.get_logger("async_http")
+
+# Same pool size, timeouts and retry policy as the synchronous client (see http_client.py)
+_clients = weakref.WeakKeyDictionary()  # Event loop -> httpx.AsyncClient
+
+
+def get_client():
+    """Returns the pooled AsyncClient for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=http_client.HTTP_POOL_SIZE
+            ),
+            timeout=httpx.Timeout(http_client.HTTP_READ_TIMEOUT, connect=http_client.HTTP_CONNECT_TIMEOUT)
+        )
+    return client
+
+
+async def close():
+    """Closes the running loop's client (call on shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def request(method, url, endpoint=None, timeout=None, retries=None, **kwargs):
+    """
+    Async counterpart of http_client.request: pooled, with timeouts and jittered retries.
+
+    :return: httpx.Response (the last one if every attempt was retryable)
+    """
+    endpoint = endpoint or urlparse(url).netloc
+    retries = http_client.HTTP_MAX_RETRIES if retries is None else retries
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    client = get_client()
+    breaker = circuit_breaker.get(endpoint)
+
+    for attempt in range(retries + 1):
+        # Raises CircuitOpenError instead of waiting on an upstream that keeps failing
+        breaker.before()
+        start = time.monotonic()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            breaker.record(False, time.monotonic() - start)
+            metrics.observe("http_request_seconds", time.monotonic() - start, endpoint=endpoint)
+            metrics.inc("http_requests_total", endpoint=endpoint, status=type(e).__name__)
+            if attempt >= retries:
+                raise
+            delay = http_client.backoff_delay(attempt)
+            log.warning("http_retry", endpoint=endpoint, error=type(e).__name__, delay=round(delay, 3))
+            await asyncio.sleep(delay)
+            continue
+        except asyncio.CancelledError:
+            # A cancelled hedge loser says nothing about the upstream, but must free a half-open probe
+            breaker.abandon()
+            raise
+        except Exception:
+            breaker.record(False, time.monotonic() - start)
+            raise
+
+        # 429 means the upstream is healthy but throttling us; only 5xx count against it
+        breaker.record(response.status_code < 500, time.monotonic() - start)
+        metrics.observe("http_request_seconds", time.monotonic() - start, endpoint=endpoint)
+        metrics.inc("http_requests_total", endpoint=endpoint, status=str(response.status_code))
+
+        if response.status_code in http_client.RETRY_STATUSES and attempt < retries:
+            delay = http_client.backoff_delay(attempt, response)
+            log.warning("http_retry", endpoint=endpoint, status=response.status_code, delay=round(delay, 3))
+            await asyncio.sleep(delay)
+            continue
+        return response
+
+
+async def get(url, **kwargs):
+    """Shortcut for request("GET", ...)."""
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    """Shortcut for request("POST", ...)."""
+    return await request("POST", url, **kwargs)
@@ -0,0 +1,75 @@
+"""
+Benchmark: vectorized EMI/DTI pricing vs looping the scalar functions.
+
+    python benchmarks/bench_emi_batch.py --amounts 200 --rates 50 --tenures 30
+
+Prices every amount x rate x tenure combination both ways, reports loans per
+second and checks that every EMI and DTI matches the scalar result exactly.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# gemini_chatbot imports the Gemini client and database modules, so reuse the formulas from there
+from gemini_chatbot import calculate_dti, calculate_emi  # noqa: E402
+import emi_batch  # noqa: E402
+
+INCOME = 1200000
+EXPENSES = 300000
+
+
+def scalar_grid(amounts, rates, tenures):
+    emis, dtis = [], []
+    for amount in amounts:
+        for rate in rates:
+            for tenure in tenures:
+                emi = calculate_emi(amount, rate, tenure)
+                emis.append(emi)
+                dtis.append(calculate_dti(INCOME, EXPENSES, emi))
+    return emis, dtis
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amounts", type=int, default=100)
+    parser.add_argument("--rates", type=int, default=40)
+    parser.add_argument("--tenures", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    amounts = [100000.0 + 25000 * i for i in range(args.amounts)]
+    rates = [0.0] + [round(6 + 0.25 * i, 2) for i in range(args.rates - 1)]  # Include the 0% case
+    tenures = [float(years) for years in range(1, args.tenures + 1)]
+    loans = len(amounts) * len(rates) * len(tenures)
+
+    scalar_seconds, (scalar_emis, scalar_dtis) = timed(lambda: scalar_grid(amounts, rates, tenures), args.repeat)
+    vector_seconds, priced = timed(
+        lambda: emi_batch.price_grid(amounts, rates, tenures, INCOME, EXPENSES), args.repeat
+    )
+
+    print(f"{loans} loans per run, best of {args.repeat}")
+    print(f"{'scalar loop':<16} {loans / scalar_seconds:>14.0f} loans/s   {scalar_seconds * 1000:9.2f} ms")
+    print(f"{'vectorized':<16} {loans / vector_seconds:>14.0f} loans/s   {vector_seconds * 1000:9.2f} ms")
+    print(f"Speed-up: {scalar_seconds / vector_seconds:.1f}x")
+
+    emi_mismatches = int(np.sum(priced["emi"].ravel() != np.asarray(scalar_emis)))
+    dti_mismatches = int(np.sum(priced["dti"].ravel() != np.asarray(scalar_dtis)))
+    print(f"EMI mismatches: {emi_mismatches}   DTI mismatches: {dti_mismatches}")
+
+
+if __name__ == "__main__":
+    main()
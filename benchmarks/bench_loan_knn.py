@@ -0,0 +1,112 @@
+"""
+Benchmark: in-memory k-NN engine vs the SQL similar-loans query.
+
+    python benchmarks/bench_loan_knn.py --rows 1000000 --queries 2000
+    python benchmarks/bench_loan_knn.py --sql --queries 500   # also time PostgreSQL (needs POSTGRES_HOST)
+
+Without --sql the engine runs on synthetic data and is checked against a plain
+Python scan that applies the same window and ordering as the SQL statement.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_connector  # noqa: E402
+import loan_knn  # noqa: E402
+
+WINDOWS = (db_connector.INCOME_WINDOW, db_connector.EXPENSES_WINDOW, db_connector.CIBIL_WINDOW)
+
+
+def synthetic_rows(count, seed=7):
+    rng = random.Random(seed)
+    for i in range(count):
+        income = rng.randrange(200000, 10000000, 1000)
+        expenses = rng.randrange(50000, income, 1000)
+        cibil = rng.randint(300, 900)
+        yield (i + 1, income, expenses, cibil, "Approved" if cibil > 650 else "Rejected")
+
+
+def random_queries(count, seed=11):
+    rng = random.Random(seed)
+    return [
+        (rng.randrange(200000, 10000000, 1000), rng.randrange(50000, 3000000, 1000), rng.randint(300, 900))
+        for _ in range(count)
+    ]
+
+
+def reference_scan(rows, income, expenses, cibil, k=5):
+    """Same semantics as SIMILAR_LOANS_SQL, one row at a time."""
+    matches = []
+    for _, row_income, row_expenses, row_cibil, status in rows:
+        if (abs(row_income - income) < WINDOWS[0] and abs(row_expenses - expenses) < WINDOWS[1]
+                and abs(row_cibil - cibil) < WINDOWS[2]):
+            distance = (((row_income - income) / WINDOWS[0]) ** 2 + ((row_expenses - expenses) / WINDOWS[1]) ** 2
+                        + ((row_cibil - cibil) / WINDOWS[2]) ** 2)
+            matches.append((distance, (row_income, row_expenses, row_cibil, status)))
+    matches.sort(key=lambda match: match[0])
+    return [row for _, row in matches[:k]]
+
+
+def time_calls(fn, queries):
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        call_start = time.perf_counter()
+        fn(*query)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "qps": len(queries) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def report(name, result):
+    print(f"{name:<28} {result['qps']:>10.0f} q/s   p50 {result['p50_ms']:8.3f} ms   p99 {result['p99_ms']:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000, help="Synthetic table size (ignored with --sql)")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--sql", action="store_true", help="Load the real table and time the SQL path too")
+    args = parser.parse_args()
+
+    queries = random_queries(args.queries)
+
+    if args.sql:
+        rows = db_connector.fetch_loan_rows()
+    else:
+        rows = list(synthetic_rows(args.rows))
+
+    start = time.perf_counter()
+    snapshot = loan_knn.build_snapshot(rows, WINDOWS)
+    print(f"Built snapshot of {len(snapshot)} rows in {time.perf_counter() - start:.2f}s "
+          f"({'KD-tree' if snapshot.tree is not None else 'brute force'})")
+
+    report("in-memory k-NN", time_calls(lambda *q: loan_knn.query_snapshot(snapshot, *q), queries))
+
+    if args.sql:
+        db_connector.LOAN_KNN_ENGINE = False
+        report("PostgreSQL", time_calls(db_connector.fetch_similar_loans, queries))
+        mismatches = sum(
+            1 for q in queries[:100]
+            if sorted(loan_knn.query_snapshot(snapshot, *q)) != sorted(tuple(r) for r in db_connector.fetch_similar_loans(*q))
+        )
+    else:
+        sample = queries[:50]
+        report("python scan (reference)", time_calls(lambda *q: reference_scan(rows, *q), sample))
+        mismatches = sum(1 for q in sample if loan_knn.query_snapshot(snapshot, *q) != reference_scan(rows, *q))
+
+    print(f"Result mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Offline load test: drives the WhatsApp webhook with every external service stubbed.
+
+    python benchmarks/load_test.py --rps 20 --duration 30
+    python benchmarks/load_test.py --mix text=60,voice=40 --gemini-latency lognormal:1.2,0.4
+    python benchmarks/load_test.py --json results.json --max-p99 5   # fail CI on a regression
+
+Sarvam (detect, translate, TTS, ASR), Gemini, Twilio (media download and
+messages.create), S3 and the Postgres similar-loans lookup are replaced by local
+stubs whose latency follows a configurable distribution:
+
+    fixed:0.2            always 200 ms
+    uniform:0.1,0.4      uniformly between 100 and 400 ms
+    lognormal:0.3,0.5    median 300 ms, sigma 0.5 (a realistic long tail)
+
+Requests arrive open-loop at --rps through the Flask test client, mixing text,
+loan:, insights:, tts: and voice-note messages. The report covers throughput,
+end-to-end latency per message type and the p50/p99 of every pipeline stage.
+"""
+import argparse
+import base64
+import importlib
+import io
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_MIX = "text=40,loan=15,insights=10,tts=10,voice=25"
+
+
+class Latency:
+    """Samples delays from a "kind:params" spec (see the module docstring)."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        values = [float(value) for value in params.split(",")] if params else []
+        if kind == "fixed":
+            self._sample = lambda: values[0]
+        elif kind == "uniform":
+            self._sample = lambda: random.uniform(values[0], values[1])
+        elif kind == "lognormal":
+            self._sample = lambda: random.lognormvariate(math.log(values[0]), values[1])
+        else:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def __call__(self):
+        return max(0.0, self._sample())
+
+    def sleep(self):
+        time.sleep(self())
+
+
+def sine_wav(seconds=2.0, rate=8000):
+    """A short mono 16-bit WAV standing in for a WhatsApp voice note or a TTS clip."""
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        sample = int(8000 * math.sin(2 * math.pi * 440 * i / rate))
+        frames += sample.to_bytes(2, "little", signed=True)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+class FakeResponse:
+    """The parts of requests.Response the app reads."""
+
+    def __init__(self, status_code=200, payload=None, content=b""):
+        self.status_code = status_code
+        self._payload = payload
+        self.content = content if payload is None else json.dumps(payload).encode("utf-8")
+        self.headers = {}
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return self._payload
+
+
+class FakeSession:
+    """Answers http_client calls locally: Sarvam endpoints and Twilio media downloads."""
+
+    def __init__(self, sarvam_latency, media_latency, voice_note, tts_clip):
+        self.sarvam_latency = sarvam_latency
+        self.media_latency = media_latency
+        self.voice_note = voice_note
+        self.tts_audio = base64.b64encode(tts_clip).decode("ascii")
+
+    def request(self, method, url, timeout=None, json=None, **kwargs):
+        if "api.twilio.com" in url or "/Media/" in url:
+            self.media_latency.sleep()
+            return FakeResponse(content=self.voice_note)
+
+        self.sarvam_latency.sleep()
+        if url.endswith("/text-to-speech"):
+            return FakeResponse(payload={"audios": [self.tts_audio]})
+        if url.endswith("/speech-to-text"):
+            return FakeResponse(payload={
+                "transcript": "मुझे पचास हज़ार की आय पर लोन चाहिए",
+                "language_code": "hi-IN",
+                "language_probability": 0.93,
+            })
+        if url.endswith("/translate"):
+            if json and "input" in json:
+                # Language detection call
+                return FakeResponse(payload={"source_language_code": "en-IN", "translated_text": json["input"]})
+            return FakeResponse(payload={"translated_texts": list(json.get("inputs", []))})
+        return FakeResponse(status_code=404, payload={"error": f"No stub for {url}"})
+
+
+class FakeTwilioMessages:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, **kwargs):
+        self.latency.sleep()
+        return type("Message", (), {"sid": f"SM{uuid.uuid4().hex}"})()
+
+
+class FakeTwilioClient:
+    def __init__(self, latency):
+        self.messages = FakeTwilioMessages(latency)
+
+
+class FakeS3Client:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def put_object(self, **kwargs):
+        self.latency.sleep()
+        return {"ETag": uuid.uuid4().hex}
+
+
+def fake_similar_loans(latency):
+    def fetch_similar_loans(income, expenses, cibil_score):
+        latency.sleep()
+        rng = random.Random(hash((income, expenses, cibil_score)))
+        return [
+            (income + rng.randint(-90000, 90000), expenses + rng.randint(-40000, 40000),
+             cibil_score + rng.randint(-40, 40), rng.choice(["Approved", "Rejected"]))
+            for _ in range(5)
+        ]
+    return fetch_similar_loans
+
+
+def message_values(kind, rng, sender):
+    """Twilio webhook form values for one synthetic message of the given kind."""
+    values = {
+        "MessageSid": f"SM{uuid.uuid4().hex}",
+        "From": sender,
+        "To": "whatsapp:+14155238886",
+        "NumMedia": "0",
+    }
+    income = rng.randrange(300000, 3000000, 10000)
+    expenses = rng.randrange(50000, income, 10000)
+    cibil = rng.randint(450, 850)
+    if kind == "text":
+        values["Body"] = rng.choice([
+            "What documents do I need for a home loan?",
+            "Can I get a personal loan with a low credit score?",
+            "मुझे बिज़नेस लोन के बारे में बताइए",
+            "How do I improve my CIBIL score quickly?",
+        ])
+    elif kind == "loan":
+        values["Body"] = f"loan:{income},{expenses},{cibil}"
+    elif kind == "insights":
+        amount = rng.randrange(100000, 5000000, 50000)
+        values["Body"] = f"insights:{income},{expenses},{cibil},{amount},{rng.choice([8.5, 10.25, 12])},{rng.randint(1, 20)}"
+    elif kind == "tts":
+        values["Body"] = f"tts:Your EMI for loan {rng.randint(1, 10**6)} is due on the fifth."
+    elif kind == "voice":
+        values["NumMedia"] = "1"
+        values["MediaContentType0"] = "audio/ogg"
+        values["MediaUrl0"] = f"https://api.twilio.com/2010-04-01/Accounts/AC/Messages/MM/Media/ME{uuid.uuid4().hex}"
+    else:
+        raise ValueError(f"Unknown message kind: {kind}")
+    return values
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def load_app(args):
+    """Imports the Flask app with every external dependency stubbed."""
+    scratch = tempfile.mkdtemp(prefix="chatbot-load-")
+    os.environ.update({
+        "SARVAM_API_KEY": "load-test",
+        "TWILIO_ACCOUNT_SID": "ACload-test",
+        "TWILIO_AUTH_TOKEN": "load-test",
+        "GEMINI_FAKE": "1",
+        "S3_BUCKET_NAME": "load-test",
+        "AWS_ACCESS_KEY_ID": "load-test",
+        "AWS_SECRET_ACCESS_KEY": "load-test",
+        "WEBHOOK_MODE": "sync",
+        "TTS_CACHE_INDEX_PATH": os.path.join(scratch, "tts_cache.sqlite3"),
+        "TRANSLATION_CACHE_PATH": os.path.join(scratch, "translations.sqlite3"),
+        "RESULT_CACHE_BACKEND": "memory",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+
+    import db_connector
+    import gemini_chatbot
+    import gemini_client
+    import http_client
+
+    gemini_latency = Latency(args.gemini_latency)
+    counter = iter(range(10 ** 12))
+    # Vary the reply so TTS and the result caches behave as they would with real answers
+    gemini_client.use_fake(
+        latency=gemini_latency,
+        reply=lambda: f"Thanks for your question. Here is answer {next(counter)} about your loan options."
+    )
+    http_client.set_session(FakeSession(
+        Latency(args.sarvam_latency), Latency(args.twilio_latency), sine_wav(), sine_wav(1.0, 16000)
+    ))
+    similar_loans = fake_similar_loans(Latency(args.db_latency))
+    db_connector.fetch_similar_loans = similar_loans
+    gemini_chatbot.fetch_similar_loans = similar_loans
+
+    chatbot = importlib.import_module("app")
+    chatbot.twilio_client = FakeTwilioClient(Latency(args.twilio_latency))
+    # The S3 upload path is shared with the ASGI service
+    importlib.import_module("chatbot_core").s3_client = FakeS3Client(Latency(args.s3_latency))
+    return chatbot
+
+
+def run(args):
+    chatbot = load_app(args)
+    import metrics
+
+    metrics.reset()
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    rng = random.Random(args.seed)
+    senders = [f"whatsapp:+9190000{i:05d}" for i in range(args.users)]
+    local = threading.local()
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def send(kind, values):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = chatbot.app.test_client()
+        start = time.perf_counter()
+        try:
+            response = client.post("/webhook", data=values)
+            ok = response.status_code == 200 and b"Error:" not in response.data
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies[kind].append(elapsed)
+            if not ok:
+                errors[kind] += 1
+
+    executor = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="load")
+    total = int(args.rps * args.duration)
+    started = time.perf_counter()
+    futures = []
+    for i in range(total):
+        # Open loop: requests are released on schedule whether or not earlier ones finished
+        delay = started + i / args.rps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        kind = rng.choices(kinds, weights)[0]
+        futures.append(executor.submit(send, kind, message_values(kind, rng, rng.choice(senders))))
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+    # Let queued messages and background audio legs finish so their stages are counted
+    if chatbot._webhook_pool is not None:
+        chatbot._webhook_pool.join()
+    chatbot._pipeline_executor.shutdown(wait=True)
+    chatbot._background_executor.shutdown(wait=True)
+
+    admitted = defaultdict(int)
+    for (name, labels), value in metrics.snapshot()["counters"].items():
+        if name == "admission_total":
+            admitted[dict(labels)["level"]] += value
+
+    completed = sum(len(values) for values in latencies.values())
+    report = {
+        "requests": completed,
+        "errors": sum(errors.values()),
+        "seconds": elapsed,
+        "throughput_rps": completed / elapsed if elapsed else 0.0,
+        "latency": {
+            kind: {
+                "count": len(values),
+                "errors": errors[kind],
+                "p50": percentile(values, 0.5),
+                "p90": percentile(values, 0.9),
+                "p99": percentile(values, 0.99),
+                "mean": statistics.fmean(values),
+            }
+            for kind, values in sorted(latencies.items())
+        },
+        "stages": metrics.stage_percentiles(),
+        "admission": dict(admitted),
+    }
+    all_latencies = [value for values in latencies.values() for value in values]
+    report["p99"] = percentile(all_latencies, 0.99)
+    return report
+
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['seconds']:.1f}s: "
+          f"{report['throughput_rps']:.1f} req/s, {report['errors']} errors")
+    if report["admission"]:
+        print("admission: " + ", ".join(f"{level}={count}" for level, count in sorted(report["admission"].items())))
+    print(f"\n{'message':<10} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for kind, row in report["latency"].items():
+        print(f"{kind:<10} {row['count']:>6} {row['errors']:>6} {row['p50'] * 1000:>9.1f} "
+              f"{row['p90'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f}")
+    print(f"\n{'stage':<12} {'count':>6} {'p50 ms':>9} {'p99 ms':>9}   (bucket estimates)")
+    for stage, row in sorted(report["stages"].items()):
+        print(f"{stage:<12} {row['count']:>6} {row['p50'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=10, help="Target arrival rate")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of traffic")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Message kinds and weights")
+    parser.add_argument("--users", type=int, default=500, help="Distinct WhatsApp senders")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sarvam-latency", default="lognormal:0.25,0.4")
+    parser.add_argument("--gemini-latency", default="lognormal:1.0,0.4")
+    parser.add_argument("--twilio-latency", default="lognormal:0.15,0.3")
+    parser.add_argument("--s3-latency", default="lognormal:0.08,0.3")
+    parser.add_argument("--db-latency", default="lognormal:0.01,0.5")
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--max-p99", type=float, help="Exit non-zero if the overall p99 (seconds) is above this")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    if args.max_p99 is not None and report["p99"] is not None and report["p99"] > args.max_p99:
+        print(f"\nFAIL: p99 {report['p99']:.3f}s is above {args.max_p99:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app_logging
+import metrics
+import translation_service
+
+log = app_logging.get_logger("canned_responses")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CANNED_CATALOG_PATH = os.getenv("CANNED_CATALOG_PATH", os.path.join(BASE_DIR, "canned_responses.json"))
+WHATSAPP_AUDIO_FORMAT = os.getenv("WHATSAPP_AUDIO_FORMAT", "mp3").lower()
+
+# Every fixed reply the service sends, in English
+MESSAGES = {
+    "help": """
+            Available commands:
+            
+            - Normal message: I'll respond conversationally
+            - tts:[text]: Convert text to speech
+            - loan:income,expenses,cibil_score: Check loan eligibility
+            - insights:income,expenses,cibil_score,loan_amount,interest_rate,tenure: Get detailed loan insights
+            - help: Show this help message
+            """,
+    "no_response": "I couldn't process your request. Please try again.",
+    "gemini_error": "Sorry, I encountered an error processing your request.",
+    "download_failed": "Sorry, I couldn't download the audio file.",
+    "transcribe_failed": "Sorry, I couldn't transcribe the audio.",
+    "media_unsupported": "I received your media, but I can only process audio files.",
+    "empty_message": "I didn't receive any message.",
+    "tts_started": "Here's your text converted to speech.",
+    "tts_empty": "Please provide some text after 'tts:' to convert to speech.",
+    "tts_failed": "Sorry, I couldn't convert your text to speech.",
+    "tts_send_failed": "Generated speech but couldn't send the audio file.",
+    "loan_format": "Please provide income, expenses, and CIBIL score in the format: loan:income,expenses,cibil_score",
+    "loan_numeric": "Please provide numeric values for income, expenses, and CIBIL score.",
+    "insights_format": "Please provide all parameters in the format: insights:income,expenses,cibil_score,loan_amount,interest_rate,tenure",
+    "insights_numeric": "Please provide proper numeric values for all parameters.",
+    "busy": "We're receiving a lot of messages right now. Please try again in a minute.",
+    "queued": "We're busy right now. Your reply will follow in a moment.",
+    "rate_limited": "You're sending messages faster than I can answer. Please wait a moment and try again.",
+}
+
+# Hand-written translations take precedence over machine translation
+MANUAL_TRANSLATIONS = {
+    "no_response": {
+        "hi-IN": "मैं आपके अनुरोध को संसाधित नहीं कर सका। कृपया पुनः प्रयास करें।",
+        "ta-IN": "உங்கள் கோரிக்கையை செயலாக்க முடியவில்லை. தயவுசெய்து மீண்டும் முயற்சிக்கவும்.",
+    },
+}
+
+
+class Catalog:
+    """
+    Pre-rendered canned replies: text and S3 audio URL per message and language.
+
+    Built offline by build(); the JSON file can be reviewed and hand-edited before deploy.
+    """
+
+    def __init__(self, entries=None, audio_format=WHATSAPP_AUDIO_FORMAT):
+        self.entries = entries or {}  # name -> language_code -> {"text", "audio_url"}
+        # Audio rendered in another format can't be reused
+        self._audio = {}  # (text, language_code) -> audio URL
+        for languages in self.entries.values():
+            for language_code, entry in languages.items():
+                if entry.get("audio_url") and entry.get("audio_format", audio_format) == audio_format:
+                    self._audio[(entry["text"], language_code)] = entry["audio_url"]
+
+    @classmethod
+    def load(cls, path=CANNED_CATALOG_PATH):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            log.info("canned_catalog_missing", path=path)
+            return cls()
+        except (OSError, ValueError) as e:
+            log.error("canned_catalog_unreadable", path=path, error=str(e))
+            return cls()
+        catalog = cls(data.get("messages", {}))
+        log.info("canned_catalog_loaded", messages=len(catalog.entries), clips=len(catalog._audio))
+        return catalog
+
+    def text(self, name, language_code):
+        entry = self.entries.get(name, {}).get(language_code)
+        return entry["text"] if entry else None
+
+    def audio_url(self, text, language_code):
+        return self._audio.get((text, language_code))
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def catalog():
+    """Returns the catalog loaded from CANNED_CATALOG_PATH (empty if it hasn't been built)."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog.load()
+        return _catalog
+
+
+def get(name, language_code="en-IN", memory_only=False):
+    """
+    Returns a canned reply in the given language without calling any API, or None.
+
+    Looks in the catalog, then the hand-written translations, then the phrase cache.
+
+    :param memory_only: Don't read the phrase cache's SQLite file (for event-loop callers)
+    """
+    if translation_service.api_language(language_code) == "en":
+        return MESSAGES[name]
+    translation = catalog().text(name, language_code) or _translation(name, language_code, memory_only)
+    metrics.inc("canned_responses_total", result="hit" if translation else "miss")
+    return translation
+
+
+def _translation(name, language_code, memory_only=False):
+    return (
+        MANUAL_TRANSLATIONS.get(name, {}).get(language_code)
+        or translation_service.lookup(MESSAGES[name], "en", language_code, memory_only)
+    )
+
+
+def text(name, language_code="en-IN", memory_only=False):
+    """Returns a canned reply in the given language, or in English if it isn't translated yet."""
+    return get(name, language_code, memory_only) or MESSAGES[name]
+
+
+def audio_url(text, language_code):
+    """Returns the pre-rendered audio URL for a canned reply's exact text, or None."""
+    return catalog().audio_url(text, language_code)
+
+
+def build(languages, synthesize=None, path=CANNED_CATALOG_PATH, workers=8):
+    """
+    Renders every canned message in every language and writes the catalog.
+
+    :param languages: Language codes such as "hi-IN"
+    :param synthesize: Callable(text, language_code) returning a public audio URL, or None to skip audio
+    :param path: Catalog file to write
+    :param workers: Clips synthesized and uploaded in parallel
+    :return: The catalog data that was written
+    """
+    languages = list(dict.fromkeys(languages))
+    # Batched: one API call per language for every TRANSLATION_BATCH_MAX messages
+    translation_service.precompute(MESSAGES.values(), languages)
+
+    messages = {name: {} for name in MESSAGES}
+    for name, english in MESSAGES.items():
+        for language_code in languages:
+            messages[name][language_code] = {
+                # Rebuilt from the sources, not from the catalog being replaced
+                "text": english if translation_service.api_language(language_code) == "en"
+                else _translation(name, language_code) or english,
+                "audio_format": WHATSAPP_AUDIO_FORMAT,
+            }
+
+    if synthesize is not None:
+        entries = [item for by_language in messages.values() for item in by_language.items()]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="canned-tts") as executor:
+            urls = executor.map(lambda item: synthesize(item[1]["text"], item[0]), entries)
+            for (language_code, entry), url in zip(entries, urls):
+                entry["audio_url"] = url
+                if not url:
+                    log.warning("canned_audio_failed", language=language_code, chars=len(entry["text"]))
+
+    data = {"built_at": int(time.time()), "messages": messages}
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+    log.info("canned_catalog_built", path=path, messages=len(messages), languages=len(languages))
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render the canned replies (text and S3 audio) in every language")
+    parser.add_argument("--output", default=CANNED_CATALOG_PATH, help="Catalog file to write")
+    parser.add_argument("--no-audio", action="store_true", help="Only translate; skip TTS and S3 uploads")
+    parser.add_argument("--workers", type=int, default=8, help="Clips synthesized in parallel")
+    args = parser.parse_args()
+
+    # The app owns the credentials, language list and the TTS -> S3 upload path;
+    # build() translates everything itself, so skip the app's startup precompute
+    translation_service.TRANSLATION_PRECOMPUTE = False
+    import app
+
+    synthesize = None if args.no_audio else app.synthesize_to_url
+    data = build(app.LANGUAGE_MAP.values(), synthesize, args.output, args.workers)
+    clips = sum(1 for languages in data["messages"].values() for entry in languages.values() if entry.get("audio_url"))
+    print(f"Wrote {args.output}: {len(data['messages'])} messages, {clips} audio clips")
+
+
+if __name__ == "__main__":
+    main()
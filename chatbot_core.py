@@ -0,0 +1,374 @@
+import math
+import os
+import socket
+import time
+import uuid
+from contextlib import nullcontext
+
+import boto3
+import numpy as np
+from botocore.config import Config as BotoConfig
+from dotenv import load_dotenv
+
+# Shared by the Flask (app.py) and ASGI (asgi_app.py) services: settings, credentials,
+# language tables, prompts and the S3 upload path. Importing it builds no web app,
+# thread pools or background threads.
+
+load_dotenv()
+
+# Local modules read their settings from the environment at import, so load .env first
+import admission
+import app_logging
+import canned_responses
+import circuit_breaker
+import emi_batch
+import gemini_client
+import http_client
+import metrics
+import session_store
+import transcoder
+import tts_cache
+
+log = app_logging.get_logger("chatbot_core")
+
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+AWS_REGION = os.getenv("AWS_REGION", "us-east-1")  # Default to us-east-1
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")  # Your S3 bucket name
+
+# Initialize S3 client (pooled connections, bounded timeouts, jittered retries)
+s3_client = boto3.client(
+    "s3",
+    aws_access_key_id=AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+    region_name=AWS_REGION,
+    config=BotoConfig(
+        max_pool_connections=http_client.HTTP_POOL_SIZE,
+        connect_timeout=http_client.HTTP_CONNECT_TIMEOUT,
+        read_timeout=http_client.HTTP_READ_TIMEOUT,
+        retries={"max_attempts": http_client.HTTP_MAX_RETRIES + 1, "mode": "standard"}
+    )
+)
+
+SARVAM_API_KEY = os.getenv("SARVAM_API_KEY")
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")  # Gemini API key
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+# Handle each MessageSid once; Twilio retries get the original reply (see dedupe.py)
+WEBHOOK_DEDUPE = os.getenv("WEBHOOK_DEDUPE", "true").lower() in ("1", "true", "yes")
+
+# Per-sender rate limits and per-upstream concurrency limits (see admission.py)
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+
+# Send a second language detection request when the first is slower than usual (see circuit_breaker.py)
+LANGUAGE_DETECT_HEDGE = os.getenv("LANGUAGE_DETECT_HEDGE", "").lower() in ("1", "true", "yes")
+
+# Audio format for voice replies: "mp3" or "ogg" (Opus, shown as a voice note)
+WHATSAPP_AUDIO_FORMAT = os.getenv("WHATSAPP_AUDIO_FORMAT", "mp3").lower()
+
+# Remember recent turns per WhatsApp number so follow-up messages keep their context
+CHAT_MEMORY = os.getenv("CHAT_MEMORY", "true").lower() in ("1", "true", "yes")
+
+# Size limits for /emi/batch: priced loans per request, and loans that may ask for a full schedule
+EMI_BATCH_MAX_ROWS = int(os.getenv("EMI_BATCH_MAX_ROWS", "10000"))
+EMI_BATCH_MAX_SCHEDULES = int(os.getenv("EMI_BATCH_MAX_SCHEDULES", "100"))
+
+# Validate environment variables
+if not SARVAM_API_KEY:
+    raise ValueError("SARVAM_API_KEY is not set.")
+if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
+    raise ValueError("Twilio credentials are not set.")
+if not GEMINI_API_KEY and not gemini_client.GEMINI_FAKE:
+    raise ValueError("GEMINI_API_KEY is not set.")
+
+# Configure Gemini API
+gemini_client.configure()
+
+# Locate ffmpeg once at startup rather than on every conversion
+transcoder.find_ffmpeg()
+
+# Check internet connectivity
+try:
+    socket.gethostbyname('www.google.com')
+    log.info("connectivity_check_ok")
+except Exception as e:
+    log.warning("connectivity_check_failed", error=str(e))
+
+
+def chatbot_response(message):
+    # Temporary response logic (replace with Gemini / LangChain)
+    return f"You said: {message}. I'll calculate your loan options soon!"
+
+
+# Map detected base language codes to the Indian variants used for TTS
+LANGUAGE_MAP = {
+    "en": "en-IN",
+    "hi": "hi-IN",
+    "ta": "ta-IN",
+    "te": "te-IN",
+    "kn": "kn-IN",
+    "ml": "ml-IN",
+    "bn": "bn-IN",
+    "gu": "gu-IN",
+    "mr": "mr-IN",
+    "pa": "pa-IN"
+}
+
+# Sarvam TTS voice settings (also part of the TTS cache key)
+TTS_SPEAKER = "meera"
+TTS_MODEL = "bulbul:v1"
+TTS_SAMPLE_RATE = 16000  # Higher quality for WhatsApp
+
+# Updated language-speaker mapping with more precise matching
+LANGUAGE_SPEAKER_MAP = {
+    "en-IN": "meera",     # Indian English
+    "hi-IN": "indic",     # Hindi
+    "ta-IN": "indic",     # Tamil
+    "kn-IN": "indic",     # Kannada
+    "te-IN": "indic",     # Telugu
+    "ml-IN": "indic",     # Malayalam
+    "bn-IN": "indic",     # Bengali
+    "pa-IN": "indic",     # Punjabi
+    "gu-IN": "indic",     # Gujarati
+    "mr-IN": "indic"      # Marathi
+}
+
+
+def tts_language_code(language_code):
+    """Standardizes a language code to the Indian variant the TTS API expects."""
+    # Handle cases where we might get just the language code without region
+    base_language = language_code.split('-')[0] if '-' in language_code else language_code
+
+    # Try exact match first, then try base language
+    if language_code not in LANGUAGE_SPEAKER_MAP and f"{base_language}-IN" in LANGUAGE_SPEAKER_MAP:
+        return f"{base_language}-IN"
+    return language_code
+
+
+def tts_cache_key(text, language_code):
+    """Content hash of everything that determines the synthesized audio."""
+    return tts_cache.cache_key(text, tts_language_code(language_code), TTS_SPEAKER, TTS_MODEL, TTS_SAMPLE_RATE)
+
+
+# Language names used to tell Gemini which language to answer in
+LANGUAGE_NAMES = {
+    "en-IN": "English",
+    "hi-IN": "Hindi",
+    "ta-IN": "Tamil",
+    "te-IN": "Telugu",
+    "kn-IN": "Kannada",
+    "ml-IN": "Malayalam",
+    "bn-IN": "Bengali",
+    "gu-IN": "Gujarati",
+    "mr-IN": "Marathi",
+    "pa-IN": "Punjabi"
+}
+
+
+def is_help_command(text):
+    """Returns True if the message asks for the command list."""
+    return text.lower() == "help" or text.lower() == "commands"
+
+
+HELP_TEXT = canned_responses.MESSAGES["help"]
+
+# Fixed replies whose translations are computed once at startup and kept on disk
+STATIC_PHRASES = list(canned_responses.MESSAGES.values())
+
+
+def build_chat_prompt(text, language_code="en-IN"):
+    """Builds the conversational prompt, including language instructions."""
+    language_name = LANGUAGE_NAMES.get(language_code, "the user's language")
+
+    # Create a context/system prompt for the model that includes language instructions
+    return f"""
+        You are an assistant for an Indian language conversational WhatsApp chatbot.
+        The user has sent a message in {language_name}.
+
+        Original user message: {text}
+
+        Respond to the user query in a helpful, conversational manner.
+        Keep your response concise (50-70 words) and direct.
+
+        IMPORTANT: Please respond in {language_name}. If you're not sure about the language,
+        respond in the same language as the user's message.
+        """
+
+
+def no_response_message(language_code="en-IN"):
+    """Message sent when Gemini returns nothing usable."""
+    # Respond in the detected language if possible
+    return canned_responses.text("no_response", language_code)
+
+
+def conversation_history(user):
+    """Returns the user's earlier turns as Gemini chat history (empty without CHAT_MEMORY)."""
+    if not user or not CHAT_MEMORY:
+        return []
+    return session_store.get_store().history(user)
+
+
+def remember_exchange(user, message, reply):
+    """Stores a message and its reply in the user's session."""
+    if user and CHAT_MEMORY:
+        session_store.get_store().record_exchange(user, message, reply)
+
+
+def voice_available():
+    """False while the TTS or Twilio breaker is open; the reply then goes out as text only."""
+    return circuit_breaker.available("sarvam.tts") and circuit_breaker.available("twilio.messages")
+
+
+def voice_permit():
+    """Holds Sarvam and Twilio permits for an audio leg; yields False when either is saturated."""
+    if not ADMISSION_CONTROL:
+        return nullcontext(True)
+    return admission.get_controller().permit(*admission.VOICE_UPSTREAMS)
+
+
+def upload_to_s3(data, s3_file_name, content_type="audio/mp3"):
+    """
+    Uploads in-memory audio to S3 and returns the public URL.
+
+    :param data: Audio file contents (bytes)
+    :param s3_file_name: Object key to save in S3
+    :param content_type: MIME type stored with the object
+    :return: Public URL of the uploaded file
+    """
+    try:
+        start = time.monotonic()
+        with metrics.stage("s3"), circuit_breaker.get("s3.upload").guard():
+            s3_client.put_object(
+                Bucket=S3_BUCKET_NAME,
+                Key=s3_file_name,
+                Body=data,
+                ContentType=content_type
+            )
+        metrics.observe("http_request_seconds", time.monotonic() - start, endpoint="s3.upload")
+
+        # Generate the URL
+        s3_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{s3_file_name}"
+        log.info("s3_uploaded", sampled=True, key=s3_file_name, bytes=len(data))
+        return s3_url
+
+    except Exception as e:
+        log.error("s3_upload_error", key=s3_file_name, error=str(e))
+        return None
+
+
+def upload_tts_audio(audio_bytes, cache_key=None):
+    """
+    Encodes TTS audio for WhatsApp and uploads it to S3.
+
+    :param audio_bytes: WAV audio from text_to_speech
+    :param cache_key: TTS cache key; when given the upload is content-addressed and its URL remembered
+    :return: Public URL, or None on failure
+    """
+    if not audio_bytes:
+        log.warning("tts_upload_skipped", reason="no audio")
+        return None
+
+    # Encode the TTS WAV for WhatsApp, falling back to the raw WAV if ffmpeg is unavailable
+    with metrics.stage("encode"):
+        encoded = transcoder.encode_for_whatsapp(audio_bytes, WHATSAPP_AUDIO_FORMAT)
+    if encoded:
+        audio_bytes, content_type, extension = encoded
+    else:
+        content_type, extension = "audio/wav", "wav"
+
+    # Upload to S3
+    if cache_key:
+        s3_file_name = f"tts/{cache_key}.{extension}"
+    else:
+        s3_file_name = f"audio_tts_output_{uuid.uuid4()}.{extension}"
+    public_url = upload_to_s3(audio_bytes, s3_file_name, content_type)
+
+    if not public_url:
+        log.error("tts_upload_failed", key=s3_file_name)
+        return None
+
+    # Only the encoded upload is indexed; a WAV fallback must not answer lookups for the WhatsApp format
+    if cache_key and encoded:
+        tts_cache.url_index().put(f"{cache_key}.{extension}", public_url, content_type)
+    return public_url
+
+
+def wants_voice(values):
+    """True if the message would normally get a spoken reply as well as text."""
+    if int(values.get('NumMedia', 0)) > 0:
+        return 'audio' in (values.get('MediaContentType0') or '')
+    body = values.get('Body', '').strip().lower()
+    return bool(body) and not body.startswith(("loan:", "insights:"))
+
+
+def message_upstreams(values):
+    """Upstreams a message keeps busy while the webhook is processing it."""
+    if int(values.get('NumMedia', 0)) > 0:
+        return ("sarvam", "gemini")
+    if values.get('Body', '').strip().lower().startswith("tts:"):
+        # Speech is produced in the background, under its own permits
+        return ()
+    return ("gemini",)
+
+
+def _finite(value, field):
+    """float(value), rejecting NaN and infinities (which JSON can't carry back)."""
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"{field} must hold finite numbers")
+    return value
+
+
+def emi_batch_response(body):
+    """
+    Prices the loans in an /emi/batch request body.
+
+    Body: {"loan_amounts": [...], "interest_rates": [...], "tenures": [...],
+           "grid": true, "income": 1200000, "expenses": 300000, "schedule": false}
+    With "grid" every amount x rate x tenure combination is priced; otherwise the
+    three lists are matched element-wise. DTI is included when income is given.
+
+    :return: (JSON-serializable payload, HTTP status)
+    """
+    try:
+        amounts = [_finite(value, "loan_amounts") for value in body["loan_amounts"]]
+        rates = [_finite(value, "interest_rates") for value in body["interest_rates"]]
+        tenures = [_finite(value, "tenures") for value in body["tenures"]]
+        income, expenses = (None if body.get(field) is None else _finite(body[field], field) for field in ("income", "expenses"))
+        grid = bool(body.get("grid", True))
+        rows = len(amounts) * len(rates) * len(tenures) if grid else max(len(amounts), len(rates), len(tenures))
+        if rows > EMI_BATCH_MAX_ROWS:
+            return {"error": f"At most {EMI_BATCH_MAX_ROWS} loans per request"}, 400
+
+        price = emi_batch.price_grid if grid else emi_batch.price
+        priced = price(amounts, rates, tenures, income, expenses)
+    except (KeyError, TypeError, ValueError) as e:
+        return {"error": f"Invalid request: {str(e)}"}, 400
+    # Finite inputs can still overflow (e.g. a huge rate over a long tenure)
+    if not all(np.isfinite(values).all() for values in priced.values()):
+        return {"error": "Invalid request: loan figures out of range"}, 400
+
+    columns = {name: values.ravel().tolist() for name, values in priced.items()}
+    results = [dict(zip(columns, row)) for row in zip(*columns.values())]
+    response = {"results": results}
+
+    if body.get("schedule"):
+        if len(results) > EMI_BATCH_MAX_SCHEDULES:
+            return {"error": f"Schedules are limited to {EMI_BATCH_MAX_SCHEDULES} loans per request"}, 400
+        tables = emi_batch.amortization(priced["loan_amount"].ravel(), priced["interest_rate"].ravel(), priced["tenure"].ravel())
+        response["schedules"] = [
+            [
+                {"month": month, "payment": payment, "interest": interest, "principal": principal, "balance": balance}
+                for month, payment, interest, principal, balance in zip(
+                    tables["month"].tolist(), tables["payment"][i].tolist(), tables["interest"][i].tolist(),
+                    tables["principal"][i].tolist(), tables["balance"][i].tolist()
+                )
+                if month <= months
+            ]
+            for i, months in enumerate((priced["tenure"].ravel() * 12).tolist())
+        ]
+
+    return response, 200
@@ -0,0 +1,269 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from contextlib import contextmanager
+
+import app_logging
+import metrics
+
+log = app_logging.get_logger("circuit_breaker")
+
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))  # Recent calls judged per upstream
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))  # Calls needed before the breaker may open
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))  # Share of failed or slow calls that opens it
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "10"))  # A call slower than this counts as failed
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # Fail fast this long before probing again
+# Gemini answers take seconds even when healthy
+SLOW_SECONDS = {"gemini": float(os.getenv("BREAKER_GEMINI_SLOW_SECONDS", "25"))}
+
+# Hedged requests: a second identical request when the first is slower than usual
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "0"))  # 0: the endpoint's observed p95
+HEDGE_MIN_DELAY = 0.05  # Seconds; never hedge sooner than this
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "16"))
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}  # circuit_breaker_state gauge
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, name):
+        super().__init__(f"{name} circuit is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing or stalling.
+
+    Closed: calls go through and their outcomes fill a rolling window. When enough of
+    the window failed (an error, a 5xx or a call over slow_seconds) the breaker opens
+    and calls fail fast with CircuitOpenError. After open_seconds one probe call is let
+    through (half-open); its outcome closes the breaker or opens it again.
+    """
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_ratio=BREAKER_FAILURE_RATIO, slow_seconds=None, open_seconds=BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_seconds = SLOW_SECONDS.get(name, BREAKER_SLOW_SECONDS) if slow_seconds is None else slow_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True for each failed call
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        metrics.set_gauge("circuit_breaker_state", STATE_VALUES[CLOSED], breaker=name)
+
+    def before(self):
+        """Call before each attempt; raises CircuitOpenError if the upstream must not be called."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            # A probe that never reported back (cancelled) is given up after open_seconds
+            probing = self._probing and now - self._probe_started < self.open_seconds
+            if self.state == OPEN or (self.state == HALF_OPEN and probing):
+                metrics.inc("circuit_breaker_rejected_total", breaker=self.name)
+                raise CircuitOpenError(self.name)
+            if self.state == HALF_OPEN:
+                self._probing = True
+                self._probe_started = now
+
+    def record(self, success, seconds):
+        """Reports an attempt's outcome and duration."""
+        failed = not success or seconds >= self.slow_seconds
+        with self._lock:
+            if self.state == HALF_OPEN and self._probing:
+                self._probing = False
+                self._transition(OPEN if failed else CLOSED)
+                return
+            self._outcomes.append(failed)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) >= self.failure_ratio * len(self._outcomes)):
+                self._transition(OPEN)
+
+    def abandon(self):
+        """Ends an attempt without an outcome (the caller stopped early); frees the half-open probe."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    @contextmanager
+    def guard(self):
+        """with breaker.guard(): call() -- fails fast when open; an exception counts as a failure."""
+        self.before()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.record(False, time.monotonic() - start)
+            raise
+        self.record(True, time.monotonic() - start)
+
+    def available(self):
+        """False while the breaker is open and not yet due for a probe."""
+        with self._lock:
+            return self.state != OPEN or time.monotonic() - self._opened_at >= self.open_seconds
+
+    def _transition(self, state):
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        self._probing = False
+        self._outcomes.clear()
+        previous, self.state = self.state, state
+        metrics.set_gauge("circuit_breaker_state", STATE_VALUES[state], breaker=self.name)
+        metrics.inc("circuit_breaker_transitions_total", breaker=self.name, state=state)
+        if state == OPEN:
+            log.warning("circuit_opened", breaker=self.name, previous=previous, seconds=self.open_seconds)
+        else:
+            log.info("circuit_state", breaker=self.name, state=state)
+
+
+class _Disabled:
+    """Stand-in used when BREAKER_ENABLED is off."""
+
+    name = None
+    state = CLOSED
+
+    def before(self):
+        pass
+
+    def record(self, success, seconds):
+        pass
+
+    def abandon(self):
+        pass
+
+    @contextmanager
+    def guard(self):
+        yield
+
+    def available(self):
+        return True
+
+
+_DISABLED = _Disabled()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get(name):
+    """Returns the breaker for an upstream endpoint (e.g. "sarvam.tts", "gemini"), creating it on first use."""
+    if not BREAKER_ENABLED:
+        return _DISABLED
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def available(name):
+    """True unless name's breaker is open (use to skip work that would fail fast anyway)."""
+    return get(name).available()
+
+
+def states():
+    """Returns {breaker name: state} for every breaker created so far."""
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+def hedge_delay(endpoint):
+    """Seconds to wait before hedging: HEDGE_DELAY_MS, or the endpoint's observed p95 latency."""
+    if HEDGE_DELAY_MS > 0:
+        return HEDGE_DELAY_MS / 1000
+    p95 = metrics.quantile("http_request_seconds", 0.95, endpoint=endpoint)
+    return max(HEDGE_MIN_DELAY, p95 if p95 is not None else 0.3)
+
+
+def _is_none(result):
+    return result is None
+
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _executor():
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+        return _hedge_executor
+
+
+def _settle(futures, is_failure, result_of):
+    # Returns the first good result, or the last one if every request failed
+    result = None
+    for future in futures:
+        try:
+            result = result_of(future)
+        except Exception:
+            result = None
+        if not is_failure(result):
+            return result, True
+    return result, False
+
+
+def hedge(func, *args, delay, endpoint=None, is_failure=_is_none):
+    """
+    Calls func(*args); if it hasn't answered after delay seconds, calls it again and
+    returns whichever answer comes first. Only for idempotent reads.
+
+    :param is_failure: Predicate for results that shouldn't win (default: None)
+    """
+    executor = _executor()
+    first = executor.submit(func, *args)
+    try:
+        return first.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+
+    second = executor.submit(func, *args)
+    pending = {first, second}
+    result = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        result, good = _settle(done, is_failure, lambda future: future.result())
+        if good:
+            winner = "first" if first in done else "second"
+            metrics.inc("hedged_requests_total", endpoint=endpoint or "other", winner=winner)
+            return result
+    metrics.inc("hedged_requests_total", endpoint=endpoint or "other", winner="none")
+    return result
+
+
+async def hedge_async(func, *args, delay, endpoint=None, is_failure=_is_none):
+    """Async counterpart of hedge for a coroutine function; the slower request is cancelled."""
+    first = asyncio.ensure_future(func(*args))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    second = asyncio.ensure_future(func(*args))
+    pending = {first, second}
+    result = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            result, good = _settle(done, is_failure, lambda task: task.result())
+            if good:
+                winner = "first" if first in done else "second"
+                metrics.inc("hedged_requests_total", endpoint=endpoint or "other", winner=winner)
+                return result
+        metrics.inc("hedged_requests_total", endpoint=endpoint or "other", winner="none")
+        return result
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,5 +1,16 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import functools
 import os
+import threading
+import time
+from contextlib import contextmanager
+
+import app_logging
+import metrics
+
+log = app_logging.get_logger("db_connector")
 
 # ✅ Load database credentials from environment variables
 DB_CONFIG = {
@@ -9,33 +20,341 @@ DB_CONFIG = {
     "port": os.getenv("POSTGRES_PORT", "5432"),
 }
 
-def fetch_similar_loans(income, expenses, cibil_score):
-    """Fetches similar loan records from PostgreSQL based on user input."""
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_CONFIG["dbname"],
-            user=DB_CONFIG["user"],
-            host=DB_CONFIG["host"],
-            port=DB_CONFIG["port"]
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # Seconds to wait for a free connection
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+DB_HEALTHCHECK_INTERVAL = float(os.getenv("DB_HEALTHCHECK_INTERVAL", "30"))  # Idle seconds before a ping
+
+# How far a historical loan may be from the applicant and still count as similar;
+# the same widths normalize each column when ranking by distance
+INCOME_WINDOW = 1000000
+EXPENSES_WINDOW = 500000
+CIBIL_WINDOW = 50
+SIMILAR_LOANS_LIMIT = 5
+
+# Server-side prepared statement for the similar-loans lookup (prepared once per connection).
+# Plain range predicates on the bare columns let the planner use the indexes from
+# migrations/001_similar_loans_indexes.sql; results come back nearest first.
+SIMILAR_LOANS_STATEMENT = "similar_loans"
+SIMILAR_LOANS_SQL = f"""
+SELECT income_annum, expenses, cibil_score, loan_status
+FROM my_table
+WHERE income_annum > $1 - {INCOME_WINDOW} AND income_annum < $1 + {INCOME_WINDOW}
+AND expenses > $2 - {EXPENSES_WINDOW} AND expenses < $2 + {EXPENSES_WINDOW}
+AND cibil_score > $3 - {CIBIL_WINDOW} AND cibil_score < $3 + {CIBIL_WINDOW}
+ORDER BY ((income_annum - $1)::float8 / {INCOME_WINDOW}) ^ 2
+    + ((expenses - $2)::float8 / {EXPENSES_WINDOW}) ^ 2
+    + ((cibil_score - $3)::float8 / {CIBIL_WINDOW}) ^ 2
+LIMIT {SIMILAR_LOANS_LIMIT}
+"""
+# Parameter types match the integer columns so the comparisons stay index-compatible
+SIMILAR_LOANS_PARAM_TYPES = "(bigint, bigint, bigint)"
+
+# Answer fetch_similar_loans from an in-memory copy of the table instead of SQL (see loan_knn.py)
+LOAN_KNN_ENGINE = os.getenv("LOAN_KNN_ENGINE", "").lower() in ("1", "true", "yes")
+# Seconds before retrying a failed table load; doubles per failure up to LOAN_KNN_RETRY_MAX_SECONDS
+LOAN_KNN_RETRY_SECONDS = float(os.getenv("LOAN_KNN_RETRY_SECONDS", "5"))
+LOAN_KNN_RETRY_MAX_SECONDS = float(os.getenv("LOAN_KNN_RETRY_MAX_SECONDS", "300"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT."""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that carries its own pool bookkeeping (psycopg2 connections can't be weakly referenced)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_used = None  # Monotonic time it was last returned to the pool
+        self.prepared = set()  # Names of statements prepared on this server session
+
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL pool that blocks (up to a timeout) when every connection is busy.
+
+    Returned connections stay open for the next request, so connection setup is paid once
+    per connection rather than per query. Connections that sat idle longer than
+    DB_HEALTHCHECK_INTERVAL are pinged before use, and each one carries a server-side
+    statement timeout.
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT, **connect_kwargs):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._connect_kwargs = dict(
+            connect_kwargs,
+            options=f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+            connection_factory=PooledConnection
         )
-        cursor = conn.cursor()
-
-        query = """
-        SELECT income_annum, expenses, cibil_score, loan_status
-        FROM my_table
-        WHERE ABS(income_annum - %s) < 1000000 
-        AND ABS(expenses - %s) < 500000 
-        AND ABS(cibil_score - %s) < 50
-        LIMIT 5;
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._idle = []  # Open connections ready for reuse, most recently returned last
+        self._in_use = 0
+        for _ in range(min(minconn, maxconn)):
+            self._checkin(self._connect())
+
+    def _connect(self):
+        metrics.inc("db_connections_opened_total")
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _checkin(self, conn):
+        # Anything but a cleanly idle session is closed rather than handed to the next caller
+        if conn.closed or conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._discard(conn)
+            return
+        conn.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(conn)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if conn.last_used is not None and time.monotonic() - conn.last_used < DB_HEALTHCHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            metrics.inc("db_pool_healthcheck_failures_total")
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _set_in_use(self, delta):
+        with self._lock:
+            self._in_use += delta
+            metrics.set_gauge("db_pool_in_use", self._in_use)
+
+    @contextmanager
+    def connection(self):
+        """Checks out a healthy connection for the duration of the with-block."""
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            metrics.inc("db_pool_timeouts_total")
+            raise PoolTimeout(f"No database connection free after {self.timeout}s")
+        metrics.observe("db_pool_wait_seconds", time.monotonic() - start)
+
+        conn = None
+        try:
+            conn = self._checkout()
+            if not self._is_healthy(conn):
+                self._discard(conn)
+                conn = self._connect()
+            self._set_in_use(1)
+            try:
+                yield conn
+            finally:
+                self._set_in_use(-1)
+                # End the read transaction so the connection goes back idle
+                if not conn.closed:
+                    conn.rollback()
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+            self._slots.release()
+
+    def prepare(self, conn, name, sql, param_types=""):
+        """Prepares a statement on this connection unless it already is."""
+        if name in conn.prepared:
+            return
+        with conn.cursor() as cursor:
+            cursor.execute(f"PREPARE {name} {param_types} AS {sql}")
+        conn.prepared.add(name)
+
+    def fetch_prepared(self, conn, name, sql, param_types, params):
         """
-        
-        cursor.execute(query, (income, expenses, cibil_score))
-        results = cursor.fetchall()
+        Runs a prepared statement and returns its rows, preparing it first if needed.
+
+        A statement the server no longer knows (DEALLOCATE, a pooler switching sessions)
+        is prepared again and the query retried once.
+        """
+        self.prepare(conn, name, sql, param_types)
+        placeholders = ", ".join(["%s"] * len(params))
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+                return cursor.fetchall()
+        except psycopg2.errors.InvalidSqlStatementName:
+            conn.rollback()
+            conn.prepared.discard(name)
+            metrics.inc("db_statement_reprepared_total", statement=name)
+        self.prepare(conn, name, sql, param_types)
+        with conn.cursor() as cursor:
+            cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+            return cursor.fetchall()
+
+    def stats(self):
+        """Returns pool size and usage figures."""
+        with self._lock:
+            return {"max": self.maxconn, "in_use": self._in_use, "idle": len(self._idle)}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_pid = None
+_forked_pools = []  # Pools inherited from a parent process; kept referenced so their sessions are never closed here
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use (and again after a fork)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid != os.getpid():
+            _forked_pools.append(_pool)
+            _pool = None
+        if _pool is None:
+            _pool = ConnectionPool(**DB_CONFIG)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+_knn_engine = None
+_knn_engine_pid = None
+_knn_engine_started = False
+_knn_load_failures = 0
+_knn_retry_at = 0.0  # Monotonic time before which a failed load isn't retried
+_knn_engine_lock = threading.Lock()
+
+
+def knn_id_column():
+    """
+    LOAN_KNN_ID_COLUMN if my_table has that column, otherwise None (the engine then
+    reloads the whole table on every refresh).
+    """
+    import loan_knn
+
+    id_column = loan_knn.LOAN_KNN_ID_COLUMN
+    if not id_column:
+        return None
+    with get_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM information_schema.columns WHERE table_name = 'my_table' AND column_name = %s",
+                (id_column,)
+            )
+            if cursor.fetchone():
+                return id_column
+    log.warning("loan_knn_id_column_missing", column=id_column)
+    return None
+
+
+def fetch_loan_rows(after_id=None, id_column=None):
+    """
+    Reads (id, income_annum, expenses, cibil_score, loan_status) rows for the k-NN engine.
+
+    :param after_id: Only return rows with a larger id (incremental refresh)
+    :param id_column: Monotonic id column from knn_id_column(); without one ids are NULL
+    """
+    if id_column:
+        query = f"SELECT {id_column}, income_annum, expenses, cibil_score, loan_status FROM my_table"
+        params = ()
+        if after_id is not None:
+            query += f" WHERE {id_column} > %s"
+            params = (after_id,)
+        query += f" ORDER BY {id_column}"
+    else:
+        query = "SELECT NULL, income_annum, expenses, cibil_score, loan_status FROM my_table"
+        params = ()
+
+    with get_pool().connection() as conn:
+        # Server-side cursor so a large table streams instead of landing in one result
+        with conn.cursor(name="loan_knn_load") as cursor:
+            cursor.itersize = 50000
+            cursor.execute(query, params)
+            return list(cursor)
+
+
+def start_knn_engine(wait=True):
+    """
+    Loads the loan table into the k-NN engine once per process when LOAN_KNN_ENGINE is set.
+
+    Call it after the server forks its workers (e.g. on the first request), not at import:
+    neither the pool nor the refresh timer survives a fork. A failed load is retried on a
+    later call, with exponential backoff.
+
+    :param wait: Block until the table is loaded; otherwise load it in a background thread
+    """
+    global _knn_engine, _knn_engine_pid, _knn_engine_started, _knn_load_failures, _knn_retry_at
+    with _knn_engine_lock:
+        if _knn_engine_pid != os.getpid():
+            # Forked from a process that had already loaded (or was loading) the table
+            _knn_engine, _knn_engine_pid, _knn_engine_started = None, os.getpid(), False
+            _knn_load_failures, _knn_retry_at = 0, 0.0
+        if _knn_engine_started or time.monotonic() < _knn_retry_at:
+            return
+        _knn_engine_started = True
+    if wait:
+        _load_knn_engine()
+    else:
+        threading.Thread(target=_load_knn_engine, name="loan-knn-load", daemon=True).start()
+
+
+def _load_knn_engine():
+    global _knn_engine, _knn_engine_started, _knn_load_failures, _knn_retry_at
+    try:
+        import loan_knn
+
+        engine = loan_knn.LoanKNNEngine(
+            functools.partial(fetch_loan_rows, id_column=knn_id_column()),
+            (INCOME_WINDOW, EXPENSES_WINDOW, CIBIL_WINDOW)
+        )
+        engine.start()
+        _knn_engine = engine
+    except Exception as e:
+        with _knn_engine_lock:
+            delay = min(LOAN_KNN_RETRY_SECONDS * 2 ** _knn_load_failures, LOAN_KNN_RETRY_MAX_SECONDS)
+            _knn_load_failures += 1
+            _knn_retry_at = time.monotonic() + delay
+            _knn_engine_started = False
+        log.warning("loan_knn_unavailable", error=str(e), retry_in=delay)
+
+
+def get_knn_engine():
+    """
+    Returns the loaded k-NN engine, or None while it is loading or if it couldn't be loaded
+    (callers then use SQL). Never waits for the table load.
+    """
+    start_knn_engine(wait=False)
+    return _knn_engine
+
+
+def fetch_similar_loans(income, expenses, cibil_score):
+    """Fetches the closest similar loan records from PostgreSQL based on user input."""
+    try:
+        if LOAN_KNN_ENGINE:
+            engine = get_knn_engine()
+            if engine is not None:
+                return engine.query(income, expenses, cibil_score, SIMILAR_LOANS_LIMIT)
 
-        conn.close()
-        
-        return results
+        db_pool = get_pool()
+        with db_pool.connection() as conn:
+            return db_pool.fetch_prepared(
+                conn, SIMILAR_LOANS_STATEMENT, SIMILAR_LOANS_SQL, SIMILAR_LOANS_PARAM_TYPES,
+                (int(income), int(expenses), int(cibil_score))
+            )
 
     except Exception as e:
-        print(f"Database Error: {e}")
-        return []
\ No newline at end of file
+        log.error("database_error", error=str(e))
+        return []
@@ -0,0 +1,287 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEDUPE_BACKEND = os.getenv("DEDUPE_BACKEND", "memory")  # "memory" or "sqlite"
+DEDUPE_TTL = float(os.getenv("DEDUPE_TTL", "3600"))  # Seconds a finished reply is replayed to retries
+DEDUPE_MAX_ENTRIES = int(os.getenv("DEDUPE_MAX_ENTRIES", "100000"))
+DEDUPE_PATH = os.getenv("DEDUPE_PATH", os.path.join(BASE_DIR, "dedupe.sqlite3"))
+# A retry waits this long for the original to finish before acknowledging without a reply
+DEDUPE_WAIT_SECONDS = float(os.getenv("DEDUPE_WAIT_SECONDS", "10"))
+# An in-flight claim older than this is assumed dead (crashed worker) and can be taken over
+DEDUPE_LEASE_SECONDS = float(os.getenv("DEDUPE_LEASE_SECONDS", "120"))
+
+NEW = "new"
+PENDING = "pending"
+DONE = "done"
+
+
+class MemoryStore:
+    """Per-process bounded store of message states with expiry."""
+
+    blocking = False  # Safe to call from an event loop
+
+    def __init__(self, max_entries=DEDUPE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (state, expires_at, value)
+        self._lock = threading.Lock()
+
+    def claim(self, key, lease):
+        """Marks key as in flight unless it already is (or finished). Returns (state, value)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= now:
+                return entry[0], entry[2]
+            self._entries[key] = (PENDING, now + lease, None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return NEW, None
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                return None, None
+            return entry[0], entry[2]
+
+    def complete(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (DONE, time.time() + ttl, value)
+            self._entries.move_to_end(key)
+
+    def release(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteStore:
+    """On-disk store shared by every worker process on the host."""
+
+    blocking = True  # Disk I/O and file locks; async callers use a thread
+
+    def __init__(self, path=DEDUPE_PATH, max_entries=DEDUPE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "key TEXT PRIMARY KEY, state TEXT NOT NULL, value TEXT, expires_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        # One connection per thread and process (a forked gunicorn worker must not reuse its parent's)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def claim(self, key, lease):
+        now = time.time()
+        conn = self._connect()
+        # IMMEDIATE takes the write lock up front, so only one process can claim a key
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM messages WHERE key = ? AND expires_at < ?", (key, now))
+            row = conn.execute("SELECT state, value FROM messages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO messages (key, state, value, expires_at) VALUES (?, ?, NULL, ?)",
+                    (key, PENDING, now + lease)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is not None:
+            return row[0], row[1]
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._trim(conn, now)
+        return NEW, None
+
+    def lookup(self, key):
+        row = self._connect().execute(
+            "SELECT state, value FROM messages WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def complete(self, key, value, ttl):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO messages (key, state, value, expires_at) VALUES (?, ?, ?, ?)",
+            (key, DONE, value, time.time() + ttl)
+        )
+
+    def release(self, key):
+        self._connect().execute("DELETE FROM messages WHERE key = ? AND state = ?", (key, PENDING))
+
+    def _trim(self, conn, now):
+        conn.execute("DELETE FROM messages WHERE expires_at < ?", (now,))
+        conn.execute(
+            "DELETE FROM messages WHERE key IN ("
+            "SELECT key FROM messages ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+
+def create_store(name=DEDUPE_BACKEND):
+    """Builds a dedupe store by name."""
+    if name == "memory":
+        return MemoryStore()
+    if name == "sqlite":
+        return SQLiteStore()
+    raise ValueError(f"Unknown dedupe backend: {name}")
+
+
+class Deduplicator:
+    """
+    Runs each message once, however many times the webhook is retried.
+
+    The first delivery of a key runs the work and stores its result. A retry that
+    arrives while the work is in flight waits for it and gets the same result; a
+    retry after it finished gets the stored result without running anything.
+    """
+
+    def __init__(self, store=None, ttl=DEDUPE_TTL, wait_seconds=DEDUPE_WAIT_SECONDS, lease=DEDUPE_LEASE_SECONDS):
+        self.store = store or create_store()
+        self.ttl = ttl
+        self.wait_seconds = wait_seconds
+        self.lease = lease
+        self._in_flight = {}  # key -> threading.Event, for waiters in this process
+        self._lock = threading.Lock()
+
+    def run(self, key, compute, pending_result=None):
+        """
+        Returns compute()'s result for key, running it at most once per TTL.
+
+        :param key: Idempotency key (MessageSid); falsy keys are never deduplicated
+        :param compute: Callable producing a string result
+        :param pending_result: Returned if the original is still running after wait_seconds
+        """
+        if not key:
+            return compute()
+
+        state, value, event = self._claim(key)
+
+        if state == DONE:
+            metrics.inc("webhook_dedupe_total", result="replay")
+            return value
+        if state == PENDING:
+            return self._wait(key, pending_result)
+
+        metrics.inc("webhook_dedupe_total", result="new")
+        try:
+            value = compute()
+        except Exception:
+            self.store.release(key)
+            raise
+        else:
+            self.store.complete(key, value, self.ttl)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def _claim(self, key):
+        # The store call stays outside the lock: a SQLite claim can wait on another process.
+        # A local retry arriving before the event is registered just polls the store.
+        state, value = self.store.claim(key, self.lease)
+        event = None
+        if state == NEW:
+            with self._lock:
+                event = self._in_flight[key] = threading.Event()
+        return state, value, event
+
+    def _wait(self, key, pending_result):
+        with self._lock:
+            event = self._in_flight.get(key)
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            state, value = self.store.lookup(key)
+            if state == DONE:
+                metrics.inc("webhook_dedupe_total", result="coalesced")
+                return value
+            remaining = deadline - time.monotonic()
+            if state is None or remaining <= 0:
+                # Original failed (and released its claim) or is still running
+                metrics.inc("webhook_dedupe_total", result="pending")
+                return pending_result
+            if event is not None and not event.is_set():
+                # Same process: sleep until the original finishes
+                event.wait(remaining)
+            else:
+                # Another process holds the claim: poll the shared store
+                time.sleep(min(0.1, remaining))
+
+    async def run_async(self, key, compute, pending_result=None):
+        """Async counterpart of run; compute is a coroutine function."""
+        if not key:
+            return await compute()
+
+        state, value, event = await self._store_call(self._claim, key)
+
+        if state == DONE:
+            metrics.inc("webhook_dedupe_total", result="replay")
+            return value
+        if state == PENDING:
+            return await self._wait_async(key, pending_result)
+
+        metrics.inc("webhook_dedupe_total", result="new")
+        try:
+            value = await compute()
+        except Exception:
+            await self._store_call(self.store.release, key)
+            raise
+        else:
+            await self._store_call(self.store.complete, key, value, self.ttl)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    async def _wait_async(self, key, pending_result):
+        # Blocking on a threading.Event would stall the event loop, so always poll
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            state, value = await self._store_call(self.store.lookup, key)
+            if state == DONE:
+                metrics.inc("webhook_dedupe_total", result="coalesced")
+                return value
+            remaining = deadline - time.monotonic()
+            if state is None or remaining <= 0:
+                metrics.inc("webhook_dedupe_total", result="pending")
+                return pending_result
+            await asyncio.sleep(min(0.05, remaining))
+
+    async def _store_call(self, func, *args):
+        # A SQLite store would stall the event loop on disk I/O or another process's write lock
+        if self.store.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator():
+    """Returns the process-wide deduplicator."""
+    global _deduplicator
+    with _deduplicator_lock:
+        if _deduplicator is None:
+            _deduplicator = Deduplicator()
+        return _deduplicator
@@ -0,0 +1,140 @@
+import numpy as np
+
+# Largest |value| * 100 for which the fast rounding path below is exact
+_EXACT_LIMIT = 2.0 ** 52
+
+
+def round2(values):
+    """
+    Rounds an array to 2 decimals exactly like Python's round(x, 2).
+
+    np.round scales by 100 first, which can land on the other side of a .5 tie;
+    the few values close to a tie are re-rounded with Python's round.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 100
+    rounded = np.rint(scaled) / 100
+    near_tie = (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6) | ~(np.abs(scaled) < _EXACT_LIMIT)
+    if near_tie.any():
+        rounded[near_tie] = [round(float(value), 2) for value in values[near_tie]]
+    return rounded
+
+
+def _months(tenure_years):
+    months = np.asarray(tenure_years, dtype=np.float64) * 12
+    if np.any(months <= 0):
+        raise ValueError("Loan tenure must be positive")
+    return months
+
+
+def emi(principal, annual_rate, tenure_years):
+    """
+    Vectorized calculate_emi: inputs broadcast against each other.
+
+    Same semantics as the scalar version: 0% loans get an unrounded principal / n,
+    every other EMI is rounded to 2 decimals.
+    """
+    principal = np.asarray(principal, dtype=np.float64)
+    r = (np.asarray(annual_rate, dtype=np.float64) / 12) / 100
+    n = _months(tenure_years)
+    principal, r, n = np.broadcast_arrays(principal, r, n)
+
+    zero_rate = r == 0
+    result = np.empty(principal.shape, dtype=np.float64)
+    result[zero_rate] = principal[zero_rate] / n[zero_rate]
+
+    rated = ~zero_rate
+    growth = (1 + r[rated]) ** n[rated]
+    result[rated] = round2((principal[rated] * r[rated] * growth) / (growth - 1))
+    return result
+
+
+def dti(income, expenses, emi_values):
+    """Vectorized calculate_dti: (expenses + EMI) / income in percent, rounded to 2 decimals."""
+    income = np.asarray(income, dtype=np.float64)
+    if np.any(income == 0):
+        raise ValueError("Income must be non-zero")
+    total_debt_payments = np.asarray(expenses, dtype=np.float64) + np.asarray(emi_values, dtype=np.float64)
+    return round2((total_debt_payments / income) * 100)
+
+
+def total_interest(principal, emi_values, tenure_years):
+    """Interest paid over the loan at the given EMI, rounded to 2 decimals."""
+    return round2(np.asarray(emi_values, dtype=np.float64) * _months(tenure_years) - np.asarray(principal, dtype=np.float64))
+
+
+def price_grid(loan_amounts, interest_rates, tenures, income=None, expenses=None):
+    """
+    Prices every combination of loan amount x rate x tenure.
+
+    :return: dict of arrays shaped (amounts, rates, tenures): loan_amount, interest_rate,
+             tenure, emi, total_interest and (when income is given) dti
+    """
+    amounts, rates, years = np.meshgrid(
+        np.asarray(loan_amounts, dtype=np.float64),
+        np.asarray(interest_rates, dtype=np.float64),
+        np.asarray(tenures, dtype=np.float64),
+        indexing="ij"
+    )
+    return price(amounts, rates, years, income, expenses)
+
+
+def price(loan_amounts, interest_rates, tenures, income=None, expenses=None):
+    """Prices loans element-wise (inputs broadcast against each other)."""
+    amounts, rates, years = np.broadcast_arrays(
+        np.asarray(loan_amounts, dtype=np.float64),
+        np.asarray(interest_rates, dtype=np.float64),
+        np.asarray(tenures, dtype=np.float64)
+    )
+    emis = emi(amounts, rates, years)
+    result = {
+        "loan_amount": amounts,
+        "interest_rate": rates,
+        "tenure": years,
+        "emi": emis,
+        "total_interest": total_interest(amounts, emis, years),
+    }
+    if income is not None:
+        result["dti"] = dti(income, 0 if expenses is None else expenses, emis)
+    return result
+
+
+def amortization(principal, annual_rate, tenure_years):
+    """
+    Month-by-month amortization tables for a batch of loans.
+
+    Loans are broadcast to shape S; every table is padded to the longest tenure M,
+    with zeros after a loan is paid off. The final instalment absorbs the rounding
+    of the EMI so the closing balance is exactly zero.
+
+    :return: dict with "month" (M,) and "payment", "interest", "principal", "balance" (S + (M,))
+    """
+    principal = np.asarray(principal, dtype=np.float64)
+    r = (np.asarray(annual_rate, dtype=np.float64) / 12) / 100
+    n = _months(tenure_years)
+    principal, r, n = np.broadcast_arrays(principal, r, n)
+    emis = emi(principal, annual_rate, tenure_years)
+
+    months = np.arange(1, int(np.ceil(n.max())) + 1 if n.size else 1, dtype=np.float64)
+    k = months.reshape((1,) * principal.ndim + (-1,))
+    p, rate, total, payment = (a[..., np.newaxis] for a in (principal, r, n, emis))
+
+    # Closed-form balance after k payments; the limit r -> 0 is straight-line repayment
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = (1 + rate) ** k
+        balance = np.where(rate == 0, p - payment * k, p * growth - payment * (growth - 1) / rate)
+    opening = np.concatenate([p, balance[..., :-1]], axis=-1)
+
+    active = k <= np.ceil(total)
+    last = k == np.ceil(total)
+    interest = np.where(active, opening * rate, 0.0)
+    paid = np.where(last, opening, np.where(active, payment - interest, 0.0))
+    balance = np.where(active & ~last, balance, 0.0)
+
+    return {
+        "month": months.astype(np.int64),
+        "payment": round2(paid + interest),
+        "interest": round2(interest),
+        "principal": round2(paid),
+        "balance": round2(balance),
+    }
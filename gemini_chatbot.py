@@ -1,30 +1,56 @@
-import google.generativeai as genai
-import os
+import gemini_client  # Shared, cached Gemini models
+import loan_rules  # Templated answers for clear-cut cases
 from db_connector import fetch_similar_loans  # Import PostgreSQL function
+from result_cache import ResultCache
+
+# Bump these whenever a prompt or answer template changes, so cached answers from the old one are ignored
+ELIGIBILITY_PROMPT_VERSION = "3"
+INSIGHTS_PROMPT_VERSION = "3"
+
+# Cached Gemini answers (rule-based answers are cheap and per-user, so they aren't cached);
+# bucket sizes apply when RESULT_CACHE_BUCKETING is enabled
+eligibility_cache = ResultCache(
+    "loan_eligibility",
+    template_version=ELIGIBILITY_PROMPT_VERSION,
+    buckets={"income": 10000, "expenses": 10000, "cibil_score": 10},
+    derived=("similar_loans",)
+)
+insights_cache = ResultCache(
+    "loan_insights",
+    template_version=INSIGHTS_PROMPT_VERSION,
+    buckets={"income": 10000, "expenses": 10000, "cibil_score": 10, "loan_amount": 10000}
+)
+
+def eligibility_answer(income, expenses, cibil_score, similar_loans):
+    """
+    Answers a clear-cut eligibility check from rules, or returns None for Gemini to decide.
 
-#  Configure Gemini AI
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")  # Gemini API key
-genai.configure(api_key=GEMINI_API_KEY)
-
-def check_loan_eligibility(income, expenses, cibil_score):
-    """Fetches past loan records and uses Gemini AI for eligibility prediction."""
-
-    # Step 1: Fetch similar loans from PostgreSQL
-    similar_loans = fetch_similar_loans(income, expenses, cibil_score)
+    Quotes the caller's own figures, so it is computed per request and never cached.
+    """
+     # Validate input data
+    if income < expenses:
+        # Return a custom message instead of relying on Gemini
+        return "The expenses exceed income. This indicates a negative cash flow, which would likely result in loan rejection. Consider reducing expenses or increasing income before applying for a loan."
 
+    # Clear-cut profiles get a templated answer; only borderline ones go to Gemini
+    dti = calculate_dti(income, expenses, 0) if income > 0 else None
+    history_rate = loan_rules.approval_rate(similar_loans)
+    assessment = loan_rules.assess(cibil_score, dti, history_rate)
+    loan_rules.record_path("eligibility", assessment.is_clear_cut)
+    if assessment.is_clear_cut:
+        return loan_rules.eligibility_message(assessment, cibil_score, dti, history_rate)
+    return None
+
+def eligibility_prompt(income, expenses, cibil_score, similar_loans):
+    """Builds the Gemini prompt for a borderline eligibility check."""
     #  Step 2: Format the data for Gemini
     loan_data = "\n".join([
         f"Income: ₹{loan[0]}, Expenses: ₹{loan[1]}, CIBIL: {loan[2]}, Approved: {loan[3]}"
         for loan in similar_loans
     ])
 
-     # Validate input data
-    if income < expenses:
-        # Return a custom message instead of relying on Gemini
-        return "The expenses exceed income. This indicates a negative cash flow, which would likely result in loan rejection. Consider reducing expenses or increasing income before applying for a loan."
-
     #  Step 3: Create a dynamic prompt for Gemini
-    prompt = f"""
+    return f"""
     Based on past loan approvals:
     {loan_data}
 
@@ -36,12 +62,53 @@ def check_loan_eligibility(income, expenses, cibil_score):
     would be eligible for a loan. **Provide an answer (≤100 words)** summarizing eligibility, risks, and ways to improve approval chances.
     """
 
+def check_loan_eligibility(income, expenses, cibil_score):
+    """Fetches past loan records and answers from rules, or with Gemini for borderline profiles."""
+
+    # Step 1: Fetch similar loans from PostgreSQL
+    similar_loans = fetch_similar_loans(income, expenses, cibil_score)
+    answer = eligibility_answer(income, expenses, cibil_score, similar_loans)
+    if answer is not None:
+        return answer
+    return gemini_eligibility(income, expenses, cibil_score, similar_loans)
+
+@eligibility_cache.cached
+def gemini_eligibility(income, expenses, cibil_score, similar_loans=None):
+    """
+    Gemini's eligibility prediction; with RESULT_CACHE_BUCKETING it gets the bucketed figures.
+
+    :param similar_loans: Rows already fetched for these figures (not part of the cache key);
+        None when bucketing changed the figures, and they are fetched for the bucket instead
+    """
+    if similar_loans is None:
+        similar_loans = fetch_similar_loans(income, expenses, cibil_score)
+
     #  Step 4: Send to Gemini AI
-    response = genai.GenerativeModel("gemini-1.5-pro-latest").generate_content(prompt)
+    response = gemini_client.generate(eligibility_prompt(income, expenses, cibil_score, similar_loans))
     # Replace Rupee symbol with "Rs." in your text
     response_text = response.text.replace("\u20b9", "Rs.")
     return response_text
 
+async def check_loan_eligibility_async(income, expenses, cibil_score):
+    """Async counterpart of check_loan_eligibility (ASGI app); shares its cache."""
+    import async_db
+
+    similar_loans = await async_db.fetch_similar_loans(income, expenses, cibil_score)
+    answer = eligibility_answer(income, expenses, cibil_score, similar_loans)
+    if answer is not None:
+        return answer
+    return await gemini_eligibility_async(income, expenses, cibil_score, similar_loans)
+
+@eligibility_cache.cached_async
+async def gemini_eligibility_async(income, expenses, cibil_score, similar_loans=None):
+    """Async counterpart of gemini_eligibility."""
+    import async_db
+
+    if similar_loans is None:
+        similar_loans = await async_db.fetch_similar_loans(income, expenses, cibil_score)
+    response = await gemini_client.generate_async(eligibility_prompt(income, expenses, cibil_score, similar_loans))
+    return response.text.replace("\u20b9", "Rs.")
+
 def calculate_emi(principal, annual_rate, tenure_years):
     """Calculates EMI using the standard formula."""
     r = (annual_rate / 12) / 100  # Convert annual interest rate to monthly
@@ -57,15 +124,29 @@ def calculate_dti(income, expenses, emi):
     dti = (total_debt_payments / income) * 100
     return round(dti, 2)
 
-def gemini_loan_insights(income, expenses, cibil_score, loan_amount, interest_rate, tenure):
-    """Uses Gemini AI to analyze EMI, affordability, and eligibility."""
-    
+def insights_answer(income, expenses, cibil_score, loan_amount, interest_rate, tenure):
+    """
+    Answers a clear-cut insights request from rules, or returns None for Gemini to decide.
+
+    Quotes the caller's own figures, so it is computed per request and never cached.
+    """
     # Step 1: Compute EMI and DTI
     emi = calculate_emi(loan_amount, interest_rate, tenure)
     dti = calculate_dti(income, expenses, emi)
 
+    assessment = loan_rules.assess(cibil_score, dti)
+    loan_rules.record_path("insights", assessment.is_clear_cut)
+    if assessment.is_clear_cut:
+        return loan_rules.insights_message(assessment, cibil_score, loan_amount, emi, dti)
+    return None
+
+def insights_prompt(income, expenses, cibil_score, loan_amount, interest_rate, tenure):
+    """Builds the Gemini prompt for a borderline insights request."""
+    emi = calculate_emi(loan_amount, interest_rate, tenure)
+    dti = calculate_dti(income, expenses, emi)
+
     # Step 2: Generate Prompt for Gemini
-    prompt = f"""
+    return f"""
     Analyze the following financial data and provide **brief insights (≤100 words)** on  loan affordability, eligibility, and risk factors.
 
     **User Profile:**
@@ -87,7 +168,31 @@ def gemini_loan_insights(income, expenses, cibil_score, loan_amount, interest_ra
     - What other financial recommendations can you provide?
     """
 
+def gemini_loan_insights(income, expenses, cibil_score, loan_amount, interest_rate, tenure):
+    """Analyzes EMI, affordability and eligibility from rules, or with Gemini for borderline cases."""
+    answer = insights_answer(income, expenses, cibil_score, loan_amount, interest_rate, tenure)
+    if answer is not None:
+        return answer
+    return gemini_insights(income, expenses, cibil_score, loan_amount, interest_rate, tenure)
+
+@insights_cache.cached
+def gemini_insights(income, expenses, cibil_score, loan_amount, interest_rate, tenure):
+    """Gemini's loan insights; with RESULT_CACHE_BUCKETING it gets the bucketed figures."""
     # Step 3: Send Prompt to Gemini
-    response = genai.GenerativeModel("gemini-1.5-pro-latest").generate_content(prompt)
+    response = gemini_client.generate(insights_prompt(income, expenses, cibil_score, loan_amount, interest_rate, tenure))
     
     return response.text.replace("\u20b9", "Rs.")
+
+async def gemini_loan_insights_async(income, expenses, cibil_score, loan_amount, interest_rate, tenure):
+    """Async counterpart of gemini_loan_insights (ASGI app); shares its cache."""
+    answer = insights_answer(income, expenses, cibil_score, loan_amount, interest_rate, tenure)
+    if answer is not None:
+        return answer
+    return await gemini_insights_async(income, expenses, cibil_score, loan_amount, interest_rate, tenure)
+
+@insights_cache.cached_async
+async def gemini_insights_async(income, expenses, cibil_score, loan_amount, interest_rate, tenure):
+    """Async counterpart of gemini_insights."""
+    prompt = insights_prompt(income, expenses, cibil_score, loan_amount, interest_rate, tenure)
+    response = await gemini_client.generate_async(prompt)
+    return response.text.replace("\u20b9", "Rs.")
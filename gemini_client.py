@@ -0,0 +1,302 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import weakref
+
+import google.generativeai as genai
+
+import circuit_breaker
+import metrics
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro-latest")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+# Local stand-in for throughput tests: no network, fixed latency, canned reply
+GEMINI_FAKE = os.getenv("GEMINI_FAKE", "").lower() in ("1", "true", "yes")
+GEMINI_FAKE_LATENCY = float(os.getenv("GEMINI_FAKE_LATENCY", "0"))  # Seconds
+GEMINI_FAKE_REPLY = os.getenv("GEMINI_FAKE_REPLY", "This is a simulated response from the assistant.")
+
+_configured = False
+_models = {}
+_models_lock = threading.Lock()
+_sync_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+_async_slots = weakref.WeakKeyDictionary()  # Event loop -> asyncio.Semaphore
+
+
+class FakeResponse:
+    """Mimics the .text attribute of a Gemini response."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """
+    Offline GenerativeModel replacement with a configurable delay.
+
+    latency and reply may be fixed values or zero-argument callables sampled per call
+    (e.g. a latency distribution in a load test).
+    """
+
+    def __init__(self, model_name, generation_config=None, latency=None, reply=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.latency = GEMINI_FAKE_LATENCY if latency is None else latency
+        self.reply = GEMINI_FAKE_REPLY if reply is None else reply
+
+    def _delay(self):
+        return self.latency() if callable(self.latency) else self.latency
+
+    def _text(self):
+        return self.reply() if callable(self.reply) else self.reply
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if stream:
+            return self._stream()
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        return FakeResponse(self._text())
+
+    def _stream(self):
+        # Spread the latency over word-sized chunks like a real token stream
+        delay = self._delay()
+        words = self._text().split(" ")
+        for i, word in enumerate(words):
+            if delay:
+                time.sleep(delay / len(words))
+            yield FakeResponse(word if i == 0 else " " + word)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return FakeResponse(self._text())
+
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+
+
+class FakeChat:
+    """Mimics a ChatSession: answers with the fake model and keeps the history."""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        self.history.append({"role": "user", "parts": [content]})
+        response = self.model.generate_content(content, stream=stream)
+        if not stream:
+            self.history.append({"role": "model", "parts": [response.text]})
+        return response
+
+    async def send_message_async(self, content, **kwargs):
+        self.history.append({"role": "user", "parts": [content]})
+        response = await self.model.generate_content_async(content)
+        self.history.append({"role": "model", "parts": [response.text]})
+        return response
+
+
+def configure():
+    """Configures the Gemini SDK once per process."""
+    global _configured
+    if not _configured and not GEMINI_FAKE:
+        genai.configure(api_key=GEMINI_API_KEY)
+    _configured = True
+
+
+def get_model(model_name=GEMINI_MODEL, generation_config=None):
+    """Returns a cached model instance for this name and generation config."""
+    key = (model_name, json.dumps(generation_config, sort_keys=True, default=str))
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            if GEMINI_FAKE:
+                model = FakeModel(model_name, generation_config)
+            else:
+                configure()
+                model = genai.GenerativeModel(model_name, generation_config=generation_config)
+            _models[key] = model
+        return model
+
+
+def use_fake(latency=0.0, reply=None):
+    """
+    Switches this process to the offline fake model (for benchmarks and tests).
+
+    :param latency: Seconds per call, or a callable returning them
+    :param reply: Reply text, or a callable returning it
+    """
+    global GEMINI_FAKE, GEMINI_FAKE_LATENCY, GEMINI_FAKE_REPLY
+    GEMINI_FAKE = True
+    GEMINI_FAKE_LATENCY = latency
+    if reply is not None:
+        GEMINI_FAKE_REPLY = reply
+    with _models_lock:
+        _models.clear()
+
+
+def generate(prompt, model_name=GEMINI_MODEL, generation_config=None, **kwargs):
+    """
+    Runs generate_content, waiting for a free slot if too many calls are in flight.
+
+    Raises circuit_breaker.CircuitOpenError while Gemini keeps failing or stalling.
+    """
+    model = get_model(model_name, generation_config)
+    start = time.monotonic()
+    with _sync_slots:
+        metrics.observe("gemini_slot_wait_seconds", time.monotonic() - start)
+        start = time.monotonic()
+        try:
+            with circuit_breaker.get("gemini").guard():
+                return model.generate_content(prompt, **kwargs)
+        finally:
+            metrics.observe("gemini_request_seconds", time.monotonic() - start, model=model_name)
+
+
+def chat(message, history, model_name=GEMINI_MODEL, generation_config=None, **kwargs):
+    """
+    Sends a message in a chat seeded with earlier turns (see session_store).
+
+    :param history: start_chat history, [{"role": "user" | "model", "parts": [text]}, ...]
+    """
+    model = get_model(model_name, generation_config)
+    start = time.monotonic()
+    with _sync_slots:
+        metrics.observe("gemini_slot_wait_seconds", time.monotonic() - start)
+        start = time.monotonic()
+        try:
+            with circuit_breaker.get("gemini").guard():
+                return model.start_chat(history=history).send_message(message, **kwargs)
+        finally:
+            metrics.observe("gemini_request_seconds", time.monotonic() - start, model=model_name)
+
+
+def generate_stream(prompt, model_name=GEMINI_MODEL, generation_config=None, history=None, **kwargs):
+    """
+    Yields response text chunks as Gemini streams them, holding one concurrency slot throughout.
+
+    With history the prompt is sent as the next message of a chat seeded with those turns.
+    """
+    model = get_model(model_name, generation_config)
+    start = time.monotonic()
+    with _sync_slots:
+        metrics.observe("gemini_slot_wait_seconds", time.monotonic() - start)
+        start = time.monotonic()
+        first_chunk = True
+        breaker = circuit_breaker.get("gemini")
+        breaker.before()
+        # Only time spent waiting on Gemini is judged, not the time the consumer holds each chunk
+        waited = 0.0
+        call_start = time.monotonic()
+        try:
+            if history:
+                stream = model.start_chat(history=history).send_message(prompt, stream=True, **kwargs)
+            else:
+                stream = model.generate_content(prompt, stream=True, **kwargs)
+            chunks = iter(stream)
+            while True:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                finally:
+                    waited += time.monotonic() - call_start
+                text = response_text(chunk)
+                if text:
+                    if first_chunk:
+                        metrics.observe("gemini_first_chunk_seconds", time.monotonic() - start, model=model_name)
+                        first_chunk = False
+                    yield text
+                call_start = time.monotonic()
+        except GeneratorExit:
+            # The consumer stopped reading: no verdict on Gemini, but a half-open probe is freed
+            breaker.abandon()
+            raise
+        except Exception:
+            breaker.record(False, waited)
+            raise
+        else:
+            breaker.record(True, waited)
+        finally:
+            metrics.observe("gemini_request_seconds", time.monotonic() - start, model=model_name)
+
+
+# A sentence ends at ., !, ?, the Devanagari danda or a newline, followed by whitespace
+# ("Rs." is an abbreviation in our replies, not a sentence end)
+SENTENCE_END = re.compile(r"(?<=[.!?\u0964\u0965])(?<!Rs\.)\s+|\n+")
+
+
+def iter_sentences(chunks, min_length=20):
+    """
+    Regroups streamed text chunks into whole sentences.
+
+    :param chunks: Iterable of text fragments
+    :param min_length: Shorter sentences are merged into the next one
+    :return: Generator of sentences, the last one possibly unterminated
+    """
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        parts = SENTENCE_END.split(buffer)
+        buffer = parts.pop()
+        pending = ""
+        for part in parts:
+            pending = f"{pending} {part}".strip() if pending else part.strip()
+            if len(pending) >= min_length:
+                yield pending
+                pending = ""
+        if pending:
+            buffer = f"{pending} {buffer}"
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def _async_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _async_slots.get(loop)
+    if semaphore is None:
+        semaphore = _async_slots[loop] = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    return semaphore
+
+
+async def generate_async(prompt, model_name=GEMINI_MODEL, generation_config=None, **kwargs):
+    """Async counterpart of generate() built on generate_content_async."""
+    model = get_model(model_name, generation_config)
+    start = time.monotonic()
+    async with _async_semaphore():
+        metrics.observe("gemini_slot_wait_seconds", time.monotonic() - start)
+        start = time.monotonic()
+        try:
+            with circuit_breaker.get("gemini").guard():
+                return await model.generate_content_async(prompt, **kwargs)
+        finally:
+            metrics.observe("gemini_request_seconds", time.monotonic() - start, model=model_name)
+
+
+async def chat_async(message, history, model_name=GEMINI_MODEL, generation_config=None, **kwargs):
+    """Async counterpart of chat()."""
+    model = get_model(model_name, generation_config)
+    start = time.monotonic()
+    async with _async_semaphore():
+        metrics.observe("gemini_slot_wait_seconds", time.monotonic() - start)
+        start = time.monotonic()
+        try:
+            with circuit_breaker.get("gemini").guard():
+                return await model.start_chat(history=history).send_message_async(message, **kwargs)
+        finally:
+            metrics.observe("gemini_request_seconds", time.monotonic() - start, model=model_name)
+
+
+def response_text(response):
+    """Returns the response text, or None if the model gave no usable answer."""
+    try:
+        return response.text if response is not None else None
+    except ValueError:
+        # Blocked or empty candidates raise on .text
+        return None
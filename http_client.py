@@ -0,0 +1,138 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import app_logging
+import circuit_breaker
+import metrics
+
+log = app_logging.get_logger("http_client")
+
+# Connection pool and timeout settings shared by every outbound HTTP call
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.25"))  # Seconds
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "5"))  # Seconds
+
+# Status codes worth retrying: rate limiting and transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the process-wide keep-alive session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # Retries are handled in request() so they can be jittered and measured
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=0
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def set_session(session):
+    """Replaces the shared session, e.g. with a stub that answers locally (benchmarks and tests)."""
+    global _session
+    with _session_lock:
+        _session = session
+
+
+def default_timeout():
+    """Returns the (connect, read) timeout tuple used when callers don't pass one."""
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def backoff_delay(attempt, response=None):
+    """Full-jitter exponential backoff, honouring a numeric Retry-After header."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(method, url, endpoint=None, timeout=None, retries=None, **kwargs):
+    """
+    Sends an HTTP request on the shared session with timeouts and retries.
+
+    :param method: HTTP method
+    :param url: Target URL
+    :param endpoint: Label used for latency metrics (default: the URL host)
+    :param timeout: Timeout in seconds or a (connect, read) tuple
+    :param retries: Retries on connection errors, timeouts and 429/5xx responses
+    :return: requests.Response (the last one if every attempt was retryable)
+    :raises circuit_breaker.CircuitOpenError: The endpoint's breaker is open
+    """
+    endpoint = endpoint or urlparse(url).netloc
+    timeout = timeout or default_timeout()
+    retries = HTTP_MAX_RETRIES if retries is None else retries
+    session = get_session()
+    breaker = circuit_breaker.get(endpoint)
+
+    for attempt in range(retries + 1):
+        # Raises CircuitOpenError instead of waiting on an upstream that keeps failing
+        breaker.before()
+        start = time.monotonic()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            breaker.record(False, time.monotonic() - start)
+            metrics.observe("http_request_seconds", time.monotonic() - start, endpoint=endpoint)
+            metrics.inc("http_requests_total", endpoint=endpoint, status=type(e).__name__)
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt)
+            log.warning("http_retry", endpoint=endpoint, error=type(e).__name__, delay=round(delay, 3))
+            time.sleep(delay)
+            continue
+        except Exception:
+            breaker.record(False, time.monotonic() - start)
+            raise
+
+        # 429 means the upstream is healthy but throttling us; only 5xx count against it
+        breaker.record(response.status_code < 500, time.monotonic() - start)
+        metrics.observe("http_request_seconds", time.monotonic() - start, endpoint=endpoint)
+        metrics.inc("http_requests_total", endpoint=endpoint, status=str(response.status_code))
+
+        if response.status_code in RETRY_STATUSES and attempt < retries:
+            delay = backoff_delay(attempt, response)
+            log.warning("http_retry", endpoint=endpoint, status=response.status_code, delay=round(delay, 3))
+            time.sleep(delay)
+            continue
+        return response
+
+
+def get(url, **kwargs):
+    """Shortcut for request("GET", ...)."""
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    """Shortcut for request("POST", ...)."""
+    return request("POST", url, **kwargs)
+
+
+def latency_histograms():
+    """Returns the per-endpoint latency histograms recorded so far."""
+    histograms = metrics.snapshot()["histograms"]
+    return {
+        dict(labels)["endpoint"]: data
+        for (name, labels), data in histograms.items()
+        if name == "http_request_seconds"
+    }
@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+import uuid
+
+import app_logging
+import metrics
+
+log = app_logging.get_logger("job_queue")
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be enqueued because the queue is at capacity."""
+
+
+class Job:
+    """A unit of background work with its enqueue/start/finish timestamps."""
+
+    def __init__(self, payload):
+        self.id = str(uuid.uuid4())
+        self.payload = payload
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+
+    def timings(self):
+        """Returns queue wait and run time in seconds (None while unknown)."""
+        wait = run = None
+        if self.started_at is not None:
+            wait = self.started_at - self.enqueued_at
+        if self.finished_at is not None and self.started_at is not None:
+            run = self.finished_at - self.started_at
+        return {"queue_wait": wait, "run": run}
+
+
+class LocalQueueBackend:
+    """Bounded in-process FIFO backend built on queue.Queue."""
+
+    def __init__(self, maxsize=100):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.maxsize = maxsize
+
+    def put(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(f"Job queue is full ({self.maxsize} jobs)")
+
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def task_done(self):
+        self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+def create_backend(name="local", maxsize=100):
+    """Builds a queue backend by name."""
+    if name == "local":
+        return LocalQueueBackend(maxsize=maxsize)
+    raise ValueError(f"Unknown job queue backend: {name}")
+
+
+class WorkerPool:
+    """Runs jobs from a queue backend on a fixed number of worker threads."""
+
+    def __init__(self, handler, backend=None, workers=4, name="jobs"):
+        self.handler = handler
+        self.backend = backend or LocalQueueBackend()
+        self.workers = workers
+        self.name = name
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the worker threads (no-op if already running)."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, payload):
+        """Enqueues a payload and returns its Job. Raises QueueFullError under backpressure."""
+        self.start()
+        job = Job(payload)
+        try:
+            self.backend.put(job)
+        except QueueFullError:
+            metrics.inc("jobs_rejected_total", queue=self.name)
+            raise
+        metrics.inc("jobs_enqueued_total", queue=self.name)
+        metrics.set_gauge("job_queue_depth", self.backend.qsize(), queue=self.name)
+        return job
+
+    def join(self):
+        """Blocks until every enqueued job has been processed."""
+        self.backend.join()
+
+    def stop(self, wait=True):
+        """
+        Signals the workers to exit once the queue is idle; jobs already queued still run.
+
+        :param wait: Block until the queue is drained and every worker has exited
+        """
+        self._stopping.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            job = self.backend.get(timeout=0.5)
+            if job is None:
+                # Stop only on an empty queue, so no accepted job is dropped
+                if self._stopping.is_set():
+                    return
+                continue
+            metrics.set_gauge("job_queue_depth", self.backend.qsize(), queue=self.name)
+            job.started_at = time.monotonic()
+            status = "ok"
+            try:
+                self.handler(job.payload)
+            except Exception as e:
+                job.error = e
+                status = "error"
+                log.error("job_failed", job=job.id, queue=self.name, error=f"{type(e).__name__}: {e}")
+            finally:
+                job.finished_at = time.monotonic()
+                timings = job.timings()
+                metrics.observe("job_queue_wait_seconds", timings["queue_wait"], queue=self.name)
+                metrics.observe("job_run_seconds", timings["run"], queue=self.name)
+                metrics.inc("jobs_processed_total", queue=self.name, status=status)
+                log.info("job_finished", sampled=True, job=job.id, queue=self.name, status=status,
+                         queue_wait=round(timings["queue_wait"], 3), run=round(timings["run"], 3))
+                self.backend.task_done()
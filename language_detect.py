@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+LANGUAGE_MEMO_SIZE = int(os.getenv("LANGUAGE_MEMO_SIZE", "10000"))
+
+# Share of letters that must come from a single script before we trust it
+SCRIPT_DOMINANCE = 0.8
+
+# Unicode blocks that map to exactly one supported language
+SCRIPT_RANGES = [
+    (0x0980, 0x09FF, "bn-IN"),  # Bengali
+    (0x0A00, 0x0A7F, "pa-IN"),  # Gurmukhi
+    (0x0A80, 0x0AFF, "gu-IN"),  # Gujarati
+    (0x0B80, 0x0BFF, "ta-IN"),  # Tamil
+    (0x0C00, 0x0C7F, "te-IN"),  # Telugu
+    (0x0C80, 0x0CFF, "kn-IN"),  # Kannada
+    (0x0D00, 0x0D7F, "ml-IN"),  # Malayalam
+]
+DEVANAGARI = (0x0900, 0x097F)
+
+# Frequent words that tell Hindi and Marathi apart (both are written in Devanagari)
+HINDI_MARKERS = {"है", "हैं", "और", "नहीं", "क्या", "मैं", "मुझे", "का", "की", "के", "में", "था", "हूं", "हूँ"}
+MARATHI_MARKERS = {"आहे", "आहेत", "आणि", "नाही", "काय", "मी", "मला", "तुम्ही", "माझे", "माझा", "होते", "आहोत"}
+MARATHI_LETTER = "ळ"  # ळ is common in Marathi and rare in Hindi
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _script_of(char):
+    code = ord(char)
+    if DEVANAGARI[0] <= code <= DEVANAGARI[1]:
+        return "devanagari"
+    for start, end, language_code in SCRIPT_RANGES:
+        if start <= code <= end:
+            return language_code
+    if char.isascii() and char.isalpha():
+        return "latin"
+    if char.isalpha():
+        return "other"
+    return None
+
+
+def _devanagari_language(text):
+    words = set(text.split())
+    hindi = len(words & HINDI_MARKERS)
+    marathi = len(words & MARATHI_MARKERS) + (1 if MARATHI_LETTER in text else 0)
+    if hindi and not marathi:
+        return "hi-IN"
+    if marathi and not hindi:
+        return "mr-IN"
+    return None
+
+
+def classify_script(text):
+    """
+    Detects the language from its Unicode script when that is unambiguous.
+
+    :return: A language code such as "ta-IN", or None if the API should decide
+    """
+    counts = {}
+    for char in text:
+        script = _script_of(char)
+        if script:
+            counts[script] = counts.get(script, 0) + 1
+    if not counts:
+        return None
+
+    script, count = max(counts.items(), key=lambda item: item[1])
+    if count / sum(counts.values()) < SCRIPT_DOMINANCE:
+        return None
+    if script == "devanagari":
+        return _devanagari_language(text)
+    if script in ("latin", "other"):
+        # English and romanized Indian languages look alike; leave them to the API
+        return None
+    return script
+
+
+def _memo_get(text):
+    with _memo_lock:
+        language_code = _memo.get(text)
+        if language_code is not None:
+            _memo.move_to_end(text)
+        return language_code
+
+
+def _memo_put(text, language_code):
+    with _memo_lock:
+        _memo[text] = language_code
+        _memo.move_to_end(text)
+        while len(_memo) > LANGUAGE_MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def guess(text):
+    """Language from the memo or the script alone (never calls the API), or None."""
+    key = text.strip()
+    return _memo_get(key) or classify_script(key)
+
+
+def detect(text, api_detect, default="en-IN"):
+    """
+    Detects the language of text, calling the API only when the script is ambiguous.
+
+    :param text: Text to classify
+    :param api_detect: Callable(text) returning a language code, or None on failure
+    :param default: Language returned when every method fails
+    :return: (language_code, source), where source is "script", "memo", "api" or "fallback"
+    """
+    key = text.strip()
+
+    language_code = _memo_get(key)
+    if language_code is not None:
+        source = "memo"
+    else:
+        language_code = classify_script(key)
+        source = "script"
+        if language_code is None:
+            language_code = api_detect(key)
+            source = "api"
+            if language_code is None:
+                language_code = default
+                source = "fallback"
+            else:
+                # Only API answers are worth remembering; the script check is already cheap
+                _memo_put(key, language_code)
+
+    metrics.inc("language_detection_total", source=source)
+    return language_code, source
+
+
+async def detect_async(text, api_detect_async, default="en-IN"):
+    """Async counterpart of detect; api_detect_async is a coroutine function."""
+    key = text.strip()
+
+    language_code = _memo_get(key)
+    if language_code is not None:
+        source = "memo"
+    else:
+        language_code = classify_script(key)
+        source = "script"
+        if language_code is None:
+            language_code = await api_detect_async(key)
+            source = "api"
+            if language_code is None:
+                language_code = default
+                source = "fallback"
+            else:
+                _memo_put(key, language_code)
+
+    metrics.inc("language_detection_total", source=source)
+    return language_code, source
+
+
+def clear_memo():
+    """Empties the memo cache."""
+    with _memo_lock:
+        _memo.clear()
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+import app_logging
+import metrics
+
+log = app_logging.get_logger("loan_knn")
+
+try:
+    from scipy.spatial import cKDTree  # Optional: spatial index for large tables
+except ImportError:
+    cKDTree = None
+
+LOAN_KNN_REFRESH_SECONDS = float(os.getenv("LOAN_KNN_REFRESH_SECONDS", "300"))
+# Monotonic column used for incremental refresh; empty means reload the whole table
+LOAN_KNN_ID_COLUMN = os.getenv("LOAN_KNN_ID_COLUMN", "id")
+# Build a KD-tree once the table has at least this many rows (if scipy is installed)
+LOAN_KNN_KDTREE_MIN_ROWS = int(os.getenv("LOAN_KNN_KDTREE_MIN_ROWS", "200000"))
+
+
+class LoanSnapshot:
+    """Immutable, compact column arrays for one version of the loan table."""
+
+    def __init__(self, ids, features, status_codes, statuses, windows):
+        self.ids = ids  # int64, or None without an id column
+        self.features = features  # int64 (n, 3): income_annum, expenses, cibil_score
+        self.status_codes = status_codes  # int16 index into statuses
+        self.statuses = statuses  # list of distinct loan_status values
+        self.windows = windows
+        self.tree = None
+        if cKDTree is not None and len(features) >= LOAN_KNN_KDTREE_MIN_ROWS:
+            # The tree lives in window units, where the similarity window is a unit box
+            self.tree = cKDTree((features / windows).astype(np.float32))
+
+    @property
+    def max_id(self):
+        return int(self.ids[-1]) if self.ids is not None and len(self.ids) else None
+
+    def __len__(self):
+        return len(self.features)
+
+
+def build_snapshot(rows, windows, previous=None):
+    """
+    Builds a snapshot from (id, income, expenses, cibil, status) rows, appended to previous.
+
+    :param rows: Iterable of row tuples; id may be None when there is no id column
+    :param windows: (income, expenses, cibil) similarity windows
+    :param previous: Snapshot to extend (incremental refresh), or None for a full load
+    """
+    rows = list(rows)
+    statuses = list(previous.statuses) if previous else []
+    status_index = {status: i for i, status in enumerate(statuses)}
+
+    codes = np.empty(len(rows), dtype=np.int16)
+    for i, row in enumerate(rows):
+        status = row[4]
+        if status not in status_index:
+            status_index[status] = len(statuses)
+            statuses.append(status)
+        codes[i] = status_index[status]
+
+    features = np.array([row[1:4] for row in rows], dtype=np.int64).reshape(-1, 3)
+    has_ids = bool(rows) and rows[0][0] is not None
+    ids = np.array([row[0] for row in rows], dtype=np.int64) if has_ids else None
+
+    if previous is not None and len(previous):
+        features = np.concatenate([previous.features, features])
+        codes = np.concatenate([previous.status_codes, codes])
+        if ids is not None and previous.ids is not None:
+            ids = np.concatenate([previous.ids, ids])
+
+    return LoanSnapshot(ids, features, codes, statuses, np.asarray(windows, dtype=np.float64))
+
+
+def query_snapshot(snapshot, income, expenses, cibil_score, k=5):
+    """
+    Returns up to k rows inside the similarity window, nearest first.
+
+    Rows are (income_annum, expenses, cibil_score, loan_status) tuples, the same
+    shape fetch_similar_loans returns from PostgreSQL.
+    """
+    if snapshot is None or not len(snapshot):
+        return []
+
+    point = np.array([income, expenses, cibil_score], dtype=np.int64)
+    if snapshot.tree is not None:
+        # Chebyshev radius 1 in window units is the window box; strict bounds are checked below
+        candidates = np.asarray(
+            snapshot.tree.query_ball_point((point / snapshot.windows).astype(np.float32), r=1.0, p=np.inf),
+            dtype=np.int64
+        )
+        if not len(candidates):
+            return []
+        in_window = np.all(np.abs(snapshot.features[candidates] - point) < snapshot.windows, axis=1)
+        candidates = candidates[in_window]
+    else:
+        in_window = np.all(np.abs(snapshot.features - point) < snapshot.windows, axis=1)
+        candidates = np.flatnonzero(in_window)
+
+    if not len(candidates):
+        return []
+
+    # Same normalized distance as the SQL ORDER BY, computed only for rows in the window
+    deltas = (snapshot.features[candidates] - point) / snapshot.windows
+    distances = np.einsum("ij,ij->i", deltas, deltas)
+    if len(candidates) > k:
+        nearest = np.argpartition(distances, k)[:k]
+    else:
+        nearest = np.arange(len(candidates))
+    nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+
+    results = []
+    for i in candidates[nearest]:
+        income_annum, loan_expenses, cibil = snapshot.features[i]
+        results.append((int(income_annum), int(loan_expenses), int(cibil), snapshot.statuses[snapshot.status_codes[i]]))
+    return results
+
+
+class LoanKNNEngine:
+    """Keeps a snapshot of the loan table in memory and refreshes it in the background."""
+
+    def __init__(self, fetch_rows, windows, refresh_seconds=LOAN_KNN_REFRESH_SECONDS):
+        """
+        :param fetch_rows: Callable(after_id) returning (id, income, expenses, cibil, status)
+                           rows with id > after_id (all rows when after_id is None)
+        :param windows: (income, expenses, cibil) similarity windows
+        """
+        self.fetch_rows = fetch_rows
+        self.windows = windows
+        self.refresh_seconds = refresh_seconds
+        self.snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+
+    def refresh(self, full=False):
+        """Loads new rows (or the whole table) and swaps in the new snapshot."""
+        with self._refresh_lock:
+            start = time.monotonic()
+            previous = None if full else self.snapshot
+            after_id = previous.max_id if previous is not None else None
+            if previous is not None and after_id is None:
+                # No id column to resume from, so reload everything
+                previous = None
+            rows = self.fetch_rows(after_id)
+            if previous is not None and not rows:
+                return self.snapshot
+            self.snapshot = build_snapshot(rows, self.windows, previous)
+            metrics.observe("loan_knn_refresh_seconds", time.monotonic() - start)
+            metrics.set_gauge("loan_knn_rows", len(self.snapshot))
+            log.info("loan_knn_refreshed", rows=len(self.snapshot), added=len(rows))
+            return self.snapshot
+
+    def start(self):
+        """Loads the table and schedules periodic incremental refreshes."""
+        self.refresh(full=True)
+        self._schedule()
+
+    def _schedule(self):
+        if self.refresh_seconds <= 0:
+            return
+        self._timer = threading.Timer(self.refresh_seconds, self._refresh_and_reschedule)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_and_reschedule(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            log.error("loan_knn_refresh_failed", error=str(e))
+        finally:
+            self._schedule()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def query(self, income, expenses, cibil_score, k=5):
+        start = time.monotonic()
+        results = query_snapshot(self.snapshot, income, expenses, cibil_score, k)
+        metrics.observe("loan_knn_query_seconds", time.monotonic() - start)
+        return results
@@ -0,0 +1,148 @@
+import os
+import threading
+
+import metrics
+
+# Answers below this confidence go to Gemini; raise it to send more borderline cases to the LLM
+LOAN_RULES_CONFIDENCE = float(os.getenv("LOAN_RULES_CONFIDENCE", "0.85"))
+
+# Hard limits no lender we target goes past
+MIN_CIBIL_SCORE = 550
+MAX_DTI = 80
+
+# Minimum similar historical loans before their approval rate counts
+MIN_SIMILAR_LOANS = 3
+
+# Relative weight of each signal in the combined score
+WEIGHTS = {"cibil": 0.45, "dti": 0.35, "history": 0.20}
+
+
+class Assessment:
+    """Outcome of the rule engine for one applicant."""
+
+    __slots__ = ("decision", "confidence", "reasons", "tips")
+
+    def __init__(self, decision, confidence, reasons, tips):
+        self.decision = decision  # "eligible", "not_eligible" or "borderline"
+        self.confidence = confidence
+        self.reasons = reasons
+        self.tips = tips
+
+    @property
+    def is_clear_cut(self):
+        return self.decision != "borderline"
+
+
+def _interpolate(value, low, high):
+    """Maps value linearly from [low, high] onto [-1, 1], clamped."""
+    if high == low:
+        return 0.0
+    return max(-1.0, min(1.0, 2 * (value - low) / (high - low) - 1))
+
+
+def approval_rate(similar_loans):
+    """Share of similar historical loans that were approved, or None if there are too few."""
+    if len(similar_loans) < MIN_SIMILAR_LOANS:
+        return None
+    approved = sum(1 for loan in similar_loans if str(loan[3]).strip().lower() in ("approved", "1", "true", "yes", "y"))
+    return approved / len(similar_loans)
+
+
+def assess(cibil_score, dti, history_rate=None, threshold=None):
+    """
+    Scores an applicant on CIBIL score, DTI and the approval rate of similar past loans.
+
+    :param cibil_score: Applicant's CIBIL score
+    :param dti: Debt-to-income ratio in percent, or None if it can't be computed
+    :param history_rate: approval_rate() of similar loans, or None
+    :param threshold: Confidence needed for a clear-cut answer (default LOAN_RULES_CONFIDENCE)
+    :return: Assessment
+    """
+    threshold = LOAN_RULES_CONFIDENCE if threshold is None else threshold
+    reasons, tips = [], []
+
+    if dti is None:
+        return Assessment("borderline", 0.0, reasons, tips)
+
+    if cibil_score < 650:
+        reasons.append(f"a CIBIL score of {cibil_score} is below what most lenders accept")
+        tips.append("pay every EMI and card bill on time for 6-12 months to rebuild your score")
+    if dti > 50:
+        reasons.append(f"a debt-to-income ratio of {dti}% leaves little room for a new EMI")
+        tips.append("reduce existing obligations or apply for a smaller amount")
+    if history_rate is not None and history_rate < 0.3:
+        reasons.append("most applicants with a similar profile were rejected")
+
+    # Hard vetoes are clear-cut regardless of the other signals
+    if cibil_score < MIN_CIBIL_SCORE or dti > MAX_DTI:
+        return Assessment("not_eligible", 0.95, reasons, tips)
+
+    signals = {
+        "cibil": _interpolate(cibil_score, 500, 800),
+        "dti": -_interpolate(dti, 20, 70),
+    }
+    if history_rate is not None:
+        signals["history"] = 2 * history_rate - 1
+    total_weight = sum(WEIGHTS[name] for name in signals)
+    score = sum(WEIGHTS[name] * value for name, value in signals.items()) / total_weight
+
+    confidence = round(0.5 + abs(score) / 2, 3)
+    if confidence < threshold:
+        return Assessment("borderline", confidence, reasons, tips)
+    return Assessment("eligible" if score > 0 else "not_eligible", confidence, reasons, tips)
+
+
+# Per-analysis [rules, llm] counts behind the loan_llm_skip_ratio gauge
+_paths = {}
+_paths_lock = threading.Lock()
+
+
+def record_path(analysis, used_rules):
+    """Counts whether a request was answered by the rules or by the LLM."""
+    metrics.inc("loan_decisions_total", analysis=analysis, path="rules" if used_rules else "llm")
+    with _paths_lock:
+        counts = _paths.setdefault(analysis, [0, 0])
+        counts[0 if used_rules else 1] += 1
+        ratio = counts[0] / (counts[0] + counts[1])
+    metrics.set_gauge("loan_llm_skip_ratio", ratio, analysis=analysis)
+
+
+def fast_path_ratio(analysis=None):
+    """Fraction of loan requests answered without calling the LLM."""
+    with _paths_lock:
+        counts = [_paths.get(analysis, [0, 0])] if analysis else list(_paths.values())
+        rules = sum(count[0] for count in counts)
+        total = rules + sum(count[1] for count in counts)
+    return rules / total if total else 0.0
+
+
+def eligibility_message(assessment, cibil_score, dti, history_rate=None):
+    """Templated answer for a clear-cut eligibility check (≤100 words)."""
+    history = ""
+    if history_rate is not None:
+        history = f" {round(history_rate * 100)}% of similar past applicants were approved."
+
+    if assessment.decision == "eligible":
+        return (
+            f"You are likely eligible for a loan. Your CIBIL score of {cibil_score} and "
+            f"debt-to-income ratio of {dti}% are within what lenders look for.{history} "
+            "To get the best rate, keep card utilisation low and avoid new credit enquiries before applying."
+        )
+    return (
+        f"A loan is unlikely to be approved right now: {'; '.join(assessment.reasons) or 'your profile is high risk'}."
+        f"{history} To improve your chances, {' and '.join(assessment.tips) or 'reduce expenses and build your credit history'}."
+    )
+
+
+def insights_message(assessment, cibil_score, loan_amount, emi, dti):
+    """Templated answer for a clear-cut insights request (≤100 words)."""
+    summary = f"For a loan of Rs.{loan_amount}, your EMI would be Rs.{emi} per month, a debt-to-income ratio of {dti}%."
+    if assessment.decision == "eligible":
+        return (
+            f"{summary} With a CIBIL score of {cibil_score}, this loan looks affordable and is likely to be approved. "
+            "Keep an emergency fund of 3-6 EMIs and consider prepaying when you can to cut total interest."
+        )
+    return (
+        f"{summary} This loan looks risky: {'; '.join(assessment.reasons) or 'your profile is high risk'}. "
+        f"To improve eligibility, {' and '.join(assessment.tips) or 'reduce expenses or choose a longer tenure'}."
+    )
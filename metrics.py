@@ -0,0 +1,189 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Default histogram buckets (seconds), tuned for network-bound pipeline stages
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Histogram fed by stage(): per-message steps (download, convert, transcribe, detect, gemini, tts, s3, twilio)
+STAGE_METRIC = "stage_seconds"
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Histogram:
+    """Fixed-bucket histogram that also tracks count and sum."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q):
+        """Estimates the q-quantile (0..1) by interpolating within its bucket; None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        # Falls in the +Inf bucket: the largest finite bound is the best estimate
+        return lower
+
+    def snapshot(self):
+        return {
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+            "count": self.count,
+            "sum": self.total,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+def inc(name, amount=1, **labels):
+    """Increments a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """Sets a gauge to the given value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Records a value in a histogram, creating it on first use."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+@contextmanager
+def timer(name, buckets=DEFAULT_BUCKETS, **labels):
+    """Observes the duration of the with-block in a histogram (also when it raises)."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start, buckets, **labels)
+
+
+def stage(name):
+    """Times one pipeline stage: with metrics.stage("tts"): ..."""
+    return timer(STAGE_METRIC, stage=name)
+
+
+def quantile(name, q, **labels):
+    """Estimated q-quantile of a histogram, or None if it has no observations."""
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        return histogram.quantile(q) if histogram is not None else None
+
+
+def stage_percentiles():
+    """Returns {stage: {"count", "p50", "p99"}} for every timed stage."""
+    with _lock:
+        stages = {dict(labels).get("stage"): h for (name, labels), h in _histograms.items() if name == STAGE_METRIC}
+        return {
+            stage_name: {"count": h.count, "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+            for stage_name, h in stages.items()
+        }
+
+
+def snapshot():
+    """Returns a point-in-time copy of all counters, gauges and histograms."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {key: h.snapshot() for key, h in _histograms.items()},
+        }
+
+
+def reset():
+    """Clears all recorded metrics."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """Renders every metric in the Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted(
+            ((key, h.buckets, list(h.counts), h.count, h.total) for key, h in _histograms.items()),
+            key=lambda item: item[0]
+        )
+
+    lines = []
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        current = None
+        for (name, labels), value in series:
+            if name != current:
+                lines.append(f"# TYPE {name} {kind}")
+                current = name
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    current = None
+    for (name, labels), buckets, counts, count, total in histograms:
+        if name != current:
+            lines.append(f"# TYPE {name} histogram")
+            current = name
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = _format_value(float(bound))
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,24 @@
+-- Indexes for db_connector.fetch_similar_loans.
+--
+-- The lookup filters on a window around all three columns at once
+-- (income_annum ± 1,000,000, expenses ± 500,000, cibil_score ± 50) and then
+-- ranks the matches by normalized distance.
+--
+-- * The GiST index (via btree_gist) prunes on all three ranges together, so the
+--   rows visited stay proportional to the window, not the table.
+-- * The B-tree index is the fallback where btree_gist can't be installed. It seeks
+--   on the narrow cibil_score window, and INCLUDE makes the scan index-only.
+--
+-- CREATE INDEX CONCURRENTLY can't run inside a transaction block, so apply this
+-- file statement by statement, for example:
+--   psql -h $POSTGRES_HOST -U postgres -d my_database -f migrations/001_similar_loans_indexes.sql
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS my_table_similar_loans_gist
+    ON my_table USING gist (income_annum, expenses, cibil_score);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS my_table_cibil_income_expenses_idx
+    ON my_table (cibil_score, income_annum, expenses) INCLUDE (loan_status);
+
+ANALYZE my_table;
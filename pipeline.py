@@ -0,0 +1,146 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import app_logging
+import metrics
+
+log = app_logging.get_logger("pipeline")
+
+
+class Stage:
+    """One named step of a pipeline and the stages whose results it consumes."""
+
+    def __init__(self, name, fn, deps=(), background=False):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.background = background
+
+
+class PipelineRun:
+    """Futures and timings for one execution of a Pipeline."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.started_at = time.monotonic()
+        self.futures = {name: Future() for name in pipeline.stages}
+        self.timings = {}  # name -> (start offset, end offset) in seconds
+        self._lock = threading.Lock()
+
+    def result(self, name, timeout=None):
+        """Waits for a stage and returns its result (re-raising its exception)."""
+        return self.futures[name].result(timeout=timeout)
+
+    def wait(self, timeout=None):
+        """Waits for every foreground stage. Background stages keep running."""
+        for name, stage in self.pipeline.stages.items():
+            if not stage.background:
+                self.futures[name].exception(timeout=timeout)
+
+    def critical_path(self, target=None):
+        """
+        Returns [(stage, seconds), ...] along the chain of latest-finishing dependencies.
+
+        :param target: Stage to trace back from (default: the last foreground stage to finish)
+        """
+        with self._lock:
+            timings = dict(self.timings)
+        if target is None:
+            finished = [name for name, stage in self.pipeline.stages.items()
+                        if not stage.background and name in timings]
+            if not finished:
+                return []
+            target = max(finished, key=lambda name: timings[name][1])
+
+        path = []
+        name = target
+        while name is not None and name in timings:
+            start, end = timings[name]
+            path.append((name, end - start))
+            deps = [dep for dep in self.pipeline.stages[name].deps if dep in timings]
+            name = max(deps, key=lambda dep: timings[dep][1]) if deps else None
+        return list(reversed(path))
+
+    def _record(self, name, start, end):
+        with self._lock:
+            self.timings[name] = (start - self.started_at, end - self.started_at)
+            done = len(self.timings) == len(self.futures)
+        metrics.observe("pipeline_stage_seconds", end - start, pipeline=self.pipeline.name, stage=name)
+        if done:
+            total = max(end for _, end in self.timings.values())
+            metrics.observe("pipeline_seconds", total, pipeline=self.pipeline.name)
+            summary = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in self.critical_path())
+            log.info("pipeline_finished", sampled=True, pipeline=self.pipeline.name, seconds=round(total, 3), critical_path=summary)
+
+
+class Pipeline:
+    """
+    A small dependency graph of stages run on a shared executor.
+
+    Each stage is called with its dependencies' results as positional arguments and is
+    submitted as soon as they are available, so independent stages run concurrently.
+    If a dependency fails, the stages depending on it fail with the same exception.
+    Background stages can run on their own executor so slow side work never holds up
+    the foreground stages of later runs; nobody waits on them, so their failures are logged.
+    """
+
+    def __init__(self, executor, name="pipeline", background_executor=None):
+        self.executor = executor
+        self.background_executor = background_executor or executor
+        self.name = name
+        self.stages = {}
+
+    def add(self, name, fn, deps=(), background=False):
+        """Adds a stage. Dependencies must already have been added."""
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = Stage(name, fn, deps, background)
+        return self
+
+    def run(self):
+        """Starts every stage whose dependencies are met and returns the PipelineRun."""
+        run = PipelineRun(self)
+        remaining = {name: len(stage.deps) for name, stage in self.stages.items()}
+        lock = threading.Lock()
+
+        def execute(stage):
+            future = run.futures[stage.name]
+            start = time.monotonic()
+            result = error = None
+            try:
+                args = [run.futures[dep].result() for dep in stage.deps]
+                result = stage.fn(*args)
+            except Exception as e:
+                error = e
+                if stage.background:
+                    log.exception("stage_failed", pipeline=self.name, stage=stage.name, error=str(e))
+            # Record the timing before waking anyone waiting on this stage
+            run._record(stage.name, start, time.monotonic())
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def on_done(_future, finished):
+            ready = []
+            with lock:
+                for stage in self.stages.values():
+                    if finished in stage.deps:
+                        remaining[stage.name] -= 1
+                        if remaining[stage.name] == 0:
+                            ready.append(stage)
+            for stage in ready:
+                submit(stage)
+
+        def submit(stage):
+            executor = self.background_executor if stage.background else self.executor
+            executor.submit(execute, stage)
+
+        for name in self.stages:
+            run.futures[name].add_done_callback(lambda future, name=name: on_done(future, name))
+        for stage in self.stages.values():
+            if not stage.deps:
+                submit(stage)
+        return run
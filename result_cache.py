@@ -0,0 +1,306 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import app_logging
+import metrics
+
+log = app_logging.get_logger("result_cache")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")  # "memory" or "sqlite"
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))  # Seconds
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join(BASE_DIR, "result_cache.sqlite3"))
+# Round inputs to each cache's bucket sizes so near-identical requests share an entry
+RESULT_CACHE_BUCKETING = os.getenv("RESULT_CACHE_BUCKETING", "").lower() in ("1", "true", "yes")
+
+
+def bucket(value, step):
+    """Rounds a number to the nearest multiple of step."""
+    if not step or not isinstance(value, (int, float)):
+        return value
+    rounded = round(value / step) * step
+    return int(rounded) if isinstance(value, int) else rounded
+
+
+class MemoryBackend:
+    """Per-process LRU with per-entry expiry."""
+
+    blocking = False  # Safe to call from an event loop
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, version, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl, version):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.inc("result_cache_evictions_total", backend="memory")
+
+    def purge_versions(self, namespace, keep_version):
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if key.startswith(f"{namespace}:") and entry[1] != keep_version]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """On-disk cache shared by every worker process on the host; survives restarts. Values are stored as JSON."""
+
+    blocking = True  # Disk I/O and file locks; async callers use a thread
+
+    def __init__(self, path=RESULT_CACHE_PATH, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, version TEXT, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+
+    def _connect(self):
+        # One connection per thread and process (a forked gunicorn worker must not reuse its parent's)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT expires_at, version, value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[0] < now:
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        try:
+            value = json.loads(row[2])
+        except ValueError:
+            # Not JSON (e.g. a row pickled by an older release): never unpickle a shared file, just miss
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0], row[1], value
+
+    def set(self, key, value, ttl, version):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO results (key, value, version, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, json.dumps(value), version, now + ttl, now)
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._trim(conn, now)
+
+    def _trim(self, conn, now):
+        conn.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+        cursor = conn.execute(
+            "DELETE FROM results WHERE key IN ("
+            "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        if cursor.rowcount > 0:
+            metrics.inc("result_cache_evictions_total", cursor.rowcount, backend="sqlite")
+
+    def purge_versions(self, namespace, keep_version):
+        cursor = self._connect().execute(
+            "DELETE FROM results WHERE key LIKE ? AND version IS NOT ?",
+            (f"{namespace}:%", keep_version)
+        )
+        return cursor.rowcount
+
+    def clear(self):
+        self._connect().execute("DELETE FROM results")
+
+
+def create_backend(name=RESULT_CACHE_BACKEND):
+    """Builds a cache backend by name."""
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unknown result cache backend: {name}")
+
+
+_default_backend = None
+_default_backend_lock = threading.Lock()
+
+
+def default_backend():
+    """Returns the backend shared by every ResultCache that doesn't get its own."""
+    global _default_backend
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = create_backend()
+        return _default_backend
+
+
+class ResultCache:
+    """
+    TTL + LRU cache for expensive analysis results.
+
+    Keys combine the namespace, the prompt template version and the (optionally
+    bucketed) call arguments, so bumping the template version invalidates old answers.
+
+    :param derived: Names of arguments computed from the others (e.g. rows fetched for
+        them); they are left out of the key and passed as None when bucketing changed
+        the other arguments, so the cached function recomputes them
+    """
+
+    def __init__(self, namespace, template_version="1", buckets=None, ttl=RESULT_CACHE_TTL, backend=None,
+                 derived=()):
+        self.namespace = namespace
+        self.template_version = str(template_version)
+        self.buckets = buckets or {}
+        self.ttl = ttl
+        self.derived = tuple(derived)
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend or default_backend()
+
+    def canonical(self, arguments):
+        """Returns the arguments as the cache sees them: bucketed when RESULT_CACHE_BUCKETING is on."""
+        if RESULT_CACHE_BUCKETING:
+            return {name: bucket(value, self.buckets.get(name)) for name, value in arguments.items()}
+        return dict(arguments)
+
+    def key(self, arguments):
+        """Builds the cache key for a dict of argument names to values."""
+        material = json.dumps([self.template_version, self.canonical(arguments)], sort_keys=True, default=str)
+        return f"{self.namespace}:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+    def _lookup(self, key):
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            log.warning("result_cache_read_failed", cache=self.namespace, error=str(e))
+            entry = None
+        metrics.inc("result_cache_total", cache=self.namespace, result="miss" if entry is None else "hit")
+        return entry
+
+    def _store(self, key, value):
+        try:
+            self.backend.set(key, value, self.ttl, self.template_version)
+        except Exception as e:
+            log.warning("result_cache_write_failed", cache=self.namespace, error=str(e))
+
+    def get_or_compute(self, arguments, compute):
+        """Returns the cached result for these arguments, computing and storing it on a miss."""
+        key = self.key(arguments)
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry[2]
+        value = compute()
+        self._store(key, value)
+        return value
+
+    async def get_or_compute_async(self, arguments, compute):
+        """Like get_or_compute, with compute returning an awaitable."""
+        key = self.key(arguments)
+        entry = await self._off_loop(self._lookup, key)
+        if entry is not None:
+            return entry[2]
+        value = await compute()
+        await self._off_loop(self._store, key, value)
+        return value
+
+    async def _off_loop(self, func, *args):
+        # A SQLite backend would stall the event loop on disk I/O or another process's write lock
+        if self.backend.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def cached(self, func):
+        """
+        Decorator caching func's results by its bound arguments.
+
+        With bucketing on, func is called with the bucketed arguments, so an entry shared
+        by every caller in a bucket holds nothing specific to any one of them.
+        """
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound, keyed = self._bind(signature, args, kwargs)
+            return self.get_or_compute(keyed, lambda: func(*bound.args, **bound.kwargs))
+
+        wrapper.cache = self
+        return wrapper
+
+    def cached_async(self, func):
+        """Decorator caching a coroutine function's results by its bound arguments."""
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound, keyed = self._bind(signature, args, kwargs)
+            return await self.get_or_compute_async(keyed, lambda: func(*bound.args, **bound.kwargs))
+
+        wrapper.cache = self
+        return wrapper
+
+    def _bind(self, signature, args, kwargs):
+        # Returns the call's bound arguments, rewritten to the (bucketed) ones the key uses, and the keyed subset
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = {name: value for name, value in bound.arguments.items() if name not in self.derived}
+        keyed = self.canonical(arguments)
+        if keyed != arguments:
+            # Derived values belong to the caller's exact figures, not the bucket's
+            for name in self.derived:
+                bound.arguments[name] = None
+        bound.arguments.update(keyed)
+        return bound, keyed
+
+    def invalidate_other_versions(self):
+        """Deletes entries written under any other template version. Returns the count removed."""
+        return self.backend.purge_versions(self.namespace, self.template_version)
+
+    def stats(self):
+        """Returns hits, misses and hit ratio for this cache."""
+        counters = metrics.snapshot()["counters"]
+        hits = counters.get(("result_cache_total", (("cache", self.namespace), ("result", "hit"))), 0)
+        misses = counters.get(("result_cache_total", (("cache", self.namespace), ("result", "miss"))), 0)
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_ratio": hits / total if total else 0.0}
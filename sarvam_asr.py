@@ -0,0 +1,93 @@
+import os
+import time
+from dataclasses import dataclass, field
+
+import app_logging
+import http_client
+
+log = app_logging.get_logger("sarvam_asr")
+
+SARVAM_API_KEY = os.getenv("SARVAM_API_KEY")
+SARVAM_ASR_URL = os.getenv("SARVAM_ASR_URL", "https://api.sarvam.ai/speech-to-text")
+SARVAM_ASR_MODEL = os.getenv("SARVAM_ASR_MODEL", "saarika:v2")
+
+
+@dataclass
+class TranscriptionResult:
+    """Structured output of a speech-to-text call."""
+    transcript: str
+    language_code: str = None
+    confidence: float = None
+    timings: dict = field(default_factory=dict)
+
+
+def _form(wav_bytes, language_code, api_key):
+    # The API spells auto-detection "unknown"
+    if not language_code or language_code == "auto":
+        language_code = "unknown"
+    return {
+        "headers": {"api-subscription-key": api_key or SARVAM_API_KEY},
+        "files": {"file": ("audio.wav", wav_bytes, "audio/wav")},
+        "data": {"model": SARVAM_ASR_MODEL, "language_code": language_code},
+    }
+
+
+def _parse(response, start, request_seconds):
+    if response.status_code != 200:
+        log.error("transcription_failed", status=response.status_code, body=response.text[:200])
+        return None
+
+    response_json = response.json()
+    transcript = (response_json.get("transcript") or "").strip()
+    if not transcript:
+        log.warning("transcription_empty")
+        return None
+
+    return TranscriptionResult(
+        transcript=transcript,
+        language_code=response_json.get("language_code"),
+        confidence=response_json.get("language_probability"),
+        timings={
+            "request": request_seconds,
+            "total": time.monotonic() - start,
+        }
+    )
+
+
+def transcribe_wav_bytes(wav_bytes, language_code="auto", api_key=None):
+    """
+    Transcribes in-memory WAV audio with the Sarvam speech-to-text API.
+
+    :param wav_bytes: 16kHz mono WAV file contents
+    :param language_code: BCP-47 code such as "hi-IN", or "auto" to let the API detect it
+    :param api_key: Sarvam key (default: SARVAM_API_KEY from the environment)
+    :return: TranscriptionResult, or None if the call failed
+    """
+    try:
+        start = time.monotonic()
+        response = http_client.post(
+            SARVAM_ASR_URL,
+            endpoint="sarvam.asr",
+            **_form(wav_bytes, language_code, api_key)
+        )
+        return _parse(response, start, time.monotonic() - start)
+    except Exception as e:
+        log.error("transcription_error", error=str(e))
+        return None
+
+
+async def transcribe_wav_bytes_async(wav_bytes, language_code="auto", api_key=None):
+    """Async counterpart of transcribe_wav_bytes (used by the ASGI app)."""
+    import async_http
+
+    try:
+        start = time.monotonic()
+        response = await async_http.post(
+            SARVAM_ASR_URL,
+            endpoint="sarvam.asr",
+            **_form(wav_bytes, language_code, api_key)
+        )
+        return _parse(response, start, time.monotonic() - start)
+    except Exception as e:
+        log.error("transcription_error", error=str(e))
+        return None
@@ -0,0 +1,235 @@
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+import metrics
+
+# Recent turns kept verbatim per user (in user/model pairs); older ones are folded into a running summary
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "12"))
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "1500"))  # Estimated tokens of history sent to Gemini
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "1200"))
+# Users with full turn history in memory; less recent users keep only a compressed summary
+SESSION_ACTIVE_USERS = int(os.getenv("SESSION_ACTIVE_USERS", "10000"))
+SESSION_IDLE_SUMMARY_CHARS = int(os.getenv("SESSION_IDLE_SUMMARY_CHARS", "400"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(512 * 1024 * 1024)))  # Cap for all sessions together
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))  # Seconds before a silent user is forgotten
+
+# Rough per-entry bookkeeping cost (dict slot, key string, object headers) used in the byte estimate
+_ENTRY_OVERHEAD = 200
+_TIMESTAMP = struct.Struct("<d")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for the history budget."""
+    return len(text) // 4 + 1
+
+
+class Turn:
+    """One message in a conversation."""
+
+    __slots__ = ("role", "text", "tokens")
+
+    def __init__(self, role, text):
+        self.role = role  # "user" or "model"
+        self.text = text
+        self.tokens = estimate_tokens(text)
+
+
+def fold_summary(summary, turns, max_chars=SESSION_SUMMARY_CHARS):
+    """
+    Appends turns to a running summary, keeping the most recent max_chars.
+
+    User turns carry the details people don't want to repeat (income, loan amounts),
+    so they are kept longer than the assistant's replies.
+    """
+    parts = [summary] if summary else []
+    for turn in turns:
+        if turn.role == "user":
+            parts.append(f"User: {turn.text[:300]}")
+        else:
+            parts.append(f"Assistant: {turn.text[:120]}")
+    folded = " | ".join(parts)
+    if len(folded) > max_chars:
+        folded = "..." + folded[-max_chars:]
+    return folded
+
+
+class Session:
+    """Recent user/model turns plus a summary of everything older."""
+
+    __slots__ = ("turns", "summary", "tokens", "last_seen")
+
+    def __init__(self, summary="", last_seen=None):
+        self.turns = deque()
+        self.summary = summary
+        self.tokens = estimate_tokens(summary) if summary else 0
+        self.last_seen = time.time() if last_seen is None else last_seen
+
+    def add_exchange(self, message, reply):
+        """
+        Appends a user message and its reply, folding the oldest exchanges into the summary
+        to stay within the budgets.
+
+        Turns are kept and folded in user/model pairs, so the history Gemini sees always
+        alternates user, model, user, ...
+        """
+        for turn in (Turn("user", message), Turn("model", reply)):
+            self.turns.append(turn)
+            self.tokens += turn.tokens
+        folded = []
+        while len(self.turns) > 2 and (len(self.turns) > SESSION_MAX_TURNS or self.tokens > SESSION_TOKEN_BUDGET):
+            for _ in range(2):
+                old = self.turns.popleft()
+                self.tokens -= old.tokens
+                folded.append(old)
+        if folded:
+            summary_tokens = estimate_tokens(self.summary) if self.summary else 0
+            self.summary = fold_summary(self.summary, folded)
+            self.tokens += estimate_tokens(self.summary) - summary_tokens
+        self.last_seen = time.time()
+
+    def history(self):
+        """Returns the conversation as Gemini start_chat history."""
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [f"Summary of our earlier conversation: {self.summary}"]})
+            history.append({"role": "model", "parts": ["Understood, I'll keep that in mind."]})
+        for turn in self.turns:
+            history.append({"role": turn.role, "parts": [turn.text]})
+        return history
+
+    def size(self):
+        """Approximate bytes held by this session."""
+        return (_ENTRY_OVERHEAD + sys.getsizeof(self.summary)
+                + sum(sys.getsizeof(turn.text) + 72 for turn in self.turns))
+
+    def compact(self):
+        """Serializes the session to a small compressed summary for the idle tier."""
+        summary = fold_summary(self.summary, self.turns, SESSION_IDLE_SUMMARY_CHARS)
+        return _TIMESTAMP.pack(self.last_seen) + zlib.compress(summary.encode("utf-8"))
+
+    @classmethod
+    def restore(cls, blob):
+        (last_seen,) = _TIMESTAMP.unpack_from(blob)
+        return cls(zlib.decompress(blob[_TIMESTAMP.size:]).decode("utf-8"), last_seen)
+
+
+class SessionStore:
+    """
+    Per-user conversation memory keyed by WhatsApp number, within a fixed memory cap.
+
+    The SESSION_ACTIVE_USERS most recent users keep their turns in memory. Less recent
+    users drop to an idle tier holding only a compressed summary (a few hundred bytes),
+    and the least recent idle users are forgotten once SESSION_MAX_BYTES is reached.
+    """
+
+    def __init__(self, active_users=SESSION_ACTIVE_USERS, max_bytes=SESSION_MAX_BYTES, ttl=SESSION_TTL):
+        self.active_users = active_users
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._active = OrderedDict()  # user -> Session
+        self._idle = OrderedDict()  # user -> compressed summary bytes
+        self._active_bytes = 0
+        self._idle_bytes = 0
+        self._lock = threading.Lock()
+
+    def _checkout(self, user):
+        # Caller holds the lock; returns the user's live session, reviving an idle one
+        session = self._active.get(user)
+        if session is not None:
+            self._active_bytes -= session.size()
+        else:
+            blob = self._idle.pop(user, None)
+            if blob is not None:
+                self._idle_bytes -= _ENTRY_OVERHEAD + sys.getsizeof(blob)
+                session = Session.restore(blob)
+            if session is None or time.time() - session.last_seen > self.ttl:
+                session = Session()
+            self._active[user] = session
+        self._active.move_to_end(user)
+        return session
+
+    def _checkin(self, session):
+        self._active_bytes += session.size()
+        self._evict()
+
+    def _demote_oldest(self):
+        user, session = self._active.popitem(last=False)
+        self._active_bytes -= session.size()
+        blob = session.compact()
+        self._idle[user] = blob
+        self._idle_bytes += _ENTRY_OVERHEAD + sys.getsizeof(blob)
+        metrics.inc("session_evictions_total", tier="active")
+
+    def _evict(self):
+        while len(self._active) > self.active_users:
+            self._demote_oldest()
+        # Over the byte cap, forget the least recent idle users first (they are older than any active one)
+        while self._active_bytes + self._idle_bytes > self.max_bytes:
+            if self._idle:
+                _, blob = self._idle.popitem(last=False)
+                self._idle_bytes -= _ENTRY_OVERHEAD + sys.getsizeof(blob)
+                metrics.inc("session_evictions_total", tier="idle")
+            elif len(self._active) > 1:
+                self._demote_oldest()
+            else:
+                break
+        metrics.set_gauge("session_store_users", len(self._active), tier="active")
+        metrics.set_gauge("session_store_users", len(self._idle), tier="idle")
+        metrics.set_gauge("session_store_bytes", self._active_bytes + self._idle_bytes)
+
+    def history(self, user):
+        """Returns the user's start_chat history (empty for a new user)."""
+        with self._lock:
+            if user not in self._active and user not in self._idle:
+                return []
+            session = self._checkout(user)
+            history = session.history()
+            self._checkin(session)
+            return history
+
+    def record_exchange(self, user, message, reply):
+        """Stores a user message and the reply it got (nothing if it got none: history holds pairs)."""
+        if not reply:
+            return
+        with self._lock:
+            session = self._checkout(user)
+            session.add_exchange(message, reply)
+            self._checkin(session)
+
+    def clear(self, user):
+        """Forgets a user's conversation."""
+        with self._lock:
+            session = self._active.pop(user, None)
+            if session is not None:
+                self._active_bytes -= session.size()
+            blob = self._idle.pop(user, None)
+            if blob is not None:
+                self._idle_bytes -= _ENTRY_OVERHEAD + sys.getsizeof(blob)
+
+    def stats(self):
+        """Returns user counts per tier and the estimated memory in use."""
+        with self._lock:
+            return {
+                "active_users": len(self._active),
+                "idle_users": len(self._idle),
+                "bytes": self._active_bytes + self._idle_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the process-wide session store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
@@ -0,0 +1,205 @@
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import app_logging
+import metrics
+
+log = app_logging.get_logger("transcoder")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# At most this many ffmpeg processes run at once; extra conversions wait in the pool queue
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", str(os.cpu_count() or 2)))
+TRANSCODE_TIMEOUT = float(os.getenv("TRANSCODE_TIMEOUT", "30"))  # Seconds per conversion
+
+ASR_SAMPLE_RATE = 16000
+
+# Output settings for audio sent over WhatsApp: (ffmpeg args, content type, file extension)
+WHATSAPP_FORMATS = {
+    "mp3": (["-f", "mp3", "-c:a", "libmp3lame", "-b:a", "64k"], "audio/mpeg", "mp3"),
+    "ogg": (["-f", "ogg", "-c:a", "libopus", "-b:a", "32k"], "audio/ogg", "ogg"),
+}
+
+_executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="transcode")
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def find_ffmpeg():
+    """Locates the ffmpeg binary once per process. Returns its path or None."""
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+
+    # Common Windows ffmpeg locations
+    potential_paths = [
+        r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
+        r"C:\ffmpeg\bin\ffmpeg.exe",
+        r"C:\ProgramData\chocolatey\bin\ffmpeg.exe",
+        os.path.join(BASE_DIR, "ffmpeg", "bin", "ffmpeg.exe"),
+        os.path.join(BASE_DIR, "ffmpeg.exe")
+    ]
+    for path in potential_paths:
+        if os.path.exists(path):
+            log.info("ffmpeg_found", path=path)
+            return path
+
+    log.warning("ffmpeg_not_found", hint="Install ffmpeg or add it to PATH (https://ffmpeg.org/download.html)")
+    return None
+
+
+def _track_pending(delta):
+    global _pending
+    with _pending_lock:
+        _pending += delta
+        metrics.set_gauge("transcode_queue_depth", _pending)
+
+
+def _run_ffmpeg(data, output_args, operation):
+    _track_pending(-1)
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        return None
+
+    command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", *output_args, "pipe:1"]
+    start = time.monotonic()
+    try:
+        process = subprocess.run(
+            command,
+            input=data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=TRANSCODE_TIMEOUT,
+            check=False
+        )
+    except subprocess.TimeoutExpired:
+        log.error("ffmpeg_timeout", operation=operation, timeout=TRANSCODE_TIMEOUT)
+        metrics.inc("transcode_total", operation=operation, status="timeout")
+        return None
+    finally:
+        metrics.observe("transcode_seconds", time.monotonic() - start, operation=operation)
+
+    if process.returncode != 0 or not process.stdout:
+        log.error("ffmpeg_failed", operation=operation, returncode=process.returncode,
+                  stderr=process.stderr.decode("utf-8", errors="replace")[:500])
+        metrics.inc("transcode_total", operation=operation, status="error")
+        return None
+
+    metrics.inc("transcode_total", operation=operation, status="ok")
+    return process.stdout
+
+
+def transcode(data, output_args, operation="transcode"):
+    """
+    Pipes bytes through ffmpeg on the bounded transcoding pool.
+
+    :param data: Input file contents (any container ffmpeg can read from a pipe)
+    :param output_args: ffmpeg output options, including "-f <format>"
+    :param operation: Label used for metrics
+    :return: Output bytes, or None on failure
+    """
+    _track_pending(1)
+    return _executor.submit(_run_ffmpeg, data, output_args, operation).result()
+
+
+def pcm_to_wav(pcm_bytes, sample_rate=ASR_SAMPLE_RATE, channels=1, sample_width=2):
+    """Wraps raw PCM samples in a WAV container, in memory."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm_bytes)
+    return buffer.getvalue()
+
+
+def is_wav(data):
+    """Returns True if the bytes start with a RIFF/WAVE header."""
+    return data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def resample_wav(data, sample_rate=ASR_SAMPLE_RATE):
+    """
+    Pure-Python mono downmix and linear-interpolation resample of 16-bit PCM WAV.
+
+    :return: WAV bytes at the requested rate, or None if the input isn't 16-bit PCM
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav_file:
+            channels = wav_file.getnchannels()
+            width = wav_file.getsampwidth()
+            rate = wav_file.getframerate()
+            frames = wav_file.readframes(wav_file.getnframes())
+    except (wave.Error, EOFError) as e:
+        log.debug("not_pcm_wav", error=str(e))
+        return None
+
+    if width != 2:
+        return None
+    if channels == 1 and rate == sample_rate:
+        return data
+
+    samples = array("h")
+    samples.frombytes(frames)
+    if channels > 1:
+        samples = array("h", (
+            sum(samples[i:i + channels]) // channels
+            for i in range(0, len(samples) - channels + 1, channels)
+        ))
+
+    if rate != sample_rate and len(samples) > 1:
+        out_len = max(1, int(len(samples) * sample_rate / rate))
+        step = rate / sample_rate
+        last = len(samples) - 1
+        resampled = array("h", bytes(2 * out_len))
+        for i in range(out_len):
+            position = i * step
+            index = int(position)
+            if index >= last:
+                resampled[i] = samples[last]
+                continue
+            fraction = position - index
+            resampled[i] = int(samples[index] + (samples[index + 1] - samples[index]) * fraction)
+        samples = resampled
+
+    return pcm_to_wav(samples.tobytes(), sample_rate=sample_rate)
+
+
+def to_asr_wav(data):
+    """Converts any input audio to 16kHz mono 16-bit WAV bytes for speech-to-text."""
+    if is_wav(data):
+        start = time.monotonic()
+        wav_bytes = resample_wav(data)
+        if wav_bytes is not None:
+            metrics.observe("transcode_seconds", time.monotonic() - start, operation="resample")
+            return wav_bytes
+
+    pcm = transcode(
+        data,
+        ["-ar", str(ASR_SAMPLE_RATE), "-ac", "1", "-f", "s16le", "-c:a", "pcm_s16le"],
+        operation="to_wav"
+    )
+    # ffmpeg can't seek back on a pipe to fill in the WAV header, so add it here
+    return pcm_to_wav(pcm) if pcm else None
+
+
+def encode_for_whatsapp(wav_bytes, audio_format="mp3"):
+    """
+    Encodes WAV audio into a format WhatsApp can play.
+
+    :return: (audio bytes, content type, file extension), or None if encoding failed
+    """
+    output_args, content_type, extension = WHATSAPP_FORMATS[audio_format]
+    encoded = transcode(wav_bytes, output_args, operation=f"to_{extension}")
+    if encoded is None:
+        return None
+    return encoded, content_type, extension
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import app_logging
+import http_client
+import metrics
+
+log = app_logging.get_logger("translation_service")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SARVAM_API_KEY = os.getenv("SARVAM_API_KEY")
+SARVAM_TRANSLATE_URL = os.getenv("SARVAM_TRANSLATE_URL", "https://api.sarvam.ai/translate")
+
+# Concurrent requests for one language pair wait this long to share an API call
+TRANSLATION_BATCH_WINDOW = float(os.getenv("TRANSLATION_BATCH_WINDOW_MS", "15")) / 1000
+TRANSLATION_BATCH_MAX = int(os.getenv("TRANSLATION_BATCH_MAX", "16"))  # Texts per API call
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", os.path.join(BASE_DIR, "translations.sqlite3"))
+TRANSLATION_PRECOMPUTE = os.getenv("TRANSLATION_PRECOMPUTE", "true").lower() in ("1", "true", "yes")
+
+
+def api_language(language_code):
+    """The translate API takes base codes: "hi-IN" -> "hi"."""
+    return language_code.split("-")[0]
+
+
+def phrase_key(text, source, target):
+    """Content hash identifying one translation."""
+    material = "\x1f".join([text, api_language(source), api_language(target)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def request_translations(texts, source, target):
+    """
+    Translates several texts in one Sarvam API call.
+
+    :return: List of translations in input order, or None if the call failed
+    """
+    payload = {
+        "inputs": list(texts),
+        "source_language_code": api_language(source),
+        "target_language_code": api_language(target)
+    }
+    headers = {
+        "Content-Type": "application/json",
+        "api-subscription-key": SARVAM_API_KEY
+    }
+    try:
+        metrics.observe("translation_batch_size", len(texts))
+        response = http_client.post(SARVAM_TRANSLATE_URL, endpoint="sarvam.translate", headers=headers, json=payload)
+        if response.status_code != 200:
+            log.error("translation_failed", status=response.status_code, body=response.text[:200])
+            return None
+
+        translated_texts = response.json().get("translated_texts") or []
+        if len(translated_texts) != len(texts):
+            log.warning("translation_empty", target=payload["target_language_code"], expected=len(texts),
+                        received=len(translated_texts))
+            return None
+        return translated_texts
+    except Exception as e:
+        log.error("translation_error", error=str(e))
+        return None
+
+
+class PhraseCache:
+    """Persistent translations of static strings (help text, canned replies), mirrored in memory."""
+
+    def __init__(self, path=TRANSLATION_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, target TEXT NOT NULL, text TEXT NOT NULL)"
+        )
+        # Static strings are few, so every worker keeps all of them in memory
+        self._memory = dict(self._conn.execute("SELECT key, text FROM translations"))
+
+    def get(self, text, source, target, memory_only=False):
+        key = phrase_key(text, source, target)
+        translation = self._memory.get(key)
+        if translation is None and not memory_only:
+            # Another worker may have translated it since we loaded
+            with self._lock:
+                row = self._conn.execute("SELECT text FROM translations WHERE key = ?", (key,)).fetchone()
+            if row:
+                translation = self._memory[key] = row[0]
+        metrics.inc("translation_cache_total", result="hit" if translation is not None else "miss")
+        return translation
+
+    def put(self, text, source, target, translation):
+        key = phrase_key(text, source, target)
+        self._memory[key] = translation
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, target, text) VALUES (?, ?, ?)",
+                (key, api_language(target), translation)
+            )
+
+    def __len__(self):
+        return len(self._memory)
+
+
+class _Batch:
+    __slots__ = ("texts", "positions", "full", "done", "results")
+
+    def __init__(self):
+        self.texts = []
+        self.positions = {}  # text -> index, so repeated texts are sent once
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+
+    def add(self, text):
+        index = self.positions.get(text)
+        if index is None:
+            index = self.positions[text] = len(self.texts)
+            self.texts.append(text)
+        return index
+
+
+class TranslationBatcher:
+    """
+    Coalesces concurrent translations for one language pair into a single API call.
+
+    The first request for a pair opens a batch and waits up to window seconds (less if
+    the batch fills up) for others to join; then every text goes out in one "inputs" list.
+    Failed calls return the original texts, as the single-text path always did.
+    """
+
+    def __init__(self, send=request_translations, window=TRANSLATION_BATCH_WINDOW, max_size=TRANSLATION_BATCH_MAX):
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self._open = {}  # (source, target) -> _Batch still accepting texts
+        self._lock = threading.Lock()
+
+    def translate(self, text, source, target):
+        pair = (api_language(source), api_language(target))
+        with self._lock:
+            batch = self._open.get(pair)
+            leader = batch is None
+            if leader:
+                batch = self._open[pair] = _Batch()
+            index = batch.add(text)
+            if len(batch.texts) >= self.max_size:
+                del self._open[pair]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(pair) is batch:
+                    del self._open[pair]
+            self._flush(batch, source, target)
+        else:
+            batch.done.wait()
+        return batch.results[index]
+
+    def _flush(self, batch, source, target):
+        try:
+            results = self.send(batch.texts, source, target)
+        except Exception as e:
+            log.error("translation_error", error=str(e))
+            results = None
+        batch.results = results or batch.texts
+        batch.done.set()
+
+
+batcher = TranslationBatcher()
+
+_phrase_cache = None
+_phrase_cache_lock = threading.Lock()
+
+
+def phrase_cache():
+    """Returns the shared phrase cache, opening it on first use."""
+    global _phrase_cache
+    with _phrase_cache_lock:
+        if _phrase_cache is None:
+            _phrase_cache = PhraseCache()
+        return _phrase_cache
+
+
+def lookup(text, source, target, memory_only=False):
+    """
+    Returns the cached translation of a static string, or None.
+
+    :param memory_only: Skip the SQLite read on a memory miss (for event-loop callers)
+    """
+    if api_language(source) == api_language(target):
+        return text
+    return phrase_cache().get(text, source, target, memory_only)
+
+
+def translate(text, source="en", target="hi-IN", static=False):
+    """
+    Translates text, sharing the API call with concurrent requests for the same pair.
+
+    :param static: The text is a fixed system string; serve it from (and save it to) the phrase cache
+    :return: The translation, or the original text if the API failed
+    """
+    if api_language(source) == api_language(target):
+        return text
+    if static:
+        cached = phrase_cache().get(text, source, target)
+        if cached is not None:
+            return cached
+
+    translation = batcher.translate(text, source, target)
+    if static and translation != text:
+        phrase_cache().put(text, source, target, translation)
+    return translation
+
+
+def precompute(phrases, languages, source="en"):
+    """
+    Fills the phrase cache with every static phrase in every language.
+
+    Missing phrases are sent TRANSLATION_BATCH_MAX at a time, so a cold start costs a
+    few API calls per language and a warm one costs none.
+
+    :return: Number of translations added
+    """
+    cache = phrase_cache()
+    added = 0
+    for target in languages:
+        if api_language(target) == api_language(source):
+            continue
+        missing = [phrase for phrase in dict.fromkeys(phrases) if cache.get(phrase, source, target) is None]
+        for start in range(0, len(missing), TRANSLATION_BATCH_MAX):
+            chunk = missing[start:start + TRANSLATION_BATCH_MAX]
+            translations = request_translations(chunk, source, target)
+            if translations is None:
+                break
+            for phrase, translation in zip(chunk, translations):
+                cache.put(phrase, source, target, translation)
+                added += 1
+    metrics.set_gauge("translation_cache_entries", len(cache))
+    log.info("translations_precomputed", added=added, entries=len(cache))
+    return added
+
+
+def start_precompute(phrases, languages, source="en"):
+    """Runs precompute in a background thread so startup isn't held up by the API."""
+    thread = threading.Thread(
+        target=precompute, args=(list(phrases), list(languages), source),
+        name="translation-precompute", daemon=True
+    )
+    thread.start()
+    return thread
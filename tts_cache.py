@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+TTS_CACHE_INDEX_PATH = os.getenv("TTS_CACHE_INDEX_PATH", os.path.join(BASE_DIR, "tts_cache.sqlite3"))
+
+
+def cache_key(text, language_code, speaker, model, sample_rate):
+    """Content hash identifying one synthesized clip."""
+    material = "\x1f".join([text, language_code, speaker, model, str(sample_rate)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class AudioLRU:
+    """In-memory LRU of audio bytes, capped by total size rather than entry count."""
+
+    def __init__(self, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        metrics.inc("tts_cache_total", layer="audio", result="hit" if data is not None else "miss")
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                metrics.inc("tts_cache_evictions_total")
+            metrics.set_gauge("tts_cache_bytes", self.size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class UrlIndex:
+    """Persistent map from clip hash to the public URL it was uploaded to."""
+
+    def __init__(self, path=TTS_CACHE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tts_urls (key TEXT PRIMARY KEY, url TEXT NOT NULL, content_type TEXT)"
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT url FROM tts_urls WHERE key = ?", (key,)).fetchone()
+        metrics.inc("tts_cache_total", layer="url", result="hit" if row else "miss")
+        return row[0] if row else None
+
+    def put(self, key, url, content_type=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tts_urls (key, url, content_type) VALUES (?, ?, ?)",
+                (key, url, content_type)
+            )
+
+
+audio_cache = AudioLRU()
+
+_url_index = None
+_url_index_lock = threading.Lock()
+
+
+def url_index():
+    """Returns the shared URL index, opening it on first use."""
+    global _url_index
+    with _url_index_lock:
+        if _url_index is None:
+            _url_index = UrlIndex()
+        return _url_index
+
+
+def stats():
+    """Returns hit/miss/eviction counters and the current audio cache size."""
+    counters = metrics.snapshot()["counters"]
+    result = {"audio_bytes": audio_cache.size, "evictions": 0}
+    for (name, labels), value in counters.items():
+        labels = dict(labels)
+        if name == "tts_cache_total":
+            result[f"{labels['layer']}_{labels['result']}"] = value
+        elif name == "tts_cache_evictions_total":
+            result["evictions"] = value
+    return result